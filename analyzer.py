@@ -0,0 +1,185 @@
+import functools
+from typing import Callable, Iterable, Iterator, Optional
+
+# Maximum number of tokens whose stem is cached.
+STEM_CACHE_SIZE = 2**16
+
+# Common English words which carry little meaning but have the longest
+# posting lists.
+STOPWORDS = frozenset("""
+    a about above after again against all am an and any are aren't as at be
+    because been before being below between both but by can can't cannot could
+    couldn't did didn't do does doesn't doing don't down during each few for
+    from further had hadn't has hasn't have haven't having he he'd he'll he's
+    her here here's hers herself him himself his how how's i i'd i'll i'm i've
+    if in into is isn't it it's its itself let's me more most mustn't my
+    myself no nor not of off on once only or other ought our ours ourselves
+    out over own same shan't she she'd she'll she's should shouldn't so some
+    such than that that's the their theirs them themselves then there there's
+    these they they'd they'll they're they've this those through to too under
+    until up very was wasn't we we'd we'll we're we've were weren't what
+    what's when when's where where's which while who who's whom why why's with
+    won't would wouldn't you you'd you'll you're you've your yours yourself
+    yourselves
+    """.split())
+
+# Biwords, pairs of consecutive tokens, are indexed as terms of their own with
+# both tokens joined by this separator. Tokens never contain whitespace, so a
+# biword never collides with a token.
+BIWORD_SEPARATOR = " "
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def light_stem(token: str) -> str:
+    """
+    Light stemmer which only removes plural endings (S-stemmer by Harman).
+    Only the first matching rule is applied.
+    """
+    if token.endswith("ies") and not token.endswith(("eies", "aies")):
+        return token[:-3] + "y"
+    if token.endswith("es") and not token.endswith(("aes", "ees", "oes")):
+        return token[:-1]
+    if token.endswith("s") and not token.endswith(("us", "ss")):
+        return token[:-1]
+    return token
+
+
+def biword(first: str, second: str) -> str:
+    """Returns the term under which the biword of `first` and `second` is stored."""
+    return first + BIWORD_SEPARATOR + second
+
+
+def is_biword(term: str) -> bool:
+    """Returns whether the index term `term`, optionally in a field, is a biword."""
+    return BIWORD_SEPARATOR in term
+
+
+def _filter_length(min_length: int, max_length: Optional[int], token: str):
+    if len(token) < min_length or (max_length is not None and len(token) > max_length):
+        return None
+    return token
+
+
+def _remove_stopword(token: str) -> Optional[str]:
+    return None if token in STOPWORDS else token
+
+
+class Analyzer:
+    """
+    Chain of stages which is applied to the tokens of documents and queries.
+
+    Every stage maps a token to a new token or to `None` to remove it. The
+    stages run in the order length filter, stopword removal, stemming; an
+    analyzer without stages returns the tokens unchanged.
+
+    If `biwords` is set, every pair of consecutive analyzed tokens of a
+    document is indexed as an additional term at the position of its first
+    token. A phrase is then looked up by its biwords instead of by all of its
+    terms, so a phrase of two terms is a single posting list. Indexing and
+    querying must use the same analyzer, so its configuration is stored with
+    the index.
+    """
+
+    def __init__(
+        self,
+        stopwords: bool = False,
+        stem: bool = False,
+        min_length: int = 1,
+        max_length: Optional[int] = None,
+        biwords: bool = False,
+    ):
+        self.stopwords = stopwords
+        self.stem = stem
+        self.min_length = min_length
+        self.max_length = max_length
+        self.biwords = biwords
+
+        self.stages: list[tuple[str, Callable[[str], Optional[str]]]] = []
+        if min_length > 1 or max_length is not None:
+            self.stages.append(
+                ("length", functools.partial(_filter_length, min_length, max_length))
+            )
+        if stopwords:
+            self.stages.append(("stopwords", _remove_stopword))
+        if stem:
+            self.stages.append(("stem", light_stem))
+
+    def __repr__(self):
+        stages = " -> ".join(name for name, _ in self.stages) or "none"
+        return f"{stages} + biwords" if self.biwords else stages
+
+    @staticmethod
+    def from_config(config: dict) -> "Analyzer":
+        return Analyzer(**config)
+
+    def to_config(self) -> dict:
+        return {
+            "stopwords": self.stopwords,
+            "stem": self.stem,
+            "min_length": self.min_length,
+            "max_length": self.max_length,
+            "biwords": self.biwords,
+        }
+
+    def analyze_term(self, term: str) -> Optional[str]:
+        """
+        Returns the term that is stored in the index for `term` or `None` if
+        the term is removed.
+        """
+        for _, stage in self.stages:
+            term = stage(term)
+            if term is None:
+                return None
+        return term
+
+    def analyze(self, tokens: Iterable[tuple[str, int]]) -> Iterator[tuple[str, int]]:
+        """
+        Applies all stages to the (token, position) pairs of the tokenizer.
+        The positions of the remaining tokens are renumbered, so phrases stay
+        consecutive when stopwords in between are removed.
+        """
+        if not self.stages:
+            return iter(tokens)
+        return self._analyze(tokens)
+
+    def _analyze(self, tokens: Iterable[tuple[str, int]]) -> Iterator[tuple[str, int]]:
+        position = 0
+        for token, _ in tokens:
+            token = self.analyze_term(token)
+            if token is not None:
+                yield token, position
+                position += 1
+
+    def index_tokens(
+        self, tokens: Iterable[tuple[str, int]]
+    ) -> Iterator[tuple[str, int]]:
+        """
+        Returns the (term, position) pairs which are indexed for the tokens of
+        a document: the analyzed tokens and, if `biwords` is set, their
+        biwords. A biword is returned right before the token it ends, so the
+        last pair is always the last token of the document.
+        """
+        tokens = self.analyze(tokens)
+        if not self.biwords:
+            return tokens
+        return self._add_biwords(tokens)
+
+    def _add_biwords(
+        self, tokens: Iterable[tuple[str, int]]
+    ) -> Iterator[tuple[str, int]]:
+        previous = None
+        for token, position in tokens:
+            if previous is not None:
+                yield biword(previous, token), position - 1
+            yield token, position
+            previous = token
+
+    def phrase_terms(self, terms: list[str]) -> list[str]:
+        """
+        Returns the index terms the phrase of the analyzed `terms` is looked
+        up with. With biwords, these are the biwords of all consecutive terms,
+        which occur at consecutive positions just like the terms themselves.
+        """
+        if not self.biwords or len(terms) < 2:
+            return terms
+        return [biword(a, b) for a, b in zip(terms, terms[1:])]
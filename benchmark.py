@@ -0,0 +1,1467 @@
+#!/usr/bin/env python
+
+import contextlib
+import functools
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import click
+from tabulate import tabulate
+
+import tokenizer
+from analyzer import Analyzer
+from bitmap import Bitmap, is_dense
+from index import DEFAULT_FIELD, FIELDS, IndexBuilder
+from index_store import MappedIndex, save_index
+from posting import Posting
+from query_file import read_query_file
+from corpus import read_corpus
+import planner
+from index import CachingIndexReader, PositionalPosting
+from input_parser import (
+    GroupQuery,
+    OrQuery,
+    PhraseQuery,
+    ProxQuery,
+    Query,
+    QueryType,
+    TermQuery,
+    Token,
+    TokenType,
+    lex,
+)
+from input_parser import parse as parse_query
+from main import (
+    BLN_PATH,
+    CORPUS_PATH,
+    boolean_search,
+    build_index,
+    compile_plan,
+    execute_plan,
+    to_list,
+    union_many,
+)
+from result_cache import ResultCache
+from retrieval import TFIDFRetrievalSystem
+from segments import SegmentedIndex
+from server import QueryServer, percentile
+from retrieval_metrics import get_query_by_id
+from spimi import SpimiIndexBuilder
+
+# Documents of CISI.ALL extracted into one file per document.
+DOCS_PATTERN = "./CISI/CISI.ALL.docs/*"
+
+
+def best_of(func, repeat: int = 3) -> float:
+    """
+    Executes `func` `repeat` times and returns the fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(func) -> int:
+    """
+    Executes `func` and returns the peak of memory allocated by Python in
+    bytes.
+    """
+    return traced_memory(func)[1]
+
+
+def traced_memory(func) -> tuple[int, int]:
+    """
+    Executes `func` and returns the memory allocated by Python that is still
+    held by the result of `func` and the peak of allocated memory in bytes.
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return current, peak
+
+
+def load_corpus() -> list[tuple[int, list[tuple[str, int]]]]:
+    """
+    Tokenizes the CISI corpus once, so the benchmarks do not measure the
+    tokenizer.
+    """
+    return [
+        (document.doc_id, list(tokenizer.tokenize_text(document.text)))
+        for document in read_corpus(CORPUS_PATH)
+    ]
+
+
+def quadratic_positional_intersect(
+    p1: list[PositionalPosting], p2: list[PositionalPosting], k: int
+) -> list[PositionalPosting]:
+    """
+    Previous implementation of `Posting.positional_intersect`, which scans all
+    positions of p2 for every position of p1 and creates one posting per
+    matching pair of positions.
+    """
+    answer: list[PositionalPosting] = []
+    i = 0
+    j = 0
+
+    while i < len(p1) and j < len(p2):
+        if p1[i].doc_id == p2[j].doc_id:
+            l = []
+            pp1 = p1[i].positions
+            pp2 = p2[j].positions
+            pp1_i = 0
+
+            while pp1_i < len(pp1):
+                pp2_i = 0
+                while pp2_i < len(pp2):
+                    if abs(pp1[pp1_i] - pp2[pp2_i]) <= k:
+                        l.append(pp2[pp2_i])
+                    elif pp2[pp2_i] > pp1[pp1_i]:
+                        break
+                    pp2_i += 1
+                while l != [] and abs(l[0] - pp1[pp1_i]) > k:
+                    del l[0]
+
+                answer += [
+                    PositionalPosting(p1[i].doc_id, [pp1[pp1_i], pos]) for pos in l
+                ]
+                pp1_i += 1
+
+            i += 1
+            j += 1
+        elif p1[i].doc_id < p2[j].doc_id:
+            i += 1
+        else:
+            j += 1
+
+    return answer
+
+
+def chained_phrase(postings: list[list[PositionalPosting]]) -> list[int]:
+    """
+    Previous phrase matching, which chains pairwise positional intersects from
+    the end of the phrase.
+    """
+    doc_ids: set[int] = set()
+    right = postings[-1]
+    for left in reversed(postings[:-1]):
+        right = quadratic_positional_intersect(left, right, 1)
+        if not right:
+            return []
+        doc_ids.update(x.doc_id for x in right)
+    return sorted(doc_ids)
+
+
+def previous_lex(input: str) -> Iterator[Token]:
+    """
+    Previous implementation of `input_parser.lex`, which copies the rest of
+    the input for every term and phrase.
+    """
+    i = 0
+    while i < len(input):
+        c = input[i]
+        if c == '"':
+            phrase = "".join(itertools.takewhile(lambda x: x != '"', input[i + 1 :]))
+            j = i
+            i += len(phrase) + 2
+            yield Token(j, phrase, TokenType.PHRASE)
+        elif c == "(":
+            yield Token(i, c, TokenType.LPAREN)
+        elif c == ")":
+            yield Token(i, c, TokenType.RPAREN)
+        elif c.isspace():
+            pass
+        elif c == "/" and i + 1 < len(input):
+            k = "".join(itertools.takewhile(lambda x: x.isdigit(), input[i + 1 :]))
+            yield Token(i, k, TokenType.PROX_K)
+            i += len(k)
+        else:
+            chars = "".join(itertools.takewhile(lambda x: x.isalnum(), input[i:]))
+            if not chars:
+                i += 1
+                continue
+            j = i
+            i += len(chars) - 1
+            if chars in FIELDS and input[i + 1 : i + 2] == ":":
+                yield Token(j, chars, TokenType.FIELD)
+                i += 2
+                continue
+            types = {"AND": TokenType.AND, "OR": TokenType.OR, "NOT": TokenType.NOT}
+            yield Token(j, chars, types.get(chars, TokenType.TERM))
+        i += 1
+
+
+def previous_parse(tokens: list[Token]) -> list[Query]:
+    """
+    Previous implementation of `input_parser.parse`, which copies the rest of
+    the tokens and searches for the next AND at every OR and for the next
+    closing parenthesis at every opening one.
+    """
+    and_queries = []
+    query_part = None
+    negate = False
+    field = DEFAULT_FIELD
+    i = 0
+
+    def add_query(query):
+        nonlocal negate, query_part
+        if negate:
+            query.is_not = True
+        negate = False
+        and_queries.append(query)
+        query_part = None
+
+    while i < len(tokens):
+        t = tokens[i]
+        if t.type == TokenType.NOT:
+            negate = not negate
+        elif t.type == TokenType.AND:
+            add_query(query_part)
+        elif t.type == TokenType.OR:
+            idx_next_and = next(
+                (
+                    j
+                    for j in range(i + 1, len(tokens))
+                    if tokens[j].type == TokenType.AND
+                ),
+                len(tokens),
+            )
+            flattened = []
+
+            def flatten(parts):
+                for part in parts:
+                    if part.type == QueryType.OR:
+                        flatten(part.parts)
+                    else:
+                        flattened.append(part)
+
+            flatten(previous_parse(tokens[i + 1 : idx_next_and]))
+            i += len(tokens[i + 1 : idx_next_and])
+            query_part.is_not = negate
+            negate = False
+            query_part = OrQuery(query_part, *flattened)
+        elif t.type == TokenType.PROX_K:
+            term_field = DEFAULT_FIELD
+            if tokens[i + 1].type == TokenType.FIELD:
+                term_field = tokens[i + 1].value
+                i += 1
+            query_part = ProxQuery(
+                query_part, TermQuery(tokens[i + 1].value, term_field), int(t.value)
+            )
+            i += 1
+        elif t.type == TokenType.FIELD:
+            field = t.value
+        elif t.type == TokenType.PHRASE:
+            query_part = PhraseQuery(t.value, field)
+            field = DEFAULT_FIELD
+        elif t.type == TokenType.TERM:
+            query_part = TermQuery(t.value, field)
+            field = DEFAULT_FIELD
+        elif t.type == TokenType.LPAREN:
+            idx_rparen = next(
+                j
+                for j in range(i + 1, len(tokens))
+                if tokens[j].type == TokenType.RPAREN
+            )
+            query_part = GroupQuery(*previous_parse(tokens[i + 1 : idx_rparen]))
+            query_part.is_not = negate
+            negate = False
+            i += len(tokens[i + 1 : idx_rparen])
+        i += 1
+
+    if query_part is not None:
+        add_query(query_part)
+    return and_queries
+
+
+def expanded_query(num_terms: int, group_size: int, rng: random.Random) -> str:
+    """
+    Returns a synthetic query like the ones of the query expansion: a
+    conjunction of groups of up to `group_size` terms, in which every term is
+    OR'd with its expansions.
+    """
+    words = ["information", "retrieval", "library", "science", "data", "system"]
+    groups = []
+    while num_terms > 0:
+        size = min(num_terms, rng.randint(min(2, group_size), group_size))
+        num_terms -= size
+        parts = []
+        for i in range(size):
+            word = rng.choice(words)
+            choice = rng.random()
+            # The previous lexer skips the character after a phrase, so a
+            # group must not end with one.
+            if choice < 0.1 and i < size - 1:
+                parts.append(f'"{word} {rng.choice(words)}"')
+            elif choice < 0.2:
+                parts.append(f"title:{word}")
+            else:
+                parts.append(word)
+        group = "(" + " OR ".join(parts) + ")"
+        groups.append("NOT " + group if rng.random() < 0.1 else group)
+    return " AND ".join(groups)
+
+
+def scale_corpus(docs, scale: int):
+    """
+    Returns a synthetic corpus which contains every document `scale` times
+    with new doc IDs.
+    """
+    max_doc_id = max(doc_id for doc_id, _ in docs)
+    return [
+        (i * max_doc_id + doc_id, tokens)
+        for i in range(scale)
+        for doc_id, tokens in docs
+    ]
+
+
+@click.group()
+def main():
+    """
+    Benchmarks for the IR system.
+    """
+    pass
+
+
+@main.command()
+@click.option(
+    "--scale",
+    "scales",
+    help="Corpus sizes as multiples of CISI.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[1, 2, 4, 8],
+)
+def build(scales):
+    """
+    Measure time and peak memory of building the index.
+    """
+    docs = load_corpus()
+    rows = []
+
+    for scale in scales:
+        corpus = scale_corpus(docs, scale)
+        num_tokens = sum(len(tokens) for _, tokens in corpus)
+
+        def run():
+            builder = IndexBuilder()
+            for doc_id, tokens in corpus:
+                builder.add_document(doc_id, tokens)
+            return builder.build()
+
+        seconds = best_of(run)
+        index_bytes, peak = traced_memory(run)
+        rows.append(
+            [
+                scale,
+                len(corpus),
+                num_tokens,
+                f"{seconds:.3f}",
+                f"{num_tokens / seconds:,.0f}",
+                f"{peak / 2**20:.1f}",
+                f"{index_bytes / 2**20:.1f}",
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Scale",
+                "Docs",
+                "Tokens",
+                "Seconds",
+                "Tokens/s",
+                "Peak MiB",
+                "Index MiB",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--workers",
+    "worker_counts",
+    help="Number of worker processes.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[1, 2, 4],
+)
+def parallel_build(worker_counts):
+    """
+    Measure building the index from the corpus files with several processes.
+    """
+    rows = []
+    baseline = None
+
+    for workers in worker_counts:
+        seconds = best_of(lambda: build_index.__wrapped__(workers))
+        baseline = baseline or seconds
+        rows.append([workers, f"{seconds:.3f}", f"{baseline / seconds:.2f}x"])
+
+    print(tabulate(rows, headers=["Workers", "Seconds", "Speedup"], tablefmt="grid"))
+
+
+@main.command()
+@click.option(
+    "--scale",
+    "scales",
+    help="Corpus sizes as multiples of CISI.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[1, 4, 8],
+)
+@click.option(
+    "--memory-budget",
+    help="Memory budget of the SPIMI builder in MiB.",
+    type=click.IntRange(1),
+    default=4,
+)
+def spimi(scales, memory_budget):
+    """
+    Compare building an index file in memory and with the SPIMI builder.
+    """
+    docs = load_corpus()
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, "index")
+
+        for scale in scales:
+            corpus = scale_corpus(docs, scale)
+
+            def in_memory():
+                builder = IndexBuilder()
+                for doc_id, tokens in corpus:
+                    builder.add_document(doc_id, tokens)
+                save_index(builder.build(), index_path, "")
+
+            def external():
+                builder = SpimiIndexBuilder(memory_budget * 2**20, tmp_dir)
+                for doc_id, tokens in corpus:
+                    builder.add_document(doc_id, tokens)
+                builder.write(index_path, "")
+
+            for name, func in [("in-memory", in_memory), ("spimi", external)]:
+                seconds = best_of(func, repeat=1)
+                peak = peak_memory(func)
+                rows.append([scale, name, f"{seconds:.3f}", f"{peak / 2**20:.1f}"])
+
+    print(
+        tabulate(
+            rows, headers=["Scale", "Builder", "Seconds", "Peak MiB"], tablefmt="grid"
+        )
+    )
+
+
+@main.command("tokenize")
+@click.option(
+    "--scale",
+    "scales",
+    help="Corpus sizes as multiples of CISI.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[1, 4, 16],
+)
+def tokenize_command(scales):
+    """
+    Measure the throughput of the tokenizer.
+    """
+    files = glob.glob(DOCS_PATTERN)
+    texts = [document.text for document in read_corpus(CORPUS_PATH)]
+
+    def read_files():
+        return sum(1 for file in files for _ in tokenizer.tokenize(file))
+
+    def read_stream():
+        return sum(
+            1
+            for document in read_corpus(CORPUS_PATH)
+            for _ in tokenizer.tokenize_text(document.text)
+        )
+
+    rows = []
+    for name, func, num_docs in [
+        ("files", read_files, len(files)),
+        ("CISI.ALL", read_stream, len(texts)),
+    ]:
+        num_tokens = func()
+        seconds = best_of(func)
+        rows.append(
+            [
+                name,
+                num_docs,
+                num_tokens,
+                f"{seconds:.3f}",
+                f"{num_tokens / seconds:,.0f}",
+            ]
+        )
+
+    for scale in scales:
+        corpus = texts * scale
+
+        def run():
+            return sum(1 for text in corpus for _ in tokenizer.tokenize_text(text))
+
+        num_tokens = run()
+        seconds = best_of(run)
+        rows.append(
+            [
+                f"x{scale}",
+                len(corpus),
+                num_tokens,
+                f"{seconds:.3f}",
+                f"{num_tokens / seconds:,.0f}",
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Corpus", "Docs", "Tokens", "Seconds", "Tokens/s"],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+def analyzer():
+    """
+    Measure how much every analyzer stage shrinks the index and speeds up
+    building and tf-idf queries.
+    """
+    queries = [get_query_by_id(x) for x in range(1, 36)]
+    configs = [
+        ("none", Analyzer()),
+        ("+ length 2-20", Analyzer(min_length=2, max_length=20)),
+        ("+ stopwords", Analyzer(True, min_length=2, max_length=20)),
+        ("+ stem", Analyzer(True, True, 2, 20)),
+    ]
+    rows = []
+    baseline = None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, config in configs:
+            index_path = os.path.join(tmp_dir, name)
+            build_seconds = best_of(lambda: build_index.__wrapped__(1, config))
+            writer = save_index(build_index.__wrapped__(1, config), index_path, "")
+            reader = MappedIndex(index_path)
+            reader.analyzer = config
+            ir_system = TFIDFRetrievalSystem(reader)
+
+            def rank():
+                for query in queries:
+                    ir_system.retrieve(query)
+
+            num_terms = sum(1 for _ in reader.terms())
+            postings_mib = writer.raw_postings_bytes / 2**20
+            baseline = baseline or postings_mib
+            rows.append(
+                [
+                    name,
+                    sum(reader.doc_lengths.values()),
+                    num_terms,
+                    f"{postings_mib:.2f}",
+                    f"{100 * postings_mib / baseline:.0f}%",
+                    f"{build_seconds:.3f}",
+                    f"{best_of(rank) * 1000:.1f}",
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Analyzer",
+                "Tokens",
+                "Terms",
+                "Postings MiB",
+                "Size",
+                "Build s",
+                "tf-idf ms",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--size",
+    help="Length of the long doc ID list.",
+    type=click.IntRange(1),
+    default=100_000,
+)
+def intersect(size):
+    """
+    Compare linear and galloping intersections of doc ID lists with skewed
+    lengths.
+    """
+    rng = random.Random(0)
+    universe = range(10 * size)
+    long_list = sorted(rng.sample(universe, size))
+    pairs = []
+    short_size = 1
+    while short_size <= size:
+        pairs.append((f"{short_size}", sorted(rng.sample(universe, short_size))))
+        short_size *= 10
+
+    index = build_index.__wrapped__()
+    information = index.get_posting_list("information").doc_ids.tolist()
+    cisi_pairs = []
+    for term in ["dewey", "catalog", "library", "retrieval"]:
+        doc_ids = index.get_posting_list(term).doc_ids.tolist()
+        cisi_pairs.append((f"{term} ({len(doc_ids)})", doc_ids))
+
+    rows = []
+    for name, large, pairs in [
+        ("synthetic", long_list, pairs),
+        (f"information ({len(information)})", information, cisi_pairs),
+    ]:
+        for short_name, short in pairs:
+            # Short intersections are repeated to get measurable times.
+            repeat = max(1, 100_000 // len(large))
+
+            def run(func):
+                for _ in range(repeat):
+                    func(short, large)
+
+            merge = best_of(lambda: run(Posting.merge_intersect)) / repeat
+            gallop = best_of(lambda: run(Posting.gallop_intersect)) / repeat
+            rows.append(
+                [
+                    name,
+                    short_name,
+                    f"{merge * 1e6:.1f}",
+                    f"{gallop * 1e6:.1f}",
+                    f"{merge / gallop:.1f}x",
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Long list", "Short list", "Merge µs", "Gallop µs", "Speedup"],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--scale",
+    "scales",
+    help="Corpus sizes as multiples of CISI.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[1, 64],
+)
+def bitmap(scales):
+    """
+    Compare AND, OR and NOT of dense doc ID lists as sorted lists and as
+    bitmaps.
+    """
+    index = build_index.__wrapped__()
+    term_a = index.get_posting_list("information").doc_ids.tolist()
+    term_b = index.get_posting_list("library").doc_ids.tolist()
+    max_doc_id = max(index.doc_ids)
+    rows = []
+
+    for scale in scales:
+        # Every document is repeated `scale` times with new doc IDs.
+        def scaled(doc_ids):
+            return [i * max_doc_id + x for i in range(scale) for x in doc_ids]
+
+        a, b, docs = scaled(term_a), scaled(term_b), scaled(index.doc_ids)
+        # Bitmaps of posting lists are cached, so their creation is not
+        # measured.
+        bitmap_a, bitmap_b = Bitmap.from_doc_ids(a), Bitmap.from_doc_ids(b)
+        bitmap_docs = Bitmap.from_doc_ids(docs)
+
+        for name, with_lists, with_bitmaps in [
+            ("AND", lambda: Posting.intersect(a, b), lambda: bitmap_a & bitmap_b),
+            ("OR", lambda: Posting.union(a, b), lambda: bitmap_a | bitmap_b),
+            ("NOT", lambda: Posting.Not(a, docs), lambda: bitmap_docs - bitmap_a),
+        ]:
+            assert with_lists() == with_bitmaps().to_list()
+            lists = best_of(with_lists)
+            bitmaps = best_of(with_bitmaps)
+            # Query results are converted back to a list once at the end.
+            converted = best_of(lambda: with_bitmaps().to_list())
+            rows.append(
+                [
+                    len(docs),
+                    name,
+                    f"{lists * 1e6:.1f}",
+                    f"{bitmaps * 1e6:.1f}",
+                    f"{lists / bitmaps:.1f}x",
+                    f"{converted * 1e6:.1f}",
+                ]
+            )
+
+    print(f"information ({len(term_a)}) and library ({len(term_b)}) per CISI copy")
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Docs",
+                "Operation",
+                "Lists µs",
+                "Bitmaps µs",
+                "Speedup",
+                "Bitmaps + list µs",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+def dense():
+    """
+    Compare evaluating queries with dense terms as lists, as bitmaps created
+    in every query and as bitmaps cached by the index, including the
+    conversion of the postings to bitmaps.
+    """
+    queries = [
+        "information AND library",
+        "information AND NOT retrieval",
+        "NOT information",
+        "information OR library",
+        "library AND NOT (data OR information)",
+        "(science AND library) AND NOT data",
+    ]
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Like `serve`, every query reads the postings from the index file
+        # through its own caching reader.
+        index_path = os.path.join(tmp_dir, "index")
+        save_index(build_index.__wrapped__(), index_path, "")
+        index = MappedIndex(index_path)
+
+        def run(query: str):
+            reader = CachingIndexReader(index)
+            return to_list(
+                execute_plan(reader, planner.plan(reader, parse_query(query)), 3, 1)
+            )
+
+        def lists(query: str):
+            with mock.patch("main.is_dense", return_value=False):
+                return run(query)
+
+        def uncached(query: str):
+            # Previously every query converted the dense terms and all doc
+            # IDs to bitmaps again.
+            index._term_bitmaps = None
+            index._doc_id_bitmap = None
+            return run(query)
+
+        totals = [0.0, 0.0, 0.0]
+        # The query handlers log every step.
+        with contextlib.redirect_stderr(io.StringIO()):
+            for query in queries:
+                doc_ids = run(query)
+                assert lists(query) == doc_ids and uncached(query) == doc_ids
+
+                times = [
+                    best_of(lambda: func(query), repeat=20)
+                    for func in [lists, uncached, run]
+                ]
+                totals = [total + time for total, time in zip(totals, times)]
+                rows.append([query, len(doc_ids), *(f"{t * 1e6:.0f}" for t in times)])
+
+    rows.append(["Total", "", *(f"{t * 1e6:.0f}" for t in totals)])
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Query",
+                "Matches",
+                "Lists µs",
+                "Bitmaps per query µs",
+                "Cached bitmaps µs",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--terms",
+    "term_counts",
+    help="Number of OR'd terms.",
+    type=click.IntRange(2),
+    multiple=True,
+    default=[10, 25, 50, 100],
+)
+def union(term_counts):
+    """
+    Compare pairwise unions of OR queries with a single k-way heap merge.
+    """
+    index = build_index.__wrapped__()
+    num_docs = len(index.doc_ids)
+
+    # Terms of the CISI boolean queries in the order they occur.
+    with open(BLN_PATH, "r") as f:
+        bln_terms = re.findall(r"'([^']+)'", f.read())
+    posting_lists = []
+    for term in dict.fromkeys(bln_terms):
+        posting_list = index.get_posting_list(term)
+        if posting_list is not None:
+            posting_lists.append(posting_list)
+
+    rows = []
+    for count in term_counts:
+        lists = [x.doc_ids.tolist() for x in posting_lists[:count]]
+        # Dense terms are evaluated as bitmaps, see `main.handle_term`.
+        mixed = [
+            x.bitmap if is_dense(len(x), num_docs) else x.doc_ids.tolist()
+            for x in posting_lists[:count]
+        ]
+
+        expected = functools.reduce(Posting.union, lists)
+        assert Posting.union_many(lists) == expected
+        assert to_list(union_many(mixed)) == expected
+
+        pairwise = best_of(lambda: functools.reduce(Posting.union, lists))
+        heap = best_of(lambda: Posting.union_many(lists))
+        bitmaps = best_of(lambda: to_list(union_many(mixed)))
+        rows.append(
+            [
+                len(lists),
+                sum(len(x) for x in lists),
+                len(expected),
+                f"{pairwise * 1e6:.0f}",
+                f"{heap * 1e6:.0f}",
+                f"{bitmaps * 1e6:.0f}",
+                f"{pairwise / heap:.1f}x",
+            ]
+        )
+
+    print(f"OR queries over the terms of {BLN_PATH}")
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Terms",
+                "Postings",
+                "Result",
+                "Pairwise µs",
+                "Heap µs",
+                "Heap + bitmaps µs",
+                "Speedup",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option("--limit", help="Number of matches to return.", default=10)
+def cursors(limit):
+    """
+    Compare evaluating boolean queries completely with reading only the first
+    matches or counting them with cursors.
+    """
+    queries = [
+        "information AND library",
+        "information AND library AND NOT retrieval",
+        "use AND NOT (data OR information)",
+        "science OR library OR information OR retrieval OR system",
+        "dewey AND information",
+    ]
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Like `boolean-retrieval`, every query reads the postings from the
+        # index file through its own caching reader.
+        index_path = os.path.join(tmp_dir, "index")
+        save_index(build_index.__wrapped__(), index_path, "")
+        index = MappedIndex(index_path)
+
+        def run(query: str, func):
+            reader = CachingIndexReader(index)
+            return reader, func(reader, planner.plan(reader, parse_query(query)))
+
+        def full(reader, plan):
+            return to_list(execute_plan(reader, plan, 3, 1))
+
+        def first(reader, plan):
+            cursor = compile_plan(reader, plan, 3, 1)
+            return cursor, list(itertools.islice(cursor, limit))
+
+        def count(reader, plan):
+            return sum(1 for _ in compile_plan(reader, plan, 3, 1))
+
+        # The query handlers log every step.
+        with contextlib.redirect_stderr(io.StringIO()):
+            for query in queries:
+                full_reader, doc_ids = run(query, full)
+                first_reader, (cursor, first_doc_ids) = run(query, first)
+                assert first_doc_ids == doc_ids[:limit]
+                assert run(query, count)[1] == len(doc_ids)
+
+                rows.append(
+                    [
+                        query,
+                        len(doc_ids),
+                        f"{best_of(lambda: run(query, full)) * 1e6:.0f}",
+                        full_reader.postings_scanned,
+                        f"{best_of(lambda: run(query, first)) * 1e6:.0f}",
+                        cursor.visited,
+                        f"{best_of(lambda: run(query, count)) * 1e6:.0f}",
+                    ]
+                )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Query",
+                "Matches",
+                "Full µs",
+                "Full postings",
+                f"First {limit} µs",
+                f"First {limit} postings",
+                "Count µs",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--length",
+    "lengths",
+    help="Number of tokens of the synthetic long documents.",
+    type=click.IntRange(10),
+    multiple=True,
+    default=[1_000, 10_000],
+)
+def positional(lengths):
+    """
+    Compare the previous and the linear positional intersect for phrase and
+    proximity queries.
+    """
+    rows = []
+    cases = []
+
+    index = build_index.__wrapped__()
+    for phrase in ["information retrieval", "the use of", "of the", "in the"]:
+        postings = [list(index.get_positional_postings(x)) for x in phrase.split()]
+        cases.append((f'"{phrase}"', postings))
+    for a, b, k in [("information", "retrieval", 10), ("the", "of", 3)]:
+        postings = [
+            list(index.get_positional_postings(a)),
+            list(index.get_positional_postings(b)),
+        ]
+        cases.append((f"{a} /{k} {b}", postings, k))
+
+    # Single documents in which two terms alternate randomly.
+    rng = random.Random(0)
+    for length in lengths:
+        tokens = [rng.choice("ab") for _ in range(length)]
+        postings = [
+            [PositionalPosting(1, [i + 1 for i, x in enumerate(tokens) if x == term])]
+            for term in "ab"
+        ]
+        cases.append((f'"a b" in {length} tokens', postings))
+        cases.append((f"a /5 b in {length} tokens", postings, 5))
+
+    for name, postings, *k in cases:
+        if k:
+            previous = best_of(
+                lambda: quadratic_positional_intersect(*postings, k[0]), repeat=1
+            )
+            linear = best_of(lambda: Posting.positional_intersect(*postings, k[0]))
+        else:
+            previous = best_of(lambda: chained_phrase(postings), repeat=1)
+            linear = best_of(lambda: Posting.phrase_intersect(postings))
+        rows.append(
+            [
+                name,
+                sum(len(x.positions) for p in postings for x in p),
+                f"{previous * 1000:.2f}",
+                f"{linear * 1000:.2f}",
+                f"{previous / linear:.1f}x",
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Query", "Positions", "Previous ms", "Linear ms", "Speedup"],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+def biwords():
+    """
+    Compare phrase queries and index size with and without a biword index.
+    """
+    phrases = [
+        '"information retrieval"',
+        '"of the"',
+        '"the use of"',
+        '"information retrieval systems"',
+        '"in the field of information science"',
+        'title:"information science"',
+    ]
+    indexes = []
+    size_rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for biwords in [False, True]:
+            analyzer = Analyzer(biwords=biwords)
+            index_path = os.path.join(tmp_dir, f"index-{biwords}")
+            build_time = best_of(
+                lambda: build_index.__wrapped__(analyzer=analyzer), repeat=1
+            )
+            save_index(build_index.__wrapped__(analyzer=analyzer), index_path, "")
+            segment = MappedIndex(index_path)
+            indexes.append(SegmentedIndex([(segment, set())], analyzer))
+            size_rows.append(
+                [
+                    "biwords" if biwords else "positional",
+                    f"{build_time:.2f}",
+                    sum(1 for _ in segment.terms()),
+                    f"{segment.postings_bytes / 2**20:.2f}",
+                ]
+            )
+
+        def run(index: SegmentedIndex, phrase: str) -> list[int]:
+            # Every query reads the postings from the index file again.
+            reader = CachingIndexReader(index)
+            plan = planner.plan(reader, parse_query(phrase))
+            return to_list(execute_plan(reader, plan, 3, 1))
+
+        rows = []
+        # The query handlers log every step.
+        with contextlib.redirect_stderr(io.StringIO()):
+            for phrase in phrases:
+                doc_ids = run(indexes[0], phrase)
+                assert run(indexes[1], phrase) == doc_ids
+                positional = best_of(lambda: run(indexes[0], phrase))
+                biword = best_of(lambda: run(indexes[1], phrase))
+                rows.append(
+                    [
+                        phrase,
+                        len(doc_ids),
+                        f"{positional * 1000:.2f}",
+                        f"{biword * 1000:.2f}",
+                        f"{positional / biword:.1f}x",
+                    ]
+                )
+
+    print(
+        tabulate(
+            size_rows,
+            headers=["Index", "Build s", "Terms", "Postings MiB"],
+            tablefmt="grid",
+        )
+    )
+    print(
+        tabulate(
+            rows,
+            headers=["Phrase", "Matches", "Positional ms", "Biwords ms", "Speedup"],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option(
+    "--queries", "num_queries", help="Number of replayed queries.", default=500
+)
+@click.option("--entries", help="Maximum number of cached results.", default=1024)
+def cache(num_queries, entries):
+    """
+    Replay boolean queries, whose operands are randomly reordered, with and
+    without a result cache.
+    """
+    templates = [
+        ["information", "retrieval"],
+        ["library", "(science OR information)"],
+        ["(data OR information)", "NOT retrieval", '"information retrieval"'],
+        ["use", "NOT (data OR library)"],
+        ["catalog /5 library", "book"],
+        ["(research AND science)", "NOT (study OR system)"],
+        ['"library of congress"', "classification"],
+        ["(computer OR system)", "(user OR reader)", "NOT library"],
+    ]
+
+    rng = random.Random(0)
+    workload = []
+    for _ in range(num_queries):
+        operands = list(rng.choice(templates))
+        rng.shuffle(operands)
+        if rng.random() < 0.2:
+            # Double negation of the first operand.
+            operands[0] = f"NOT (NOT {operands[0]})"
+        workload.append(" AND ".join(operands))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, "index")
+        save_index(build_index.__wrapped__(), index_path, "")
+        index = MappedIndex(index_path)
+
+        def replay(result_cache: Optional[ResultCache]) -> list[list[int]]:
+            results = []
+            for query in workload:
+                # Like `boolean-retrieval`, every query is parsed again and
+                # reads the postings through its own caching reader.
+                reader = CachingIndexReader(index)
+                plan = planner.plan(reader, parse_query(query))
+                results.append(to_list(execute_plan(reader, plan, 3, 1, result_cache)))
+            return results
+
+        # The query handlers log every step.
+        with contextlib.redirect_stderr(io.StringIO()):
+            expected = replay(None)
+            result_cache = ResultCache(entries)
+            assert replay(result_cache) == expected
+
+            uncached = best_of(lambda: replay(None), repeat=1)
+            cached = best_of(lambda: replay(ResultCache(entries)), repeat=1)
+
+    rows = [
+        ["none", f"{uncached * 1000:.1f}", "", "", ""],
+        [
+            "result cache",
+            f"{cached * 1000:.1f}",
+            f"{result_cache.hits / (result_cache.hits + result_cache.misses):.0%}",
+            len(result_cache),
+            f"{result_cache.bytes / 1024:.0f}",
+        ],
+    ]
+    print(f"{len(workload)} queries from {len(templates)} templates")
+    print(
+        tabulate(
+            rows,
+            headers=["Cache", "Total ms", "Hit rate", "Entries", "KiB"],
+            tablefmt="grid",
+        )
+    )
+    print(f"Speedup: {uncached / cached:.1f}x")
+
+
+@main.command()
+@click.option("--requests", "num_requests", help="Number of requests.", default=500)
+@click.option(
+    "--concurrency", help="Number of concurrent clients.", multiple=True, default=[1, 4]
+)
+def server(num_requests, concurrency):
+    """
+    Measure the latency of boolean and tf-idf queries against the query
+    server and compare it with starting the CLI for every query.
+    """
+    queries = [
+        ("boolean", "information AND library"),
+        ("boolean", "use AND NOT (data OR information)"),
+        ("boolean", '"information retrieval" OR dewey'),
+        ("tf-idf", "information retrieval systems"),
+        ("tf-idf", "classification of library books"),
+    ]
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        index = build_index.__wrapped__()
+    ir_system = TFIDFRetrievalSystem(index)
+    result_cache = ResultCache()
+    query_server = QueryServer(
+        ("127.0.0.1", 0),
+        lambda query, k, r, limit: boolean_search(
+            index, query, k, r, limit, result_cache
+        ),
+        ir_system.retrieve,
+        result_cache,
+    )
+    threading.Thread(target=query_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{query_server.server_address[1]}"
+
+    def request(i: int) -> float:
+        endpoint, query = queries[i % len(queries)]
+        url = f"{base_url}/{endpoint}?q={urllib.parse.quote(query)}"
+        start = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            json.load(response)
+        return time.perf_counter() - start
+
+    rows = []
+    # The query handlers log every step.
+    with contextlib.redirect_stderr(io.StringIO()):
+        for clients in concurrency:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                latencies = sorted(pool.map(request, range(num_requests)))
+            elapsed = time.perf_counter() - start
+            rows.append(
+                [
+                    f"server, {clients} clients",
+                    f"{percentile(latencies, 50) * 1000:.2f}",
+                    f"{percentile(latencies, 99) * 1000:.2f}",
+                    f"{num_requests / elapsed:.0f}",
+                ]
+            )
+
+    query_server.shutdown()
+    query_server.server_close()
+
+    # Every call of the CLI starts the interpreter and opens the index.
+    cli_latencies = []
+    for _, query in queries[:3]:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "main.py", "boolean-retrieval", "-q", query, "-k", "3"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        cli_latencies.append(time.perf_counter() - start)
+    for _, query in queries[:3]:
+        # Remove the result files written by the CLI.
+        with contextlib.suppress(OSError):
+            os.remove(query.replace("/", "_") + ".txt")
+    cli_latencies.sort()
+    rows.append(
+        [
+            "CLI per query",
+            f"{percentile(cli_latencies, 50) * 1000:.2f}",
+            f"{percentile(cli_latencies, 99) * 1000:.2f}",
+            f"{len(cli_latencies) / sum(cli_latencies):.0f}",
+        ]
+    )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Setup", "p50 ms", "p99 ms", "Queries/s"],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+@click.option("--repeat", help="Number of times every query is run.", default=20)
+@click.option("--jobs", help="Number of processes.", multiple=True, default=[1, 2, 4])
+def batch(repeat, jobs):
+    """
+    Run the queries of CISI.BLN as batch with different numbers of processes
+    and compare it with starting the CLI for every query.
+    """
+    queries = read_query_file(BLN_PATH)
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        query_path = os.path.join(tmp_dir, "queries.txt")
+        with open(query_path, "w") as f:
+            for _ in range(repeat):
+                f.writelines(query + "\n" for _, query in queries)
+
+        for num_jobs in jobs:
+            start = time.perf_counter()
+            subprocess.run(
+                [
+                    sys.executable,
+                    "main.py",
+                    "batch",
+                    query_path,
+                    "--jobs",
+                    str(num_jobs),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            elapsed = time.perf_counter() - start
+            rows.append(
+                [
+                    f"batch, {num_jobs} jobs",
+                    f"{elapsed:.2f}",
+                    f"{len(queries) * repeat / elapsed:.0f}",
+                ]
+            )
+
+    # Every call of the CLI starts the interpreter and opens the index.
+    start = time.perf_counter()
+    for _, query in queries[:5]:
+        subprocess.run(
+            [sys.executable, "main.py", "boolean-retrieval", "-q", query, "-k", "3"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        # Remove the result file written by the CLI.
+        with contextlib.suppress(OSError):
+            os.remove(query.replace("/", "_") + ".txt")
+    elapsed = (time.perf_counter() - start) / 5
+    rows.append(
+        [
+            "CLI per query",
+            f"{elapsed * len(queries) * repeat:.2f} (est.)",
+            f"{1 / elapsed:.0f}",
+        ]
+    )
+
+    print(f"{len(queries) * repeat} queries from {BLN_PATH}")
+    print(tabulate(rows, headers=["Setup", "Total s", "Queries/s"], tablefmt="grid"))
+
+
+@main.command()
+@click.option(
+    "--terms",
+    "term_counts",
+    help="Number of terms of the synthetic queries.",
+    type=click.IntRange(1),
+    multiple=True,
+    default=[10, 100, 500, 2000],
+)
+def parse(term_counts):
+    """
+    Compare the previous and the linear lexer and parser on long queries.
+    """
+    rng = random.Random(0)
+    rows = []
+    cases = [
+        (count, shape, group_size)
+        for count in term_counts
+        for shape, group_size in [("groups of 2-8 terms", 8), ("one group", count)]
+    ]
+    for count, shape, group_size in cases:
+        query = expanded_query(count, group_size, rng)
+        tokens = list(lex(query))
+        assert [(x.pos, x.value, x.type) for x in previous_lex(query)] == [
+            (x.pos, x.value, x.type) for x in tokens
+        ]
+
+        previous_lexer = best_of(lambda: list(previous_lex(query)))
+        lexer = best_of(lambda: list(lex(query)))
+        parser = best_of(lambda: parse_query(query)) - lexer
+        try:
+            assert repr(previous_parse(tokens)) == repr(parse_query(query))
+            previous_parser = best_of(lambda: previous_parse(tokens))
+        except RecursionError:
+            # The previous parser recursed at every OR.
+            previous_parser = None
+
+        rows.append(
+            [
+                count,
+                shape,
+                len(tokens),
+                f"{previous_lexer * 1000:.2f}",
+                f"{lexer * 1000:.2f}",
+                (
+                    "RecursionError"
+                    if previous_parser is None
+                    else f"{previous_parser * 1000:.2f}"
+                ),
+                f"{parser * 1000:.2f}",
+                (
+                    "-"
+                    if previous_parser is None
+                    else f"{(previous_lexer + previous_parser) / (lexer + parser):.1f}x"
+                ),
+            ]
+        )
+
+    print("Conjunctions of OR'd groups like the ones of the query expansion")
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Terms",
+                "Query",
+                "Tokens",
+                "Previous lex ms",
+                "Lex ms",
+                "Previous parse ms",
+                "Parse ms",
+                "Speedup",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+@main.command()
+def compression():
+    """
+    Compare size and query speed of an uncompressed and a compressed index.
+    """
+    queries = [get_query_by_id(x) for x in range(1, 36)]
+    terms = [t for query in queries for t, _ in tokenizer.tokenize_text(query)]
+    index = build_index.__wrapped__()
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compress in [False, True]:
+            index_path = os.path.join(tmp_dir, f"index-{compress}")
+            save_index(index, index_path, "", compress)
+            reader = MappedIndex(index_path)
+            ir_system = TFIDFRetrievalSystem(reader)
+
+            def lookup():
+                for term in terms:
+                    reader.get_positional_postings(term)
+
+            def rank():
+                for query in queries:
+                    ir_system.retrieve(query)
+
+            rows.append(
+                [
+                    "vbyte" if compress else "none",
+                    f"{os.path.getsize(index_path) / 2**20:.2f}",
+                    f"{reader.postings_bytes / 2**20:.2f}",
+                    f"{best_of(lookup) * 1000:.1f}",
+                    f"{best_of(rank) * 1000:.1f}",
+                ]
+            )
+
+    print(f"{len(terms)} term lookups and {len(queries)} tf-idf queries")
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Compression",
+                "File MiB",
+                "Postings MiB",
+                "Lookups ms",
+                "tf-idf ms",
+            ],
+            tablefmt="grid",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
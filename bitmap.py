@@ -0,0 +1,204 @@
+import sys
+from array import array
+from typing import Iterable, Iterator, Union
+
+# Doc IDs are split into chunks of 2**16 IDs, every chunk is stored in its own
+# container and only holds the lower 16 bits of its IDs.
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# A container is stored as bitmap if it holds at least one doc ID per this
+# many possible IDs below its highest ID. A bitmap then needs no more memory
+# than an array of 16 bit values.
+BITMAP_DENSITY = 16
+
+# Lists of doc IDs which contain at least this fraction of all documents are
+# represented as bitmaps during query evaluation.
+DENSE_FRACTION = 1 / BITMAP_DENSITY
+
+# Container of a chunk, either a sorted array of the lower 16 bits of its doc
+# IDs or an integer whose set bits are the lower 16 bits of its doc IDs.
+Container = Union[array, int]
+
+# Bit positions set in every byte value.
+_BYTE_BITS = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)]
+
+
+def _array_to_bits(values: array) -> int:
+    bits = bytearray((values[-1] >> 3) + 1)
+    for value in values:
+        bits[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _set_bits(bits: int, base: int = 0) -> list[int]:
+    """Returns `base` plus the positions of all set bits of `bits`."""
+    data = bits.to_bytes((bits.bit_length() + 7) >> 3, "little")
+    return [
+        base + (i << 3) + bit
+        for i, byte in enumerate(data)
+        if byte
+        for bit in _BYTE_BITS[byte]
+    ]
+
+
+def _bits_to_array(bits: int) -> array:
+    return array("H", _set_bits(bits))
+
+
+def _normalize(container: Container) -> Container:
+    """
+    Converts `container` into the cheaper representation for its doc IDs.
+    Returns 0 for an empty container.
+    """
+    if isinstance(container, int):
+        if container.bit_count() * BITMAP_DENSITY < container.bit_length():
+            return _bits_to_array(container)
+        return container
+    if not container:
+        return 0
+    if len(container) * BITMAP_DENSITY >= container[-1] + 1:
+        return _array_to_bits(container)
+    return container
+
+
+def _and(a: Container, b: Container) -> Container:
+    if isinstance(a, int) and isinstance(b, int):
+        return a & b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        # Test every value of the array against the bytes of the bitmap.
+        data = b.to_bytes((b.bit_length() + 7) >> 3, "little")
+        n = len(data)
+        return array(
+            "H",
+            (x for x in a if (x >> 3) < n and data[x >> 3] >> (x & 7) & 1),
+        )
+    return array("H", sorted(set(a).intersection(b)))
+
+
+def _or(a: Container, b: Container) -> Container:
+    # Chunks which only exist in one of the bitmaps are passed as 0.
+    if isinstance(b, int) and not b:
+        return a
+    if isinstance(a, int) and not a:
+        return b
+    if isinstance(a, int) or isinstance(b, int):
+        a = a if isinstance(a, int) else _array_to_bits(a)
+        b = b if isinstance(b, int) else _array_to_bits(b)
+        return a | b
+    return array("H", sorted(set(a).union(b)))
+
+
+def _and_not(a: Container, b: Container) -> Container:
+    if isinstance(a, int):
+        return a & ~(b if isinstance(b, int) else _array_to_bits(b))
+    if isinstance(b, int):
+        data = b.to_bytes((b.bit_length() + 7) >> 3, "little")
+        n = len(data)
+        return array(
+            "H",
+            (x for x in a if (x >> 3) >= n or not data[x >> 3] >> (x & 7) & 1),
+        )
+    return array("H", sorted(set(a).difference(b)))
+
+
+class Bitmap:
+    """
+    Compressed set of doc IDs, similar to a Roaring bitmap.
+
+    The doc IDs are split into chunks by their upper bits. Sparse chunks are
+    stored as sorted arrays, dense chunks as bitmaps in a Python integer, so
+    AND, OR and AND NOT of two dense chunks are single bitwise operations on
+    whole machine words. Bitmaps are immutable, every operation returns a new
+    bitmap.
+    """
+
+    __slots__ = ["_containers"]
+
+    def __init__(self, containers: dict[int, Container]):
+        # Mapping from the upper bits of the doc IDs to the container of the
+        # chunk, sorted by key. Empty containers are never stored.
+        self._containers = containers
+
+    @staticmethod
+    def from_doc_ids(doc_ids: Iterable[int]) -> "Bitmap":
+        """
+        Creates a bitmap from sorted doc IDs. Duplicate doc IDs are only
+        stored once.
+        """
+        chunks: dict[int, array] = {}
+        key = -1
+        values = array("H")
+        for doc_id in doc_ids:
+            if doc_id >> CHUNK_BITS != key:
+                key = doc_id >> CHUNK_BITS
+                values = chunks.setdefault(key, array("H"))
+            low = doc_id & CHUNK_MASK
+            if not values or values[-1] != low:
+                values.append(low)
+        return Bitmap({key: _normalize(values) for key, values in chunks.items()})
+
+    def __len__(self) -> int:
+        return sum(
+            x.bit_count() if isinstance(x, int) else len(x)
+            for x in self._containers.values()
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_list())
+
+    def __repr__(self):
+        dense = sum(isinstance(x, int) for x in self._containers.values())
+        return (
+            f"Bitmap({len(self)} doc IDs, {dense}/{len(self._containers)} dense chunks)"
+        )
+
+    def memory_usage(self) -> int:
+        """Returns the number of bytes used by the containers."""
+        return sum(sys.getsizeof(x) for x in self._containers.values())
+
+    def to_list(self) -> list[int]:
+        """Returns the sorted doc IDs."""
+        result: list[int] = []
+        for key, container in self._containers.items():
+            base = key << CHUNK_BITS
+            if isinstance(container, int):
+                result += _set_bits(container, base)
+            else:
+                result += [base + low for low in container]
+        return result
+
+    def _combine(self, other: "Bitmap", op, keys: Iterable[int]) -> "Bitmap":
+        containers = {}
+        for key in keys:
+            container = _normalize(
+                op(self._containers.get(key, 0), other._containers.get(key, 0))
+            )
+            if container:
+                containers[key] = container
+        return Bitmap(containers)
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        keys = [x for x in self._containers if x in other._containers]
+        return self._combine(other, _and, keys)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        keys = sorted(self._containers.keys() | other._containers.keys())
+        return self._combine(other, _or, keys)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        """Returns the doc IDs of `self` which are not in `other` (AND NOT)."""
+        return self._combine(other, _and_not, self._containers)
+
+
+def is_dense(num_doc_ids: int, num_docs: int) -> bool:
+    """
+    Returns whether a list of `num_doc_ids` doc IDs out of `num_docs`
+    documents is dense enough to be evaluated as bitmap.
+    """
+    return num_doc_ids > 0 and num_doc_ids >= DENSE_FRACTION * num_docs
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import json
+import re
+from typing import Iterator, Optional, TextIO
+
+# Matches the lines which start a new field of a record in the CISI format:
+# ".I <doc id>" starts a new document, ".T", ".A", ".W", ".X" etc. start a
+# field of the current document.
+_CISI_MARKER = re.compile(r"^\.(?:I\s+(\d+)|([A-Z]))\s*$")
+
+# Fields of the CISI format that are stored in a document.
+_CISI_FIELDS = {"T": "title", "A": "author", "W": "text"}
+
+
+class Document:
+    """A document of a corpus with its title, authors and text."""
+
+    def __init__(self, doc_id: int, title: str = "", author: str = "", text: str = ""):
+        self.doc_id = doc_id
+        self.title = title
+        self.author = author
+        self.text = text
+
+    def __repr__(self):
+        return f"Document({self.doc_id}, {self.title!r})"
+
+    def hash(self) -> str:
+        """Returns a hash of the contents of the document."""
+        digest = hashlib.sha1()
+        for field in [self.title, self.author, self.text]:
+            digest.update(field.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+
+def _open(path: str) -> TextIO:
+    """Opens `path` for reading and decompresses it if it ends with ".gz"."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def read_cisi(path: str) -> Iterator[Document]:
+    """
+    Reads all documents of a file in the CISI format in a single sequential
+    pass.
+
+    Every record starts with ".I <doc id>" followed by fields which start with
+    a line like ".T" (title), ".A" (author, may occur several times), ".W"
+    (abstract) or ".X" (references). Only the title, authors and abstract are
+    kept. Line breaks inside a field are kept as well, so words on adjacent
+    lines are not joined.
+    """
+    doc_id = None
+    # Mapping from field name to the lines of the field.
+    fields: dict[str, list[str]] = {}
+    lines = None
+
+    def document() -> Document:
+        return Document(
+            doc_id,
+            "".join(fields.get("title", [])).strip(),
+            "".join(fields.get("author", [])).strip(),
+            "".join(fields.get("text", [])),
+        )
+
+    with _open(path) as f:
+        for line in f:
+            # Only lines starting with a dot can be markers.
+            marker = _CISI_MARKER.match(line) if line.startswith(".") else None
+            if marker is None:
+                if lines is not None:
+                    lines.append(line)
+                continue
+
+            if marker[1] is not None:
+                if doc_id is not None:
+                    yield document()
+                doc_id = int(marker[1])
+                fields = {}
+                lines = None
+            elif marker[2] in _CISI_FIELDS:
+                lines = fields.setdefault(_CISI_FIELDS[marker[2]], [])
+            else:
+                lines = None
+
+    if doc_id is not None:
+        yield document()
+
+
+def read_jsonl(path: str) -> Iterator[Document]:
+    """
+    Reads a corpus with one JSON object per line. Every object needs an "id"
+    and may contain "title", "author" and "text".
+    """
+    with _open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            obj = json.loads(line)
+            yield Document(
+                int(obj["id"]),
+                obj.get("title", ""),
+                obj.get("author", ""),
+                obj.get("text", ""),
+            )
+
+
+def read_corpus(path: str) -> Iterator[Document]:
+    """
+    Reads all documents of the corpus at `path`. Files ending with ".jsonl"
+    are read as JSONL, all other files as CISI format. Both may additionally
+    be compressed with gzip.
+    """
+    name = path[: -len(".gz")] if path.endswith(".gz") else path
+    if name.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_cisi(path)
+
+
+def unsorted_doc_id(path: str) -> Optional[int]:
+    """
+    Returns the first doc ID of the corpus at `path` which is not larger than
+    the doc ID before it, or `None` if the doc IDs are strictly ascending.
+    """
+    previous = None
+    for document in read_corpus(path):
+        if previous is not None and document.doc_id <= previous:
+            return document.doc_id
+        previous = document.doc_id
+    return None
@@ -0,0 +1,244 @@
+import bisect
+import heapq
+import sys
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, Optional, Sequence
+
+from index import PostingList
+
+# Doc ID of a cursor that has no more documents. It is larger than every doc
+# ID, so exhausted cursors sort last.
+NO_MORE_DOCS = sys.maxsize
+
+
+class Cursor(ABC):
+    """
+    Iterator over the sorted doc IDs matching a query, which only reads as
+    many postings as needed (document-at-a-time evaluation).
+
+    `doc_id` is the current doc ID, -1 before the first move and
+    `NO_MORE_DOCS` once the cursor is exhausted. `cost` estimates the number
+    of doc IDs the cursor can return, conjunctions let their cheapest operand
+    lead. `visited` counts the postings the cursor and its operands have read
+    so far.
+    """
+
+    doc_id: int = -1
+    cost: int = 0
+
+    @abstractmethod
+    def advance(self, target: int) -> int:
+        """
+        Moves to the first doc ID which is at least `target` and returns it.
+        The cursor does not move if it is already there.
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def visited(self) -> int:
+        pass
+
+    def next(self) -> int:
+        """Moves to the next doc ID and returns it."""
+        return self.advance(self.doc_id + 1)
+
+    def __iter__(self) -> Iterator[int]:
+        doc_id = self.next()
+        while doc_id != NO_MORE_DOCS:
+            yield doc_id
+            doc_id = self.next()
+
+
+class ListCursor(Cursor):
+    """
+    Cursor over a sorted list of doc IDs. `load` is only called on the first
+    move, so lists of operands that are never reached are not read at all.
+    Duplicate doc IDs are returned once.
+    """
+
+    def __init__(self, load: Callable[[], Sequence[int]], cost: int):
+        self._load = load
+        self._doc_ids: Optional[Sequence[int]] = None
+        self._i = 0
+        self._visited = 0
+        self.cost = cost
+
+    @staticmethod
+    def of(doc_ids: Sequence[int]) -> "ListCursor":
+        return ListCursor(lambda: doc_ids, len(doc_ids))
+
+    @property
+    def visited(self) -> int:
+        return self._visited
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc_id:
+            return self.doc_id
+        if self._doc_ids is None:
+            self._doc_ids = self._load()
+
+        # Galloping search from the current position, so skipping far ahead
+        # only reads O(log distance) doc IDs.
+        doc_ids = self._doc_ids
+        n = len(doc_ids)
+        lo = self._i
+        hi = lo
+        step = 1
+        while hi < n and doc_ids[hi] < target:
+            self._visited += 1
+            lo = hi + 1
+            hi = self._i + step
+            step *= 2
+        self._i = bisect.bisect_left(doc_ids, target, lo, min(hi, n))
+
+        if self._i == n:
+            self.doc_id = NO_MORE_DOCS
+        else:
+            self._visited += 1
+            self.doc_id = doc_ids[self._i]
+        return self.doc_id
+
+
+class PostingListCursor(ListCursor):
+    """
+    Cursor over the doc IDs of a posting list, which also gives access to the
+    positions of the term in the current document.
+    """
+
+    def __init__(self, load: Callable[[], Optional[PostingList]], cost: int):
+        self._posting_list: Optional[PostingList] = None
+
+        def load_doc_ids() -> Sequence[int]:
+            self._posting_list = load()
+            return self._posting_list.doc_ids if self._posting_list else ()
+
+        super().__init__(load_doc_ids, cost)
+
+    @property
+    def positions(self) -> Sequence[int]:
+        """Positions of the term in the current document."""
+        offsets = self._posting_list.offsets
+        return self._posting_list.positions[offsets[self._i] : offsets[self._i + 1]]
+
+
+class AndCursor(Cursor):
+    """
+    Conjunction of cursors. The operand with the lowest cost leads, the
+    others are only advanced to its doc IDs (leapfrog).
+    """
+
+    def __init__(self, cursors: list[Cursor]):
+        self._cursors = sorted(cursors, key=lambda x: x.cost)
+        self.cost = self._cursors[0].cost
+
+    @property
+    def visited(self) -> int:
+        return sum(x.visited for x in self._cursors)
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc_id:
+            return self.doc_id
+
+        lead, others = self._cursors[0], self._cursors[1:]
+        doc_id = lead.advance(target)
+        while doc_id != NO_MORE_DOCS:
+            for cursor in others:
+                other_doc_id = cursor.advance(doc_id)
+                if other_doc_id != doc_id:
+                    doc_id = lead.advance(other_doc_id)
+                    break
+            else:
+                break
+
+        self.doc_id = doc_id
+        return doc_id
+
+
+class OrCursor(Cursor):
+    """Disjunction of cursors, merged with a heap ordered by current doc ID."""
+
+    def __init__(self, cursors: list[Cursor]):
+        self._cursors = cursors
+        # (doc ID, cursor number) of every cursor, created on the first move.
+        self._heap: Optional[list[tuple[int, int]]] = None
+        self.cost = sum(x.cost for x in cursors)
+
+    @property
+    def visited(self) -> int:
+        return sum(x.visited for x in self._cursors)
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc_id:
+            return self.doc_id
+
+        if self._heap is None:
+            self._heap = [(x.advance(target), i) for i, x in enumerate(self._cursors)]
+            heapq.heapify(self._heap)
+
+        heap = self._heap
+        while heap[0][0] < target:
+            _, i = heap[0]
+            heapq.heapreplace(heap, (self._cursors[i].advance(target), i))
+
+        self.doc_id = heap[0][0]
+        return self.doc_id
+
+
+class AndNotCursor(Cursor):
+    """Doc IDs of `include` which are not returned by `exclude`."""
+
+    def __init__(self, include: Cursor, exclude: Cursor):
+        self._include = include
+        self._exclude = exclude
+        self.cost = include.cost
+
+    @property
+    def visited(self) -> int:
+        return self._include.visited + self._exclude.visited
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc_id:
+            return self.doc_id
+
+        doc_id = self._include.advance(target)
+        while doc_id != NO_MORE_DOCS and self._exclude.advance(doc_id) == doc_id:
+            doc_id = self._include.advance(doc_id + 1)
+
+        self.doc_id = doc_id
+        return doc_id
+
+
+class PositionalCursor(Cursor):
+    """
+    Documents which contain the terms of all `cursors` at positions accepted
+    by `matches`. `matches` is called with the positions of every term in the
+    candidate document, in the order of `cursors`.
+    """
+
+    def __init__(
+        self,
+        cursors: list[PostingListCursor],
+        matches: Callable[[list[Sequence[int]]], bool],
+    ):
+        self._cursors = cursors
+        self._candidates = AndCursor(cursors)
+        self._matches = matches
+        self.cost = self._candidates.cost
+
+    @property
+    def visited(self) -> int:
+        return self._candidates.visited
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc_id:
+            return self.doc_id
+
+        doc_id = self._candidates.advance(target)
+        while doc_id != NO_MORE_DOCS and not self._matches(
+            [x.positions for x in self._cursors]
+        ):
+            doc_id = self._candidates.advance(doc_id + 1)
+
+        self.doc_id = doc_id
+        return doc_id
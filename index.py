@@ -1,142 +1,525 @@
+import bisect
 import math
-from typing import Optional
+from abc import ABC, abstractmethod
+from array import array
+from typing import Iterable, Iterator, Optional, Sequence
 
 from Levenshtein import distance as lev
 
+from analyzer import Analyzer, is_biword
+from bitmap import Bitmap
 
-class IndexTerm:
-    def __init__(self, term: str, doc_id: int, pos: int):
-        self.term = term
-        self.doc_id = doc_id
-        self.position = pos
-        self.kgrams = []
+# Fields of a document that are indexed. Terms of the default field are stored
+# as they are, terms of the other fields are prefixed with the field name and
+# `FIELD_SEPARATOR`, e.g. "title:retrieval". Tokens never contain the
+# separator, so all fields share one term dictionary without collisions.
+DEFAULT_FIELD = "abstract"
+FIELDS = (DEFAULT_FIELD, "title", "author")
+FIELD_SEPARATOR = ":"
 
-    def __eq__(self, other):
-        return (
-            self.term == other.term
-            and self.doc_id == other.doc_id
-            and self.position == other.position
-            and self.kgrams == other.kgrams
-        )
 
-    def __hash__(self):
-        return hash((self.term, self.doc_id, self.position, tuple(self.kgrams)))
+def field_term(term: str, field: str = DEFAULT_FIELD) -> str:
+    """Returns the term under which `term` is stored in `field`."""
+    if field == DEFAULT_FIELD:
+        return term
+    return field + FIELD_SEPARATOR + term
 
-    def __repr__(self):
-        return f"{self.term}#{self.doc_id}#{self.kgrams}\n"
+
+def split_field_term(term: str) -> tuple[str, str]:
+    """Inverse of `field_term`, returns the field and the term."""
+    field, separator, rest = term.partition(FIELD_SEPARATOR)
+    if not separator:
+        return DEFAULT_FIELD, term
+    return field, rest
+
+
+def average_length(lengths: dict[int, int]) -> float:
+    """Returns the average of the document lengths `lengths`."""
+    return sum(lengths.values()) / len(lengths) if lengths else 0.0
 
 
 class PositionalPosting:
-    def __init__(self, doc_id: int, positions: list[int]):
+    """
+    A posting of a single document together with the positions of the term in
+    this document.
+    """
+
+    __slots__ = ("doc_id", "positions")
+
+    def __init__(self, doc_id: int, positions: Sequence[int]):
         self.doc_id = doc_id
         self.positions = positions
 
     def __repr__(self):
-        return f"{self.doc_id}:{self.positions}\n"
+        return f"{self.doc_id}:{list(self.positions)}\n"
 
 
 class PostingList:
-    def __init__(self, term: str, doc_freq: int, postings: list[PositionalPosting]):
+    """
+    All postings of a term stored in columns.
+
+    `doc_ids` holds the sorted doc IDs and `term_freqs` the number of
+    occurrences of the term in every document. The positions of all postings
+    are stored one after another in `positions`, where the positions of the
+    i-th posting are `positions[offsets[i] : offsets[i + 1]]`.
+    """
+
+    __slots__ = (
+        "term",
+        "doc_ids",
+        "term_freqs",
+        "positions",
+        "offsets",
+        "_postings",
+        "_bitmap",
+    )
+
+    def __init__(self, term: str, doc_ids: array, term_freqs: array, positions: array):
         self.term = term
-        self.doc_freq = doc_freq
-        self.postings = postings
-        self.doc_ids: set[int] = set()
-        # Mapping from doc_id to term frequency.
-        self._term_frequency: dict[int, int] = {}
-
-    def calculate_document_frequency(self):
-        self.doc_ids = set([posting.doc_id for posting in self.postings])
-
-    def calculate_term_frequency(self):
-        for posting in self.postings:
-            self._term_frequency[posting.doc_id] = math.log10(
-                len(posting.positions) + 1
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.positions = positions
+        self._postings: Optional[tuple[PositionalPosting, ...]] = None
+        self._bitmap: Optional[Bitmap] = None
+        self.offsets = array("I", [0])
+        offset = 0
+        for term_freq in term_freqs:
+            offset += term_freq
+            self.offsets.append(offset)
+
+    @staticmethod
+    def from_postings(
+        term: str, postings: Iterable[PositionalPosting]
+    ) -> "PostingList":
+        doc_ids, term_freqs, positions = array("I"), array("I"), array("I")
+        for posting in postings:
+            doc_ids.append(posting.doc_id)
+            term_freqs.append(len(posting.positions))
+            positions.extend(posting.positions)
+        return PostingList(term, doc_ids, term_freqs, positions)
+
+    @property
+    def doc_freq(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def postings(self) -> tuple[PositionalPosting, ...]:
+        """
+        Returns the postings as read-only sequence of objects sorted by doc
+        ID. The objects are only created on first access.
+        """
+        if self._postings is None:
+            self._postings = tuple(
+                PositionalPosting(doc_id, self.positions[start:end])
+                for doc_id, start, end in zip(
+                    self.doc_ids, self.offsets, self.offsets[1:]
+                )
             )
+        return self._postings
+
+    @property
+    def bitmap(self) -> Bitmap:
+        """
+        Returns the doc IDs as bitmap. The bitmap is only created on first
+        access.
+        """
+        if self._bitmap is None:
+            self._bitmap = Bitmap.from_doc_ids(self.doc_ids)
+        return self._bitmap
 
     def get_term_frequency(self, doc_id: int) -> float:
-        return self._term_frequency.get(doc_id, 0)
+        """Returns the logarithmically weighted term frequency in `doc_id`."""
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return 0
+        return math.log10(self.term_freqs[i] + 1)
+
+    def __len__(self):
+        return len(self.doc_ids)
 
     def __repr__(self):
         return f"{self.term}:{self.doc_freq} = {self.postings} \n"
 
 
 class IndexBuilder:
+    """
+    Builds an `Index` from a stream of documents.
+
+    The doc IDs, term frequencies and positions of a term are appended to
+    compact arrays while the documents are added, so building the index is
+    linear in the size of the corpus. Documents should be added in ascending
+    doc ID order, otherwise the postings have to be sorted in `build`.
+    """
+
     def __init__(self):
-        self._index: dict[IndexTerm, int] = {}
+        # Mapping from term to its doc IDs, term frequencies and positions.
+        self._postings: dict[str, tuple[array, array, array]] = {}
         # Mapping from doc id to doc length.
         self._doc_lengths: dict[int, int] = {}
-
-    def add(self, term: IndexTerm):
-        self._index[term] = self._index.get(term, 0) + 1
-
-    def set_doc_len(self, doc_id: int, length: int):
+        # Mapping from field to the mapping from doc id to field length.
+        self._field_lengths: dict[str, dict[int, int]] = {}
+        self._last_doc_id: Optional[int] = None
+        self._in_order = True
+
+    def add_document(
+        self,
+        doc_id: int,
+        tokens: Iterable[tuple[str, int]],
+        fields: Optional[dict[str, Iterable[tuple[str, int]]]] = None,
+    ) -> int:
+        """
+        Adds the `tokens` of the document `doc_id` and returns the length of
+        the document.
+
+        `tokens` are (token, position) pairs as returned by the tokenizer,
+        where positions start at 0. The index stores positions starting at 1.
+        `tokens` belong to the default field, `fields` maps the names of other
+        fields to their tokens.
+        """
+        if doc_id in self._doc_lengths:
+            raise ValueError(f"Document {doc_id} was already added")
+
+        if self._last_doc_id is not None and doc_id < self._last_doc_id:
+            self._in_order = False
+        self._last_doc_id = doc_id
+
+        length = self._add_field(doc_id, tokens, DEFAULT_FIELD)
         self._doc_lengths[doc_id] = length
 
-    def build(self):
-        # Mapping from (term.term, term.doc_id) to a list of positions.
-        positions_map = {}
-        for term in self._index.keys():
-            positions_map[(term.term, term.doc_id)] = positions_map.get(
-                (term.term, term.doc_id), []
-            ) + [term.position]
-
-        # Sort by term, then docID.
-        sorted_index = sorted(self._index.keys(), key=lambda k: (k.term, k.doc_id))
-
-        postings_lists: dict[str, PostingList] = {}
-
-        for term in sorted_index:
-            if (term.term, term.doc_id) not in positions_map:
-                continue
-
-            positions = positions_map[(term.term, term.doc_id)]
+        for field, field_tokens in (fields or {}).items():
+            field_lengths = self._field_lengths.setdefault(field, {})
+            field_lengths[doc_id] = self._add_field(doc_id, field_tokens, field)
+
+        return length
+
+    def _add_field(
+        self, doc_id: int, tokens: Iterable[tuple[str, int]], field: str
+    ) -> int:
+        """Adds the `tokens` of one field and returns the length of the field."""
+        # Mapping from term to its positions in this document.
+        doc_positions: dict[str, list[int]] = {}
+        length = 0
+
+        for token, pos in tokens:
+            positions = doc_positions.get(token)
+            if positions is None:
+                positions = doc_positions[token] = []
+            positions.append(pos + 1)
+            length = pos + 1
+
+        for token, positions in doc_positions.items():
+            term = field_term(token, field)
+            columns = self._postings.get(term)
+            if columns is None:
+                columns = self._postings[term] = (array("I"), array("I"), array("I"))
+            columns[0].append(doc_id)
+            columns[1].append(len(positions))
+            columns[2].extend(positions)
+
+        return length
+
+    def merge(self, other: "IndexBuilder"):
+        """
+        Appends the documents of `other` to this builder.
+
+        Merging builders that contain consecutive ranges of doc IDs in
+        ascending order results in the same index as adding all documents to
+        a single builder.
+        """
+        if self._doc_lengths.keys() & other._doc_lengths.keys():
+            raise ValueError("Cannot merge builders that share documents")
+
+        if other._doc_lengths:
+            first_doc_id = min(other._doc_lengths.keys())
+            if self._last_doc_id is not None and first_doc_id < self._last_doc_id:
+                self._in_order = False
+            self._in_order = self._in_order and other._in_order
+            self._last_doc_id = max(self._last_doc_id or 0, other._last_doc_id)
+
+        for term, columns in other._postings.items():
+            own_columns = self._postings.get(term)
+            if own_columns is None:
+                self._postings[term] = columns
+            else:
+                for own_column, column in zip(own_columns, columns):
+                    own_column.extend(column)
 
-            del positions_map[(term.term, term.doc_id)]
+        self._doc_lengths.update(other._doc_lengths)
+        for field, field_lengths in other._field_lengths.items():
+            self._field_lengths.setdefault(field, {}).update(field_lengths)
 
-            if term.term not in postings_lists:
-                postings_lists[term.term] = PostingList(
-                    term.term,
-                    1,
-                    [PositionalPosting(term.doc_id, positions)],
+    def build(self):
+        lexicon = Lexicon(sorted(self._postings.keys()))
+        posting_lists: list[PostingList] = []
+
+        for term in lexicon:
+            posting_list = PostingList(term, *self._postings[term])
+            if not self._in_order:
+                posting_list = PostingList.from_postings(
+                    term, sorted(posting_list.postings, key=lambda k: k.doc_id)
                 )
+            posting_lists.append(posting_list)
+
+        return Index(lexicon, posting_lists, self._doc_lengths, self._field_lengths)
+
+
+class Lexicon:
+    """
+    Term dictionary that assigns dense integer IDs to terms.
+
+    The ID of a term is its rank in the sorted list of all terms, so data per
+    term can be stored in lists indexed by the term ID and the term of an ID
+    is found without a search.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        """`terms` must be sorted and must not contain duplicates."""
+        self._terms = list(terms)
+        # Mapping from term to its ID.
+        self._ids = {term: term_id for term_id, term in enumerate(self._terms)}
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._terms)
+
+    def get_id(self, term: str) -> Optional[int]:
+        """Returns the ID of `term` or `None` if the term is unknown."""
+        return self._ids.get(term)
+
+    def get_term(self, term_id: int) -> str:
+        return self._terms[term_id]
+
+
+class IndexReader(ABC):
+    """
+    Read access to an index, independent of where the postings are stored.
+
+    Implementations provide the attributes `doc_ids` (sorted list of all doc
+    IDs with at least one posting in the default field), `doc_lengths`
+    (mapping from doc ID to doc length) and `avg_doc_length` for the default
+    field. `field_lengths` and `avg_field_lengths` contain the same statistics
+    for the other fields, keyed by field name. `analyzer` is the analyzer the
+    documents were indexed with, query terms have to be analyzed the same way.
+    `version` changes whenever the documents of the index change, so query
+    results can be cached as long as it stays the same.
+
+    Every term has a dense integer ID. Looking up a term by its ID avoids
+    hashing or comparing the term again, so queries resolve their terms to IDs
+    once and use the IDs afterwards.
+    """
+
+    doc_ids: list[int]
+    doc_lengths: dict[int, int]
+    avg_doc_length: float
+    field_lengths: dict[str, dict[int, int]]
+    avg_field_lengths: dict[str, float]
+    analyzer: Analyzer = Analyzer()
+    version: int = 0
+    _doc_id_bitmap: Optional[Bitmap] = None
+    _term_bitmaps: Optional[dict[int, Bitmap]] = None
+
+    def get_doc_id_bitmap(self) -> Bitmap:
+        """
+        Returns `doc_ids` as bitmap, e.g. to compute the complement of a
+        query. The bitmap is only created on first use.
+        """
+        if self._doc_id_bitmap is None:
+            self._doc_id_bitmap = Bitmap.from_doc_ids(self.doc_ids)
+        return self._doc_id_bitmap
+
+    def get_bitmap_by_id(self, term_id: int) -> Bitmap:
+        """
+        Returns the doc IDs of the term `term_id` as bitmap. Bitmaps are kept
+        by term ID for the lifetime of the index, so they are only meant for
+        dense terms, which are then converted once instead of in every query.
+        """
+        if self._term_bitmaps is None:
+            self._term_bitmaps = {}
+        bitmap = self._term_bitmaps.get(term_id)
+        if bitmap is None:
+            posting_list = self.get_posting_list_by_id(term_id)
+            if posting_list is None:
+                bitmap = Bitmap.from_doc_ids([])
             else:
-                postings_lists[term.term].doc_freq += 1
-                postings_lists[term.term].postings.append(
-                    PositionalPosting(term.doc_id, positions)
-                )
-
-        for posting_list in postings_lists.values():
-            posting_list.calculate_document_frequency()
-            posting_list.calculate_term_frequency()
-
-        return Index(postings_lists, self._doc_lengths)
-
+                bitmap = posting_list.bitmap
+            self._term_bitmaps[term_id] = bitmap
+        return bitmap
+
+    def get_field_lengths(self, field: str) -> tuple[dict[int, int], float]:
+        """
+        Returns the mapping from doc ID to the length of `field` and the
+        average length of the field.
+        """
+        if field == DEFAULT_FIELD:
+            return self.doc_lengths, self.avg_doc_length
+        return self.field_lengths.get(field, {}), self.avg_field_lengths.get(field, 0.0)
+
+    @abstractmethod
+    def terms(self) -> Iterator[str]:
+        """Returns an iterator over all terms in the index in ID order."""
+        pass
+
+    @abstractmethod
+    def get_term_id(self, term: str) -> Optional[int]:
+        """Returns the ID of `term` or `None` if the term is not indexed."""
+        pass
+
+    @abstractmethod
+    def get_term(self, term_id: int) -> str:
+        """Returns the term with the ID `term_id`."""
+        pass
+
+    @abstractmethod
+    def get_posting_list_by_id(self, term_id: int) -> Optional[PostingList]:
+        """
+        Returns the posting list of the term `term_id` or `None` if the term
+        has no postings.
+        """
+        pass
+
+    def get_doc_freq_by_id(self, term_id: int) -> int:
+        """
+        Returns the number of documents containing the term `term_id`.
+        Implementations can answer this without decoding the postings.
+        """
+        posting_list = self.get_posting_list_by_id(term_id)
+        return 0 if posting_list is None else posting_list.doc_freq
+
+    def get_doc_freq(self, term: str) -> int:
+        """Returns the number of documents containing `term`."""
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return 0
+        return self.get_doc_freq_by_id(term_id)
+
+    def get_positional_postings(self, term: str) -> Sequence[PositionalPosting]:
+        """Returns the postings of `term` as read-only sequence sorted by doc ID."""
+        posting_list = self.get_posting_list(term)
+        if posting_list is None:
+            return ()
+        return posting_list.postings
 
-class Index:
-    def __init__(self, entries: dict[str, PostingList], doc_lengths: dict[int, int]):
-        self._index = entries
-        self.doc_ids = sorted(
-            set(
-                [
-                    postings.doc_id
-                    for posting_list in entries.values()
-                    for postings in posting_list.postings
-                ]
-            )
-        )
+    def get_posting_list(self, term: str) -> Optional[PostingList]:
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        return self.get_posting_list_by_id(term_id)
+
+
+class Index(IndexReader):
+    def __init__(
+        self,
+        lexicon: Lexicon,
+        posting_lists: list[PostingList],
+        doc_lengths: dict[int, int],
+        field_lengths: Optional[dict[str, dict[int, int]]] = None,
+    ):
+        self._lexicon = lexicon
+        # Posting lists indexed by term ID, sorted by doc ID when the index is
+        # built.
+        self._posting_lists = posting_lists
+        self.doc_ids = sorted(x for x, length in doc_lengths.items() if length > 0)
         self.doc_lengths = doc_lengths
-        self.avg_doc_length = sum(doc_lengths.values()) / len(doc_lengths)
+        self.avg_doc_length = average_length(doc_lengths)
+        self.field_lengths = field_lengths or {}
+        self.avg_field_lengths = {
+            field: average_length(lengths)
+            for field, lengths in self.field_lengths.items()
+        }
 
     def __repr__(self):
-        return f"{self._index}\n"
-
-    def get_positional_postings(self, term: str) -> list[PositionalPosting]:
-        if term not in self._index:
-            return []
-        return sorted(self._index[term].postings, key=lambda k: k.doc_id)
+        return f"Index({len(self._lexicon)} terms, {len(self.doc_ids)} docs)\n"
+
+    def terms(self) -> Iterator[str]:
+        return iter(self._lexicon)
+
+    def get_term_id(self, term: str) -> Optional[int]:
+        return self._lexicon.get_id(term)
+
+    def get_term(self, term_id: int) -> str:
+        return self._lexicon.get_term(term_id)
+
+    def get_posting_list_by_id(self, term_id: int) -> Optional[PostingList]:
+        return self._posting_lists[term_id]
+
+
+class CachingIndexReader(IndexReader):
+    """
+    Wraps an index for the evaluation of a single query.
+
+    Every term is resolved to its ID and looked up in the wrapped index only
+    once, even if it occurs several times in the query. `postings_scanned`
+    counts the postings handed out to the query, `lookups` the number of
+    requested posting lists and `cache_hits` how many of them were answered
+    from the cache.
+    """
+
+    def __init__(self, index: IndexReader):
+        self._wrapped = index
+        self.analyzer = index.analyzer
+        self.version = index.version
+        self.doc_ids = index.doc_ids
+        self.doc_lengths = index.doc_lengths
+        self.avg_doc_length = index.avg_doc_length
+        self.field_lengths = index.field_lengths
+        self.avg_field_lengths = index.avg_field_lengths
+        # Mapping from term to its ID, `None` if the term does not exist.
+        self._term_ids: dict[str, Optional[int]] = {}
+        # Mapping from term ID to its posting list.
+        self._cache: dict[int, Optional[PostingList]] = {}
+        self.postings_scanned = 0
+        self.lookups = 0
+        self.cache_hits = 0
+
+    def terms(self) -> Iterator[str]:
+        return self._wrapped.terms()
+
+    def get_term_id(self, term: str) -> Optional[int]:
+        if term not in self._term_ids:
+            self._term_ids[term] = self._wrapped.get_term_id(term)
+        return self._term_ids[term]
+
+    def get_term(self, term_id: int) -> str:
+        return self._wrapped.get_term(term_id)
 
     def get_posting_list(self, term: str) -> Optional[PostingList]:
-        return self._index.get(term, None)
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            self.lookups += 1
+            return None
+        return self.get_posting_list_by_id(term_id)
+
+    def get_posting_list_by_id(self, term_id: int) -> Optional[PostingList]:
+        self.lookups += 1
+        if term_id in self._cache:
+            self.cache_hits += 1
+            posting_list = self._cache[term_id]
+        else:
+            posting_list = self._wrapped.get_posting_list_by_id(term_id)
+            self._cache[term_id] = posting_list
+
+        if posting_list is not None:
+            self.postings_scanned += posting_list.doc_freq
+        return posting_list
+
+    def get_doc_id_bitmap(self) -> Bitmap:
+        return self._wrapped.get_doc_id_bitmap()
+
+    def get_bitmap_by_id(self, term_id: int) -> Bitmap:
+        # Bitmaps are cached by the wrapped index across queries, so no
+        # postings are scanned for them.
+        self.lookups += 1
+        return self._wrapped.get_bitmap_by_id(term_id)
+
+    def get_doc_freq_by_id(self, term_id: int) -> int:
+        # Document frequencies are not counted as lookups, they do not hand
+        # out postings.
+        posting_list = self._cache.get(term_id)
+        if posting_list is not None:
+            return posting_list.doc_freq
+        return self._wrapped.get_doc_freq_by_id(term_id)
 
 
 # Klasse für die KGramm Index
@@ -164,11 +547,18 @@ class KGramIndex:
             ):
                 self._kgrams.append({"k": kgram, "values": []})
 
-    def setKGramValues(self, termList: Index):
+    def setKGramValues(self, termList: IndexReader, field: str = DEFAULT_FIELD):
         # for val in range(0, len(termList) - 1):
         idx = 0
+        # Nur Terme aus dem Feld der Anfrage kommen als Korrektur in Frage,
+        # Biwörter nie.
+        terms = [
+            term
+            for term_field, term in map(split_field_term, termList.terms())
+            if term_field == field and not is_biword(term)
+        ]
         for k in self._kgrams:
-            possbileValues = [d for d in termList._index if k["k"] in d]
+            possbileValues = [d for d in terms if k["k"] in d]
             if len(possbileValues) > 0:
                 if possbileValues not in k["values"]:
                     for val in possbileValues:
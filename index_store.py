@@ -0,0 +1,419 @@
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator, Optional
+
+import vbyte
+from index import IndexReader, PostingList, average_length
+
+# Every index file starts with this magic value followed by the format version.
+# The version must be increased whenever the layout of the file changes, so
+# that old files get rebuilt instead of being read incorrectly.
+MAGIC = b"WPPIDX"
+FORMAT_VERSION = 4
+
+# Layout of an index file (all integers are little endian):
+#
+#   header        see `_HEADER`
+#   fingerprint   utf-8 encoded corpus fingerprint
+#   postings      for every term: doc_freq, then the doc IDs, the term
+#                 frequencies and the positions of all postings one
+#                 after another (uint32). With `FLAG_VBYTE` set, doc
+#                 IDs and the positions of each posting are stored as
+#                 gaps and all values are variable byte encoded.
+#   term offsets  n_terms + 1 uint32 offsets into the term blob
+#   term blob     all terms utf-8 encoded and sorted
+#   offsets       n_terms + 1 uint64 offsets into the postings section
+#   docs          n_docs doc IDs, n_docs doc lengths, then the number
+#                 of doc IDs with at least one posting and these doc
+#                 IDs (uint32)
+#   fields        number of fields other than the default field, then
+#                 for every field the length of its name, the utf-8
+#                 encoded name padded to 4 bytes and n_docs field
+#                 lengths in the order of the doc IDs (uint32)
+#
+# Every section after the fingerprint starts at a multiple of 8 bytes. The
+# header ends with a flags field for format options.
+_HEADER = struct.Struct("<6sHHdQQQQQQQQ")
+
+FLAG_VBYTE = 1
+
+_UINT32 = struct.Struct("<I")
+
+
+class IndexFormatError(Exception):
+    """Raised when an index file is damaged or has an unsupported version."""
+
+
+def corpus_fingerprint(path: str) -> str:
+    """
+    Returns a fingerprint of the corpus file at `path`.
+
+    The fingerprint only depends on the file name, size and modification
+    time, so it can be computed without reading the documents. A missing
+    file has a fingerprint as well, which differs from that of every
+    existing file.
+    """
+    digest = hashlib.sha1()
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        digest.update(
+            f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+        )
+    return digest.hexdigest()
+
+
+def _to_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+class IndexWriter:
+    """
+    Writes an index file term by term, so the whole index never has to be
+    held in memory. Terms must be added in sorted order.
+
+    If `compress` is set, the postings are stored as variable byte encoded
+    gaps. After writing, `raw_postings_bytes` and `postings_bytes` contain the
+    size of the postings without and with compression.
+
+    Usage:
+        with IndexWriter(path, fingerprint) as writer:
+            writer.add_term(term, doc_ids, counts, positions)
+            ...
+            writer.set_documents(doc_lengths)
+    """
+
+    def __init__(self, path: str, fingerprint: str, compress: bool = False):
+        self._path = path
+        self._tmp_path = path + ".tmp"
+        self._fingerprint = fingerprint.encode()
+        self._flags = FLAG_VBYTE if compress else 0
+        self.raw_postings_bytes = 0
+        self.postings_bytes = 0
+        self._f = open(self._tmp_path, "wb")
+        self._terms: list[bytes] = []
+        self._offsets = array("Q", [0])
+        self._doc_lengths: dict[int, int] = {}
+        self._field_lengths: dict[str, dict[int, int]] = {}
+
+        # The header is written last, when all section offsets are known.
+        self._f.write(b"\0" * _HEADER.size)
+        self._f.write(self._fingerprint)
+        _pad(self._f)
+        self._postings_off = self._f.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp_path)
+
+    def add_term(self, term: str, doc_ids: array, term_freqs: array, positions: array):
+        """
+        Adds the postings of `term`. `doc_ids` are sorted, `term_freqs`
+        contains the number of positions per doc ID and `positions` the
+        positions of all postings one after another.
+        """
+        encoded = term.encode()
+        if self._terms and encoded <= self._terms[-1]:
+            raise ValueError(f'Term "{term}" was not added in sorted order')
+
+        if self._flags & FLAG_VBYTE:
+            data = bytearray()
+            vbyte.encode([len(doc_ids)], data)
+            vbyte.encode(vbyte.gaps(doc_ids), data)
+            vbyte.encode(term_freqs, data)
+            offset = 0
+            for term_freq in term_freqs:
+                vbyte.encode(vbyte.gaps(positions[offset : offset + term_freq]), data)
+                offset += term_freq
+        else:
+            data = _to_bytes(
+                array("I", [len(doc_ids)]) + doc_ids + term_freqs + positions
+            )
+
+        self._f.write(data)
+        self.raw_postings_bytes += (1 + 2 * len(doc_ids) + len(positions)) * 4
+        self.postings_bytes += len(data)
+        self._terms.append(encoded)
+        self._offsets.append(self._f.tell() - self._postings_off)
+
+    def set_documents(
+        self,
+        doc_lengths: dict[int, int],
+        field_lengths: Optional[dict[str, dict[int, int]]] = None,
+    ):
+        """
+        Sets the mapping from doc ID to doc length and, for every field other
+        than the default field, the mapping from doc ID to field length.
+        """
+        self._doc_lengths = doc_lengths
+        self._field_lengths = field_lengths or {}
+
+    def close(self):
+        f = self._f
+        _pad(f)
+
+        term_offsets = array("I", [0])
+        for term in self._terms:
+            term_offsets.append(term_offsets[-1] + len(term))
+
+        terms_off = f.tell()
+        f.write(_to_bytes(term_offsets))
+        f.write(b"".join(self._terms))
+        _pad(f)
+
+        offsets_off = f.tell()
+        f.write(_to_bytes(self._offsets))
+
+        # Every document with at least one token has at least one posting.
+        all_doc_ids = sorted(self._doc_lengths.keys())
+        doc_ids = [x for x in all_doc_ids if self._doc_lengths[x] > 0]
+        avg_doc_length = average_length(self._doc_lengths)
+
+        docs_off = f.tell()
+        f.write(_to_bytes(array("I", all_doc_ids)))
+        f.write(_to_bytes(array("I", [self._doc_lengths[x] for x in all_doc_ids])))
+        f.write(_to_bytes(array("I", [len(doc_ids)])))
+        f.write(_to_bytes(array("I", doc_ids)))
+        _pad(f)
+
+        fields_off = f.tell()
+        f.write(_to_bytes(array("I", [len(self._field_lengths)])))
+        for field in sorted(self._field_lengths.keys()):
+            name = field.encode()
+            f.write(_to_bytes(array("I", [len(name)])))
+            f.write(name + b"\0" * (-len(name) % 4))
+            lengths = self._field_lengths[field]
+            f.write(_to_bytes(array("I", [lengths.get(x, 0) for x in all_doc_ids])))
+
+        f.seek(0)
+        f.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                len(self._fingerprint),
+                avg_doc_length,
+                len(self._terms),
+                len(all_doc_ids),
+                self._postings_off,
+                terms_off,
+                offsets_off,
+                docs_off,
+                fields_off,
+                self._flags,
+            )
+        )
+        f.close()
+
+        # Replace the old file atomically so a concurrent reader never sees a
+        # partially written index.
+        os.replace(self._tmp_path, self._path)
+
+
+def save_index(
+    index: IndexReader, path: str, fingerprint: str, compress: bool = False
+) -> IndexWriter:
+    """
+    Serializes `index` into the file at `path` and returns the writer, which
+    holds the size of the postings.
+
+    `fingerprint` identifies the corpus the index was built from. If
+    `compress` is set, the postings are variable byte encoded.
+    """
+    with IndexWriter(path, fingerprint, compress) as writer:
+        for term in sorted(index.terms()):
+            posting_list = index.get_posting_list(term)
+            writer.add_term(
+                term,
+                posting_list.doc_ids,
+                posting_list.term_freqs,
+                posting_list.positions,
+            )
+        writer.set_documents(index.doc_lengths, index.field_lengths)
+
+    return writer
+
+
+class MappedIndex(IndexReader):
+    """
+    Read-only index that is backed by a memory mapped index file.
+
+    Opening the file only reads the header and the document table. The
+    postings of a term are decoded when they are requested, so the cost of a
+    query only depends on the terms it touches. Processes reading the same
+    file share its pages through the page cache.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise IndexFormatError(f'"{path}" is empty') from e
+
+        if len(self._mm) < _HEADER.size:
+            raise IndexFormatError(f'"{path}" is not an index file')
+
+        (
+            magic,
+            version,
+            fingerprint_len,
+            self.avg_doc_length,
+            self._num_terms,
+            num_docs,
+            self._postings_off,
+            self._terms_off,
+            self._offsets_off,
+            docs_off,
+            fields_off,
+            flags,
+        ) = _HEADER.unpack_from(self._mm, 0)
+
+        if magic != MAGIC:
+            raise IndexFormatError(f'"{path}" is not an index file')
+        if version != FORMAT_VERSION:
+            raise IndexFormatError(
+                f'"{path}" has format version {version}, expected {FORMAT_VERSION}'
+            )
+
+        self.compressed = bool(flags & FLAG_VBYTE)
+        self.fingerprint = self._mm[
+            _HEADER.size : _HEADER.size + fingerprint_len
+        ].decode()
+
+        # Start of the term blob, which follows the term offsets.
+        self._term_blob_off = self._terms_off + (self._num_terms + 1) * 4
+
+        doc_table = _from_bytes("I", self._mm[docs_off : docs_off + num_docs * 8])
+        self.doc_lengths = dict(zip(doc_table[:num_docs], doc_table[num_docs:]))
+
+        num_doc_ids_off = docs_off + num_docs * 8
+        (num_doc_ids,) = _UINT32.unpack_from(self._mm, num_doc_ids_off)
+        self.doc_ids = _from_bytes(
+            "I", self._mm[num_doc_ids_off + 4 : num_doc_ids_off + 4 + num_doc_ids * 4]
+        ).tolist()
+
+        self.field_lengths: dict[str, dict[int, int]] = {}
+        (num_fields,) = _UINT32.unpack_from(self._mm, fields_off)
+        offset = fields_off + 4
+        for _ in range(num_fields):
+            (name_len,) = _UINT32.unpack_from(self._mm, offset)
+            name = self._mm[offset + 4 : offset + 4 + name_len].decode()
+            offset += 4 + name_len + (-name_len % 4)
+            lengths = _from_bytes("I", self._mm[offset : offset + num_docs * 4])
+            self.field_lengths[name] = dict(zip(doc_table[:num_docs], lengths))
+            offset += num_docs * 4
+        self.avg_field_lengths = {
+            field: average_length(lengths)
+            for field, lengths in self.field_lengths.items()
+        }
+
+    def __repr__(self):
+        return f"MappedIndex({self._num_terms} terms, {len(self.doc_ids)} docs)\n"
+
+    def _term_at(self, i: int) -> bytes:
+        start, end = struct.unpack_from("<II", self._mm, self._terms_off + i * 4)
+        return self._mm[self._term_blob_off + start : self._term_blob_off + end]
+
+    def get_term_id(self, term: str) -> Optional[int]:
+        # The ID of a term is its index in the sorted term dictionary, so it
+        # is found by binary search.
+        key = term.encode()
+        lo, hi = 0, self._num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._num_terms and self._term_at(lo) == key:
+            return lo
+        return None
+
+    def _decode(self, term: str, term_id: int) -> PostingList:
+        start, end = struct.unpack_from(
+            "<QQ", self._mm, self._offsets_off + term_id * 8
+        )
+        data = self._mm[self._postings_off + start : self._postings_off + end]
+
+        if self.compressed:
+            return self._decode_compressed(term, vbyte.decode(data))
+
+        values = _from_bytes("I", data)
+        doc_freq = values[0]
+        return PostingList(
+            term,
+            values[1 : 1 + doc_freq],
+            values[1 + doc_freq : 1 + 2 * doc_freq],
+            values[1 + 2 * doc_freq :],
+        )
+
+    def _decode_compressed(self, term: str, values: list[int]) -> PostingList:
+        doc_freq = values[0]
+        doc_ids = array("I", itertools.accumulate(values[1 : 1 + doc_freq]))
+        term_freqs = array("I", values[1 + doc_freq : 1 + 2 * doc_freq])
+
+        positions = array("I")
+        offset = 1 + 2 * doc_freq
+        for term_freq in term_freqs:
+            positions.extend(itertools.accumulate(values[offset : offset + term_freq]))
+            offset += term_freq
+
+        return PostingList(term, doc_ids, term_freqs, positions)
+
+    @property
+    def postings_bytes(self) -> int:
+        """Size of the postings section in bytes."""
+        (end,) = struct.unpack_from(
+            "<Q", self._mm, self._offsets_off + self._num_terms * 8
+        )
+        return end
+
+    def get_postings_bytes_by_id(self, term_id: int) -> int:
+        """Size of the postings of the term `term_id` in bytes."""
+        start, end = struct.unpack_from(
+            "<QQ", self._mm, self._offsets_off + term_id * 8
+        )
+        return end - start
+
+    def terms(self) -> Iterator[str]:
+        for i in range(self._num_terms):
+            yield self._term_at(i).decode()
+
+    def get_term(self, term_id: int) -> str:
+        return self._term_at(term_id).decode()
+
+    def get_posting_list_by_id(self, term_id: int) -> Optional[PostingList]:
+        return self._decode(self.get_term(term_id), term_id)
+
+    def get_doc_freq_by_id(self, term_id: int) -> int:
+        # The postings of every term start with its document frequency.
+        (start,) = struct.unpack_from("<Q", self._mm, self._offsets_off + term_id * 8)
+        offset = self._postings_off + start
+        if self.compressed:
+            return vbyte.decode_first(self._mm, offset)
+        return _UINT32.unpack_from(self._mm, offset)[0]
@@ -1,6 +1,8 @@
-import itertools
+import re
 from enum import Enum
-from typing import Iterator
+from typing import Iterator, Optional
+
+from index import DEFAULT_FIELD, FIELDS
 
 
 class TokenType(Enum):
@@ -12,6 +14,7 @@ class TokenType(Enum):
     OR = 7
     NOT = 8
     TERM = 9
+    FIELD = 10
 
 
 class Token:
@@ -30,49 +33,51 @@ class Token:
         return f"{self.pos}-{self.end} {self.type} {self.value}"
 
 
+class QuerySyntaxError(ValueError):
+    """Raised when a query cannot be parsed."""
+
+
+# Tokens of a query in one pass. A phrase ends at the next quote or at the end
+# of the query, a field name must be directly followed by a colon and
+# characters which cannot start a token, like ":", are skipped.
+_TOKEN = re.compile(
+    r'"(?P<phrase>[^"]*)"?'
+    r"|(?P<lparen>\()"
+    r"|(?P<rparen>\))"
+    r"|/(?P<prox_k>\d+)"
+    r"|(?P<field>" + "|".join(map(re.escape, FIELDS)) + r"):"
+    r"|(?P<word>[^\W_]+)"
+    r"|\s+|.",
+    re.DOTALL,
+)
+
+_TOKEN_TYPES = {
+    "phrase": TokenType.PHRASE,
+    "lparen": TokenType.LPAREN,
+    "rparen": TokenType.RPAREN,
+    "prox_k": TokenType.PROX_K,
+    "field": TokenType.FIELD,
+}
+
+_OPERATORS = {"AND": TokenType.AND, "OR": TokenType.OR, "NOT": TokenType.NOT}
+
+
 def lex(input: str) -> Iterator[Token]:
     """
-    Tokenizes the input string.
+    Tokenizes the input string in a single pass, so the cost is linear in its
+    length.
     """
-    i = 0
-    c = None
-
-    while i < len(input):
-        c = input[i]
-
-        if c == '"':
-            phrase = "".join(itertools.takewhile(lambda x: x != '"', input[i + 1 :]))
-            j = i
-            i += len(phrase) + 2
-            yield Token(j, phrase, TokenType.PHRASE)
-        elif c == "(":
-            yield Token(i, c, TokenType.LPAREN)
-        elif c == ")":
-            yield Token(i, c, TokenType.RPAREN)
-        elif c.isspace():
-            pass
-        elif c == "/" and i + 1 < len(input):
-            k = "".join(itertools.takewhile(lambda x: x.isdigit(), input[i + 1 :]))
-            chars = Token(i, k, TokenType.PROX_K)
-            i += len(k)
-            yield chars
+    for match in _TOKEN.finditer(input):
+        group = match.lastgroup
+        if group is None:
+            continue
+
+        value = match.group(group)
+        if group == "word":
+            type = _OPERATORS.get(value, TokenType.TERM)
         else:
-            chars = "".join(itertools.takewhile(lambda x: x.isalnum(), input[i:]))
-
-            j = i
-            i += len(chars) - 1
-
-            match chars:
-                case "AND":
-                    yield Token(j, chars, TokenType.AND)
-                case "OR":
-                    yield Token(j, chars, TokenType.OR)
-                case "NOT":
-                    yield Token(j, chars, TokenType.NOT)
-                case _:
-                    yield Token(j, chars, TokenType.TERM)
-
-        i += 1
+            type = _TOKEN_TYPES[group]
+        yield Token(match.start(), value, type)
 
 
 class QueryType(Enum):
@@ -83,6 +88,10 @@ class QueryType(Enum):
     GROUP = 5
 
 
+def _field_prefix(field: str) -> str:
+    return "" if field == DEFAULT_FIELD else f"{field}:"
+
+
 class Query:
     """
     Represents one independent query.
@@ -100,18 +109,21 @@ class Query:
 
 class TermQuery(Query):
     """
-    Represents the easiest query, a single term query.
+    Represents the easiest query, a single term query. The term is searched
+    in `field`.
 
     Example:
         term1
+        title:term1
     """
 
-    def __init__(self, term: str):
+    def __init__(self, term: str, field: str = DEFAULT_FIELD):
         super().__init__(QueryType.TERM)
         self.term = term
+        self.field = field
 
     def __repr__(self) -> str:
-        return super().__repr__() + str(self.term)
+        return super().__repr__() + _field_prefix(self.field) + str(self.term)
 
 
 class ProxQuery(Query):
@@ -134,19 +146,21 @@ class ProxQuery(Query):
 
 class PhraseQuery(Query):
     """
-    Represents a phrase query.
+    Represents a phrase query. The phrase is searched in `field`.
 
     Example:
         "term1 term2"
+        title:"term1 term2"
     """
 
-    def __init__(self, phrase: str):
+    def __init__(self, phrase: str, field: str = DEFAULT_FIELD):
         super().__init__(QueryType.PHRASE)
         self.phrase = phrase
         self.parts = phrase.split()
+        self.field = field
 
     def __repr__(self) -> str:
-        return super().__repr__() + f'"{self.phrase}"'
+        return super().__repr__() + _field_prefix(self.field) + f'"{self.phrase}"'
 
 
 class OrQuery(Query):
@@ -185,112 +199,127 @@ class GroupQuery(Query):
 
 def parse(input: str) -> list[Query]:
     """
-    Parses the input string into a list of queries.
-    """
-    tokens = list(lex(input))
-    return _parse_internal(tokens)
+    Parses the input string into a list of queries, which all have to match.
 
+    OR binds tighter than AND, NOT only applies to the next term, phrase,
+    proximity query or group and terms without an operator between them are
+    combined with AND. E.g. "a AND NOT b OR c d" is parsed into the queries
+    `a`, `NOT b OR c` and `d`.
 
-def _parse_internal(tokens):
-    """
-    Internal implementation to parse the input string into a list of queries.
+    Raises `QuerySyntaxError` if the query is malformed, e.g. because of an
+    unbalanced parenthesis or a missing operand.
     """
-    and_queries = []
-    query_part = None
-    negate = False
-    i = 0
+    return _Parser(list(lex(input))).parse()
 
-    def add_query(query):
-        nonlocal negate
-        nonlocal query_part
 
-        if negate:
-            query.is_not = True
+# Tokens an operand can start with. An operand directly following another one
+# is combined with it by AND.
+_OPERAND_START = {
+    TokenType.LPAREN,
+    TokenType.PHRASE,
+    TokenType.NOT,
+    TokenType.TERM,
+    TokenType.FIELD,
+}
+
+
+class _Parser:
+    """
+    Recursive descent parser over the tokens of a query with one method per
+    precedence level. Every token is only looked at once and the operands of
+    AND and OR are collected in one list each, so the cost is linear in the
+    number of tokens.
+    """
 
+    def __init__(self, tokens: list[Token]):
+        self._tokens = tokens
+        self._i = 0
+
+    def _peek(self) -> Optional[Token]:
+        return self._tokens[self._i] if self._i < len(self._tokens) else None
+
+    def _next(self) -> Token:
+        token = self._peek()
+        if token is None:
+            raise QuerySyntaxError("Unexpected end of query")
+        self._i += 1
+        return token
+
+    def _accept(self, type: TokenType) -> bool:
+        """Skips the next token if it has type `type`."""
+        token = self._peek()
+        if token is None or token.type != type:
+            return False
+        self._i += 1
+        return True
+
+    def parse(self) -> list[Query]:
+        if not self._tokens:
+            return []
+
+        and_queries = self._conjunction()
+        token = self._peek()
+        if token is not None:
+            raise QuerySyntaxError(
+                f'Unexpected "{token.value}" at position {token.pos}'
+            )
+        return and_queries
+
+    def _conjunction(self) -> list[Query]:
+        and_queries = [self._disjunction()]
+        while True:
+            if not self._accept(TokenType.AND):
+                token = self._peek()
+                if token is None or token.type not in _OPERAND_START:
+                    return and_queries
+            and_queries.append(self._disjunction())
+
+    def _disjunction(self) -> Query:
+        parts = [self._unary()]
+        while self._accept(TokenType.OR):
+            parts.append(self._unary())
+        return parts[0] if len(parts) == 1 else OrQuery(*parts)
+
+    def _unary(self) -> Query:
+        # NOT NOT a is a.
         negate = False
-        and_queries.append(query)
-        query_part = None
-
-    while i < len(tokens):
-        t = tokens[i]
-
-        match t.type:
-            case TokenType.NOT:
-                negate = not negate
-            case TokenType.AND:
-                add_query(query_part)
-            case TokenType.OR:
-                # Parse until the next AND token or until the end if no next AND token exists.
-                # This means that we could parse many other OR queries, that's why we
-                # flatten the result further down to have one OR query with many single queries
-                # instead of many nested OR queries.
-                idx_next_and = None
-                for j in range(i + 1, len(tokens)):
-                    if tokens[j].type == TokenType.AND:
-                        idx_next_and = j
-                        break
-
-                or_queries = []
-                processed_tokens = None
-
-                if idx_next_and is not None:
-                    or_queries = _parse_internal(tokens[i + 1 : idx_next_and])
-                    processed_tokens = len(tokens[i + 1 : idx_next_and])
-                else:
-                    or_queries = _parse_internal(tokens[i + 1 :])
-                    processed_tokens = len(tokens[i + 1 :])
-
-                flattened = []
-
-                def flatten(or_query_parts):
-                    for part in or_query_parts:
-                        if part.type == QueryType.OR:
-                            flatten(part.parts)
-                        else:
-                            flattened.append(part)
-
-                flatten(or_queries)
-                i += processed_tokens
-
-                query_part.is_not = negate
-                negate = False
-
-                flattened.insert(0, query_part)
-                query_part = OrQuery(*flattened)
-
-            case TokenType.PROX_K:
-                query_part = ProxQuery(
-                    query_part, TermQuery(tokens[i + 1].value), int(t.value)
-                )
-                i += 1
-            case TokenType.PHRASE:
-                query_part = PhraseQuery(t.value)
-            case TokenType.TERM:
-                query_part = TermQuery(t.value)
-            case TokenType.LPAREN:
-                # Recursively parse until we find the closing parantheses.
-                idx_rparen = None
-                for j in range(i + 1, len(tokens)):
-                    if tokens[j].type == TokenType.RPAREN:
-                        idx_rparen = j
-                        break
-
-                paren_queries = _parse_internal(tokens[i + 1 : idx_rparen])
-                processed_tokens = len(tokens[i + 1 : idx_rparen])
-                query_part = GroupQuery(*paren_queries)
-                query_part.is_not = negate
-                negate = False
-                i += processed_tokens
-            case TokenType.RPAREN:
-                # Not needed.
-                # Handled already above, just hear for clarity.
-                pass
-
-        i += 1
-
-    # We only add to the list when encountering an `AND` token.
-    # So we have to manually add the last query part.
-    if query_part is not None:
-        add_query(query_part)
-
-    return and_queries
+        while self._accept(TokenType.NOT):
+            negate = not negate
+
+        query = self._operand()
+        query.is_not = negate
+        return query
+
+    def _operand(self) -> Query:
+        token = self._peek()
+        if self._accept(TokenType.LPAREN):
+            and_queries = self._conjunction()
+            if not self._accept(TokenType.RPAREN):
+                raise QuerySyntaxError(f'Missing ")" for "(" at position {token.pos}')
+            return GroupQuery(*and_queries)
+
+        query = self._term_or_phrase()
+        prox = self._peek()
+        if not self._accept(TokenType.PROX_K):
+            return query
+
+        term_b = self._term_or_phrase()
+        if query.type != QueryType.TERM or term_b.type != QueryType.TERM:
+            raise QuerySyntaxError(
+                f'Proximity operator "/{prox.value}" at position {prox.pos} '
+                "needs a term on both sides"
+            )
+        return ProxQuery(query, term_b, int(prox.value))
+
+    def _term_or_phrase(self) -> Query:
+        token = self._next()
+        field = DEFAULT_FIELD
+        if token.type == TokenType.FIELD:
+            field = token.value
+            token = self._next()
+
+        if token.type == TokenType.TERM:
+            return TermQuery(token.value, field)
+        if token.type == TokenType.PHRASE:
+            return PhraseQuery(token.value, field)
+        raise QuerySyntaxError(f'Unexpected "{token.value}" at position {token.pos}')
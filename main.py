@@ -1,26 +1,74 @@
 #!/usr/bin/env python
 
-import glob
+import contextlib
+import functools
+import itertools
+import json
+import signal
 import sys
 import time
+from multiprocessing import Pool
 from os import path
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
 
 import click
+from tabulate import tabulate
 
+import index_store
+import planner
 import tokenizer
-from index import Index, IndexBuilder, IndexTerm, KGramIndex, PositionalPosting
+from analyzer import Analyzer, is_biword
+from bitmap import Bitmap, is_dense
+from corpus import Document, read_corpus, unsorted_doc_id
+from cursors import (
+    AndCursor,
+    AndNotCursor,
+    Cursor,
+    ListCursor,
+    OrCursor,
+    PositionalCursor,
+    PostingListCursor,
+)
+from index import (
+    DEFAULT_FIELD,
+    FIELDS,
+    CachingIndexReader,
+    Index,
+    IndexBuilder,
+    IndexReader,
+    KGramIndex,
+    PositionalPosting,
+    field_term,
+)
 from input_parser import (
     GroupQuery,
+    OrQuery,
     PhraseQuery,
     ProxQuery,
     Query,
+    QuerySyntaxError,
     QueryType,
     TermQuery,
     parse,
 )
 from posting import Posting
+from result_cache import ResultCache, conjunction_key, query_key
 from retrieval import TFIDFRetrievalSystem
 from retrieval_metrics import Evaluation
+from query_file import read_query_file
+from segments import IndexDirectory
+from server import QueryServer, percentile
+from spimi import SpimiIndexBuilder
+
+# Corpus the index is built from if no other corpus is given.
+CORPUS_PATH = "./CISI/CISI.ALL"
+INDEX_PATH = "./CISI/CISI.ALL.index"
+# Boolean queries of CISI with long OR expansions.
+BLN_PATH = "./CISI/CISI.BLN"
+
+# Result of a query part. Dense results are kept as bitmaps, so combining them
+# with AND, OR and NOT uses bitwise operations instead of merging lists.
+DocIds = Union[list[int], Bitmap]
 
 
 def eprint(category: str, text: str):
@@ -39,6 +87,7 @@ def measure_time(func):
     Executes `func` and prints its execution time on stderr.
     """
 
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start = time.time()
         result = func(*args, **kwargs)
@@ -49,21 +98,240 @@ def measure_time(func):
     return wrapper
 
 
-@measure_time
-def build_index() -> Index:
+def analyze_document(
+    document: Document, analyzer: Analyzer
+) -> tuple[Iterator[tuple[str, int]], dict[str, Iterator[tuple[str, int]]]]:
+    """
+    Returns the indexed terms of the abstract of `document`, which is the
+    default field, and the terms of its other fields.
+    """
+
+    def analyze(text: str) -> Iterator[tuple[str, int]]:
+        return analyzer.index_tokens(tokenizer.tokenize_text(text))
+
+    fields = {"title": analyze(document.title), "author": analyze(document.author)}
+    return analyze(document.text), fields
+
+
+def build_shard(
+    documents: Iterable[Document], analyzer: Optional[Analyzer] = None
+) -> IndexBuilder:
+    """
+    Tokenizes and indexes `documents` into a partial index. The tokens are
+    passed through `analyzer` if given.
+    """
+    analyzer = analyzer or Analyzer()
     builder = IndexBuilder()
+    for document in documents:
+        builder.add_document(document.doc_id, *analyze_document(document, analyzer))
+    return builder
+
+
+@measure_time
+def build_index(
+    workers: int = 1,
+    analyzer: Optional[Analyzer] = None,
+    corpus: str = CORPUS_PATH,
+) -> Index:
+    """
+    Builds the index of all documents of `corpus`. With more than one worker,
+    every worker process indexes a consecutive range of documents and the
+    partial indexes are merged in corpus order afterwards.
+    """
+    if workers == 1:
+        # The documents are streamed into the builder without reading the
+        # whole corpus first.
+        return build_shard(read_corpus(corpus), analyzer).build()
+
+    documents = list(read_corpus(corpus))
+    if len(documents) < 2:
+        return build_shard(documents, analyzer).build()
+
+    shard_size = -(-len(documents) // workers)
+    shards = [
+        documents[i : i + shard_size] for i in range(0, len(documents), shard_size)
+    ]
 
-    for file in glob.iglob("./CISI/CISI.ALL.docs/*"):
-        doc_id = int(path.basename(file))
-        pos = 0
-        for token, pos in tokenizer.tokenize(file):
-            pos += 1
-            builder.add(IndexTerm(token, doc_id, pos))
-        builder.set_doc_len(doc_id, pos)
+    with Pool(len(shards)) as pool:
+        builders = pool.map(functools.partial(build_shard, analyzer=analyzer), shards)
+
+    builder = builders[0]
+    for other in builders[1:]:
+        builder.merge(other)
 
     return builder.build()
 
 
+@measure_time
+def build_index_file(
+    memory_budget: int,
+    index_path: str,
+    compress: bool = False,
+    analyzer: Optional[Analyzer] = None,
+    corpus: str = CORPUS_PATH,
+) -> index_store.IndexWriter:
+    """
+    Builds the index directly into the file `index_path` without holding it in
+    memory. Postings are spilled to temporary files whenever they use more
+    than `memory_budget` bytes.
+    """
+    analyzer = analyzer or Analyzer()
+    builder = SpimiIndexBuilder(memory_budget, tmp_dir=path.dirname(index_path))
+    for document in read_corpus(corpus):
+        builder.add_document(document.doc_id, *analyze_document(document, analyzer))
+    writer = builder.write(index_path, path.basename(index_path), compress)
+    eprint("INDEX", f"Merged {builder.num_runs} runs")
+    return writer
+
+
+def document_hashes(corpus: str) -> dict[int, str]:
+    """
+    Returns a mapping from doc ID to the hash of the contents of the document
+    for all documents of `corpus`.
+    """
+    return {document.doc_id: document.hash() for document in read_corpus(corpus)}
+
+
+def rebuild_index(
+    directory: IndexDirectory,
+    workers: int = 1,
+    memory_budget: Optional[int] = None,
+    compress: bool = False,
+    analyzer: Optional[Analyzer] = None,
+    corpus: str = CORPUS_PATH,
+):
+    """
+    Replaces the index in `directory` by a single segment containing all
+    documents of `corpus`, analyzed with `analyzer`.
+    """
+    fingerprint = index_store.corpus_fingerprint(corpus)
+    writers: list[index_store.IndexWriter] = []
+
+    if memory_budget is not None:
+
+        def write_segment(segment_path: str):
+            writers.append(
+                build_index_file(
+                    memory_budget, segment_path, compress, analyzer, corpus
+                )
+            )
+
+    else:
+        index = build_index(workers, analyzer, corpus)
+
+        def write_segment(segment_path: str):
+            writers.append(
+                index_store.save_index(
+                    index, segment_path, path.basename(segment_path), compress
+                )
+            )
+
+    directory.rebuild(write_segment, compress, analyzer)
+    directory.set_source(fingerprint, document_hashes(corpus), corpus)
+
+    mib = 2**20
+    raw_bytes = writers[0].raw_postings_bytes
+    postings_bytes = writers[0].postings_bytes
+    # An empty corpus has no postings to compress.
+    ratio = f", {100 * postings_bytes / raw_bytes:.0f}%" if raw_bytes else ""
+    eprint(
+        "INDEX",
+        f"Postings use {postings_bytes / mib:.2f} MiB "
+        f"({raw_bytes / mib:.2f} MiB uncompressed{ratio})",
+    )
+
+    if analyzer is not None and analyzer.biwords:
+        name, _ = directory.segments[0]
+        segment = index_store.MappedIndex(path.join(directory.path, name))
+        num_terms = 0
+        num_biwords = 0
+        biword_bytes = 0
+        for term_id, term in enumerate(segment.terms()):
+            num_terms += 1
+            if is_biword(term):
+                num_biwords += 1
+                biword_bytes += segment.get_postings_bytes_by_id(term_id)
+        positional_bytes = postings_bytes - biword_bytes
+        growth = (
+            f" (+{100 * biword_bytes / positional_bytes:.0f}% over the positional "
+            "index)"
+            if positional_bytes
+            else ""
+        )
+        eprint(
+            "INDEX",
+            f"Biwords use {biword_bytes / mib:.2f} MiB of the postings{growth} "
+            f"and {num_biwords} of {num_terms} terms",
+        )
+
+
+@measure_time
+def update_index(directory: IndexDirectory):
+    """
+    Synchronizes the index in `directory` with its corpus. Only new and
+    changed documents are indexed into a new segment, removed documents are
+    deleted.
+    """
+    corpus = directory.corpus or CORPUS_PATH
+    fingerprint = index_store.corpus_fingerprint(corpus)
+    indexed_hashes = directory.doc_hashes
+    hashes: dict[int, str] = {}
+    changed: list[Document] = []
+
+    for document in read_corpus(corpus):
+        hashes[document.doc_id] = document.hash()
+        if indexed_hashes.get(document.doc_id) != hashes[document.doc_id]:
+            changed.append(document)
+
+    deleted = indexed_hashes.keys() - hashes.keys()
+
+    directory.delete_documents(deleted)
+    if changed:
+        directory.add_documents(build_shard(changed, directory.analyzer).build())
+    directory.apply_merge_policy()
+    directory.set_source(fingerprint, hashes, corpus)
+
+    eprint(
+        "INDEX",
+        f"Indexed {len(changed)} new or changed and deleted {len(deleted)} documents",
+    )
+
+
+@measure_time
+def load_index(workers: int = 1) -> IndexReader:
+    """
+    Opens the index in `INDEX_PATH`. The index is built from `CORPUS_PATH`
+    with `workers` processes if it does not exist yet or has an unsupported
+    version. If the corpus has changed, the index is updated incrementally.
+    """
+    directory = IndexDirectory(INDEX_PATH)
+
+    if not directory.exists:
+        eprint("INDEX", f'No index found at "{INDEX_PATH}", building it')
+        rebuild_index(directory, workers)
+        return directory.open()
+
+    try:
+        if directory.fingerprint != index_store.corpus_fingerprint(
+            directory.corpus or CORPUS_PATH
+        ):
+            eprint("INDEX", f'Corpus has changed, updating the index at "{INDEX_PATH}"')
+            update_index(directory)
+        return directory.open()
+    except index_store.IndexFormatError as e:
+        # Segments written by another version of the index format are rebuilt
+        # with the settings of the existing index.
+        eprint("INDEX", f"{e}, rebuilding the index")
+        rebuild_index(
+            directory,
+            workers,
+            compress=directory.compress,
+            analyzer=directory.analyzer,
+            corpus=directory.corpus or CORPUS_PATH,
+        )
+        return directory.open()
+
+
 @measure_time
 def parse_query(query) -> list[Query]:
     return parse(query)
@@ -76,7 +344,7 @@ def getOrQueryTerms(query) -> list[Query]:
     return queryList
 
 
-def get_doc_ids(postings: list[PositionalPosting]) -> list[int]:
+def get_doc_ids(postings: Sequence[PositionalPosting]) -> list[int]:
     """
     Converts a list of positional postings to a list of their respective doc
     IDs.
@@ -84,15 +352,85 @@ def get_doc_ids(postings: list[PositionalPosting]) -> list[int]:
     return [x.doc_id for x in postings]
 
 
-def intersect_many(list_of_doc_ids: list[list[int]]) -> list[int]:
-    result_doc_ids = list_of_doc_ids[0]
+def to_list(doc_ids: DocIds) -> list[int]:
+    """Returns the doc IDs of a query result as sorted list."""
+    return doc_ids.to_list() if isinstance(doc_ids, Bitmap) else doc_ids
+
+
+def intersect_many(list_of_doc_ids: list[DocIds]) -> DocIds:
+    """
+    Intersects all lists of doc IDs, starting with the shortest ones so the
+    intermediate results stay as small as possible.
 
-    for right in list_of_doc_ids[1:]:
-        result_doc_ids = Posting.intersect(result_doc_ids, right)
+    Bitmaps are intersected with each other first. The intersection of the
+    remaining lists is then turned into a bitmap to intersect it with them.
+    """
+    lists = sorted((x for x in list_of_doc_ids if not isinstance(x, Bitmap)), key=len)
+    bitmaps = sorted((x for x in list_of_doc_ids if isinstance(x, Bitmap)), key=len)
+
+    result_doc_ids: Optional[DocIds] = None
+    if lists:
+        result_doc_ids = lists[0]
+        for right in lists[1:]:
+            if not result_doc_ids:
+                break
+            result_doc_ids = Posting.intersect(result_doc_ids, right)
+
+    if bitmaps:
+        result_bitmap = bitmaps[0]
+        for right in bitmaps[1:]:
+            if not result_bitmap:
+                break
+            result_bitmap = result_bitmap & right
+
+        if result_doc_ids is None:
+            return result_bitmap
+        if result_doc_ids:
+            return (Bitmap.from_doc_ids(result_doc_ids) & result_bitmap).to_list()
 
     return result_doc_ids
 
 
+def union_many(list_of_doc_ids: list[DocIds]) -> DocIds:
+    """
+    Returns the union of all query results. Bitmaps are combined with a
+    bitwise OR, lists with a single k-way merge. If there are both, the merged
+    list is added to the bitmap.
+    """
+    lists = [x for x in list_of_doc_ids if not isinstance(x, Bitmap)]
+    bitmaps = [x for x in list_of_doc_ids if isinstance(x, Bitmap)]
+
+    if not bitmaps:
+        return Posting.union_many(lists) if lists else []
+
+    result_bitmap = bitmaps[0]
+    for right in bitmaps[1:]:
+        result_bitmap = result_bitmap | right
+    if lists:
+        result_bitmap = result_bitmap | Bitmap.from_doc_ids(Posting.union_many(lists))
+    return result_bitmap
+
+
+def and_not(left: DocIds, right: DocIds) -> DocIds:
+    """
+    Returns the doc IDs of `left` which are not in `right`. If one of them is
+    a bitmap, the other one is converted to a bitmap as well.
+    """
+    if isinstance(left, Bitmap) or isinstance(right, Bitmap):
+        left = left if isinstance(left, Bitmap) else Bitmap.from_doc_ids(left)
+        right = right if isinstance(right, Bitmap) else Bitmap.from_doc_ids(right)
+        return left - right
+    return Posting.and_not(left, right)
+
+
+workers_option = click.option(
+    "--workers",
+    help="Number of processes used to build the index.",
+    type=click.IntRange(1),
+    default=1,
+)
+
+
 @click.group()
 def main():
     """
@@ -101,12 +439,177 @@ def main():
     pass
 
 
+@main.group(name="index")
+def index_group():
+    """
+    Manage the on-disk index of the CISI dataset.
+    """
+    pass
+
+
+@index_group.command(name="build")
+@workers_option
+@click.option(
+    "--memory-budget",
+    help="Build the index with at most this many MiB of postings in memory.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--compress",
+    help="Store doc IDs and positions as variable byte encoded gaps.",
+    is_flag=True,
+)
+@click.option(
+    "--corpus",
+    help="Corpus in CISI or JSONL format, optionally compressed with gzip.",
+    type=click.Path(exists=True, dir_okay=False),
+    default=CORPUS_PATH,
+    show_default=True,
+)
+@click.option("--stopwords", help="Do not index common English words.", is_flag=True)
+@click.option("--stem", help="Remove plural endings of tokens.", is_flag=True)
+@click.option(
+    "--biwords",
+    help="Also index pairs of consecutive tokens to speed up phrase queries.",
+    is_flag=True,
+)
+@click.option(
+    "--min-length",
+    help="Do not index tokens shorter than this.",
+    type=click.IntRange(1),
+    default=1,
+)
+@click.option(
+    "--max-length",
+    help="Do not index tokens longer than this.",
+    type=click.IntRange(1),
+)
+def index_build(
+    workers,
+    memory_budget,
+    compress,
+    corpus,
+    stopwords,
+    stem,
+    biwords,
+    min_length,
+    max_length,
+):
+    """
+    Build the index and write it to disk.
+    """
+    if memory_budget is not None and workers > 1:
+        raise click.UsageError("--memory-budget cannot be used with --workers")
+
+    if memory_budget is not None:
+        # The SPIMI builder spills postings in the order they are added, so it
+        # needs the documents sorted by doc ID. Only the doc IDs are checked,
+        # the documents are not held in memory.
+        doc_id = unsorted_doc_id(corpus)
+        if doc_id is not None:
+            raise click.UsageError(
+                f"--memory-budget needs a corpus sorted by doc ID, but document "
+                f'{doc_id} of "{corpus}" is out of order'
+            )
+
+    directory = IndexDirectory(INDEX_PATH)
+    rebuild_index(
+        directory,
+        workers,
+        memory_budget * 2**20 if memory_budget is not None else None,
+        compress,
+        Analyzer(stopwords, stem, min_length, max_length, biwords),
+        corpus,
+    )
+
+    eprint(
+        "INDEX",
+        f'Wrote index with {len(directory.open().doc_ids)} documents to "{INDEX_PATH}"',
+    )
+
+
+@index_group.command(name="update")
+@workers_option
+def index_update(workers):
+    """
+    Index new and changed documents and delete removed ones.
+    """
+    directory = IndexDirectory(INDEX_PATH)
+    if directory.exists:
+        update_index(directory)
+    else:
+        rebuild_index(directory, workers)
+
+
+@index_group.command(name="merge")
+def index_merge():
+    """
+    Merge all segments into one and drop deleted documents.
+    """
+    directory = IndexDirectory(INDEX_PATH)
+    if not directory.exists:
+        raise click.ClickException(f'No index found at "{INDEX_PATH}"')
+    directory.merge()
+    eprint("INDEX", f'Merged all segments of "{INDEX_PATH}"')
+
+
+@index_group.command(name="status")
+def index_status():
+    """
+    Show the segments of the index.
+    """
+    directory = IndexDirectory(INDEX_PATH)
+    if not directory.exists:
+        raise click.ClickException(f'No index found at "{INDEX_PATH}"')
+
+    rows = []
+    for name, deleted in directory.segments:
+        segment = index_store.MappedIndex(path.join(INDEX_PATH, name))
+        rows.append([name, len(segment.doc_lengths), len(deleted)])
+
+    print(tabulate(rows, headers=["Segment", "Documents", "Deleted"], tablefmt="grid"))
+    print(f"Corpus: {directory.corpus}")
+    print(f"Analyzer: {directory.analyzer}")
+
+
+def parse_field_weights(ctx, param, values) -> Optional[dict[str, float]]:
+    """
+    Converts the values of the `--field-weight` option to a mapping from field
+    to weight.
+    """
+    if not values:
+        return None
+
+    field_weights = {}
+    for value in values:
+        field, _, weight = value.partition("=")
+        if field not in FIELDS:
+            raise click.BadParameter(
+                f'Unknown field "{field}", expected one of {", ".join(FIELDS)}'
+            )
+        try:
+            field_weights[field] = float(weight)
+        except ValueError:
+            raise click.BadParameter(f'Invalid weight "{weight}" for field "{field}"')
+    return field_weights
+
+
 @main.command()
-def tf_idf():
+@workers_option
+@click.option(
+    "--field-weight",
+    "field_weights",
+    help="Weight of a field in the score, e.g. title=2. Can be given several "
+    "times. By default only the abstract is searched.",
+    metavar="FIELD=WEIGHT",
+    multiple=True,
+    callback=parse_field_weights,
+)
+def tf_idf(workers, field_weights):
     """
     Use a vector space model based on tf-idf to query the CISI dataset.
     """
-    ir_system = TFIDFRetrievalSystem(build_index())
+    ir_system = TFIDFRetrievalSystem(load_index(workers), field_weights)
     Evaluation.execute_evaluation(ir_system=ir_system)
 
 
@@ -124,56 +627,70 @@ def tf_idf():
     type=click.IntRange(1),
     default=3,
 )
-def boolean_retrieval(query, k, r):
+@workers_option
+@click.option(
+    "--explain",
+    help="Print the query plan with its estimated costs instead of executing it.",
+    is_flag=True,
+)
+@click.option(
+    "--limit",
+    help="Only return the first LIMIT matches.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--count",
+    help="Only print the number of matches.",
+    is_flag=True,
+)
+def boolean_retrieval(query, k, r, workers, explain, limit, count):
     """
     Use a boolean retrieval model to query the CISI dataset.
     """
     # for windows command line
     totalQuery = query
-    and_queries = parse_query(query)
-    and_query_result_doc_ids: list[list[int]] = []
+    try:
+        and_queries = parse_query(query)
+    except QuerySyntaxError as e:
+        raise click.ClickException(f'Invalid query "{query}": {e}')
 
-    index = build_index()
+    if len(and_queries) == 0:
+        eprint("MAIN", f'Found 0 matches for total query "{query}"')
+        return
 
-    for query in and_queries:
-        eprint("MAIN", f'Handle AND query part "{query}"')
-        result_doc_ids: list[int] = []
-        if query.type == QueryType.GROUP:
-            result_doc_ids = handle_group(index, query, k, r)
-        elif query.type == QueryType.OR:
-            # We expect OR queries to only consist of two, non-nested parts.
-            def handle_part(query: Query) -> list[int]:
-                if query.type == QueryType.TERM:
-                    return handle_term(index, query, k, r)
-                elif query.type == QueryType.PHRASE:
-                    return handle_phrase(index, query)
-                elif query.type == QueryType.PROX:
-                    return handle_prox(index, query)
-
-            left = handle_part(query.parts[0])
-            right = handle_part(query.parts[1])
-            union = Posting.union(left, right)
-            result_doc_ids = union
-        elif query.type == QueryType.PROX:
-            result_doc_ids = handle_prox(index, query)
-        elif query.type == QueryType.PHRASE:
-            result_doc_ids = handle_phrase(index, query)
-        elif query.type == QueryType.TERM:
-            result_doc_ids = handle_term(index, query, k, r)
-
-        if query.is_not:
-            eprint("NOT", f'Handle NOT query part "{query}"')
-            inverted = Posting.Not(result_doc_ids, index.doc_ids)
-            eprint("NOT", f'Found {len(inverted)} documents for NOT query "{query}"')
-            and_query_result_doc_ids.append(inverted)
-        else:
-            and_query_result_doc_ids.append(result_doc_ids)
+    # Every term of the query is only looked up once.
+    index = CachingIndexReader(load_index(workers))
+    query_plan = planner.plan(index, and_queries)
 
-    if len(and_query_result_doc_ids) == 0:
-        eprint("MAIN", f'Found 0 matches for total query "{query}"')
+    if explain:
+        print("\n".join(query_plan.explain()))
         return
 
-    result_doc_ids = intersect_many(and_query_result_doc_ids)
+    if limit is None and not count:
+        # Subexpressions which occur several times are only evaluated once.
+        cache = ResultCache()
+        result_doc_ids = to_list(execute_plan(index, query_plan, k, r, cache))
+        eprint("STATS", f"Result cache: {cache.hits} hits, {cache.misses} misses")
+    else:
+        # Only the postings needed for the first matches or the count are
+        # read.
+        cursor = compile_plan(index, query_plan, k, r)
+        if count:
+            num_matches = sum(1 for _ in cursor)
+        else:
+            result_doc_ids = list(itertools.islice(cursor, limit))
+        eprint("STATS", f"Cursors visited {cursor.visited} postings")
+
+    eprint(
+        "STATS",
+        f"Scanned {index.postings_scanned} postings in {index.lookups} lookups "
+        f"({index.cache_hits} cached)",
+    )
+
+    if count:
+        eprint("MAIN", f'Found {num_matches} matches for total query "{totalQuery}"')
+        print(num_matches)
+        return
 
     if len(result_doc_ids) == 0:
         eprint("MAIN", f'Found 0 matches for total query "{totalQuery}"')
@@ -196,18 +713,478 @@ def boolean_retrieval(query, k, r):
     )
 
 
-def handle_prox(index: Index, query: ProxQuery) -> list[int]:
-    eprint("PROX", f'Handle proximity query "{query}"')
+def boolean_search(
+    index: IndexReader,
+    query: str,
+    k: int,
+    r: int,
+    limit: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+) -> list[int]:
+    """
+    Returns the doc IDs matching the boolean `query`, or only the first
+    `limit` of them. Results are reused from and stored in `cache` if given.
+    """
+    and_queries = parse_query(query)
+    if len(and_queries) == 0:
+        return []
 
-    postings_a = index.get_positional_postings(query.term_a.term)
-    postings_b = index.get_positional_postings(query.term_b.term)
+    # Every term of the query is only looked up once.
+    reader = CachingIndexReader(index)
+    query_plan = planner.plan(reader, and_queries)
+    if limit is None:
+        return to_list(execute_plan(reader, query_plan, k, r, cache))
+    return list(itertools.islice(compile_plan(reader, query_plan, k, r), limit))
 
-    if postings_a is None or postings_b is None:
-        eprint(
-            f'Found 0 matches for proximity query term "{query.term_a.term if postings_a is None else query.term_b.term}"'
+
+@main.command()
+@click.option("--host", help="Address to listen on.", default="127.0.0.1")
+@click.option("--port", help="Port to listen on.", type=click.IntRange(0), default=8000)
+@workers_option
+@click.option(
+    "--field-weight",
+    "field_weights",
+    help="Weight of a field in the tf-idf score, e.g. title=2. Can be given "
+    "several times. By default only the abstract is searched.",
+    metavar="FIELD=WEIGHT",
+    multiple=True,
+    callback=parse_field_weights,
+)
+@click.option(
+    "--cache-entries",
+    help="Maximum number of cached boolean query results.",
+    type=click.IntRange(0),
+    default=1024,
+)
+@click.option(
+    "--cache-memory",
+    help="Maximum memory of cached boolean query results in MiB.",
+    type=click.IntRange(0),
+    default=64,
+)
+def serve(host, port, workers, field_weights, cache_entries, cache_memory):
+    """
+    Answer boolean and tf-idf queries over HTTP with JSON responses.
+
+    The index is loaded once and shared by all requests. Endpoints:
+    /boolean?q=QUERY&k=3&r=3&limit=N, /tf-idf?q=QUERY&top=10 and /stats,
+    which reports the p50 and p99 latency of both query endpoints.
+    """
+    index = load_index(workers)
+    ir_system = TFIDFRetrievalSystem(index, field_weights)
+    cache = ResultCache(cache_entries, cache_memory * 2**20)
+
+    server = QueryServer(
+        (host, port),
+        lambda query, k, r, limit: boolean_search(index, query, k, r, limit, cache),
+        ir_system.retrieve,
+        cache,
+    )
+    eprint("SERVER", f"Listening on http://{host}:{server.server_address[1]}")
+
+    # Stop on SIGTERM like on Ctrl+C, so the latencies are reported as well.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for endpoint, stats in server.latency.summary().items():
+            eprint(
+                "STATS",
+                f"{endpoint}: {stats['requests']} requests, "
+                f"p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms",
+            )
+
+
+def run_batch_query(
+    index: IndexReader,
+    query_id: int,
+    query: str,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> dict:
+    """Runs one query of a batch and returns its result with its timing."""
+    start = time.perf_counter()
+    doc_ids = boolean_search(index, query, k, r, cache=cache)
+    elapsed = time.perf_counter() - start
+    return {
+        "id": query_id,
+        "query": query,
+        "matches": len(doc_ids),
+        "time_ms": round(elapsed * 1000, 3),
+        "doc_ids": doc_ids,
+    }
+
+
+# Index, result cache, k and r of a batch worker process.
+_batch_worker: Optional[tuple[IndexReader, ResultCache, int, int]] = None
+
+
+def _init_batch_worker(k: int, r: int):
+    global _batch_worker
+    # The spell checker prints to stdout, which may hold the results.
+    sys.stdout = sys.stderr
+    _batch_worker = (IndexDirectory(INDEX_PATH).open(), ResultCache(), k, r)
+
+
+def _run_batch_worker(item: tuple[int, str]) -> dict:
+    index, cache, k, r = _batch_worker
+    return run_batch_query(index, *item, k, r, cache)
+
+
+@main.command()
+@click.argument(
+    "query_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=BLN_PATH,
+)
+@click.option(
+    "-k",
+    help="k-gram size for the k-gram index.",
+    type=click.IntRange(1),
+    default=3,
+    show_default=True,
+)
+@click.option(
+    "-r",
+    help="Activate spelling correction when less than r documents are found.",
+    type=click.IntRange(1),
+    default=3,
+)
+@workers_option
+@click.option(
+    "--jobs",
+    help="Number of processes executing the queries.",
+    type=click.IntRange(1),
+    default=1,
+)
+@click.option(
+    "--format",
+    "output_format",
+    help="Format of the results.",
+    type=click.Choice(["jsonl", "tsv"]),
+    default="jsonl",
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="File the results are written to.",
+    type=click.File("w"),
+    default="-",
+)
+def batch(query_file, k, r, workers, jobs, output_format, output):
+    """
+    Run all boolean queries of QUERY_FILE against one loaded index.
+
+    QUERY_FILE is in the CISI.BLN format, which is translated into the query
+    syntax, or contains one query per line. Every result is written as one
+    line with the number of matches, the doc IDs and the time of the query.
+    """
+    try:
+        queries = read_query_file(query_file)
+    except ValueError as e:
+        raise click.ClickException(f'Cannot read "{query_file}": {e}')
+
+    # A malformed query fails the batch before any query runs.
+    for query_id, query in queries:
+        try:
+            parse(query)
+        except QuerySyntaxError as e:
+            raise click.ClickException(f'Invalid query {query_id} "{query}": {e}')
+
+    # The index is built or updated once before the queries run.
+    index = load_index(workers)
+
+    if output_format == "tsv":
+        output.write("id\tquery\tmatches\ttime_ms\tdoc_ids\n")
+
+    def write(result: dict):
+        if output_format == "jsonl":
+            output.write(json.dumps(result) + "\n")
+        else:
+            doc_ids = " ".join(map(str, result["doc_ids"]))
+            output.write(
+                f"{result['id']}\t{result['query']}\t{result['matches']}\t"
+                f"{result['time_ms']}\t{doc_ids}\n"
+            )
+
+    start = time.perf_counter()
+    times = []
+    if jobs == 1:
+        cache = ResultCache()
+        # The spell checker prints to stdout, which may hold the results.
+        with contextlib.redirect_stdout(sys.stderr):
+            for query_id, query in queries:
+                result = run_batch_query(index, query_id, query, k, r, cache)
+                times.append(result["time_ms"])
+                write(result)
+    else:
+        with Pool(jobs, _init_batch_worker, (k, r)) as pool:
+            # Results are written in the order of the queries as soon as they
+            # are available.
+            for result in pool.imap(_run_batch_worker, queries):
+                times.append(result["time_ms"])
+                write(result)
+    elapsed = time.perf_counter() - start
+
+    times.sort()
+    eprint(
+        "STATS",
+        f"Ran {len(queries)} queries in {elapsed:.2f} seconds "
+        f"(p50 {percentile(times, 50)} ms, p99 {percentile(times, 99)} ms per query)",
+    )
+
+
+def cached_result(
+    index: IndexReader,
+    cache: Optional[ResultCache],
+    key: str,
+    k: int,
+    r: int,
+    evaluate: Callable[[], DocIds],
+) -> DocIds:
+    """
+    Returns the result of the query with the canonical form `key` from
+    `cache`. On a miss, or without a cache, the result is computed by
+    `evaluate` and cached. The spelling correction depends on `k` and `r`, so
+    they are part of the cache key.
+    """
+    if cache is None:
+        return evaluate()
+
+    result = cache.get(index.version, (k, r, key))
+    if result is not None:
+        eprint("CACHE", f'Reusing cached result of "{key}"')
+        return result
+
+    result = evaluate()
+    cache.put(index.version, (k, r, key), result)
+    return result
+
+
+def execute_plan(
+    index: IndexReader,
+    plan: planner.Plan,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    """
+    Evaluates the conjunction `plan`. The evaluation stops as soon as the
+    intermediate result is empty, the remaining parts are not looked up.
+
+    If `cache` is given, the results of the whole conjunction and of its
+    groups, OR, phrase and proximity queries are reused from it and cached.
+    """
+    key = conjunction_key([x.query for x in plan.include + plan.exclude])
+    return cached_result(
+        index, cache, key, k, r, lambda: evaluate_plan(index, plan, k, r, cache)
+    )
+
+
+def evaluate_plan(
+    index: IndexReader,
+    plan: planner.Plan,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    """Evaluates the conjunction `plan` like `execute_plan`, without caching it."""
+    result_doc_ids: Optional[DocIds] = None
+
+    for conjunct in plan.include:
+        eprint("MAIN", f'Handle AND query part "{conjunct.query}"')
+        doc_ids = handle_conjunct(index, conjunct, k, r, cache)
+        if result_doc_ids is None:
+            result_doc_ids = doc_ids
+        else:
+            result_doc_ids = intersect_many([result_doc_ids, doc_ids])
+
+        if not result_doc_ids:
+            eprint("PLAN", f'No documents left after AND query part "{conjunct.query}"')
+            return []
+
+    if result_doc_ids is None:
+        result_doc_ids = index.get_doc_id_bitmap()
+
+    for conjunct in plan.exclude:
+        eprint("NOT", f'Handle NOT query part "{conjunct.query}"')
+        result_doc_ids = and_not(
+            result_doc_ids, handle_conjunct(index, conjunct, k, r, cache)
         )
+
+        if not result_doc_ids:
+            eprint("PLAN", f'No documents left after NOT query part "{conjunct.query}"')
+            return []
+
+    return result_doc_ids
+
+
+def handle_conjunct(
+    index: IndexReader,
+    conjunct: planner.Conjunct,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    """Evaluates the query of `conjunct`, ignoring its negation."""
+    if conjunct.plan is not None:
+        eprint("GROUP", f'Handle group query "{conjunct.query}"')
+        return execute_plan(index, conjunct.plan, k, r, cache)
+    return handle_query(index, conjunct.query, k, r, cache)
+
+
+def handle_query(
+    index: IndexReader,
+    query: Query,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    """
+    Evaluates `query`, ignoring its negation. Terms are a single lookup and
+    groups are cached by `execute_plan`, all other queries are cached here.
+    """
+    if query.type == QueryType.TERM:
+        return handle_term(index, query, k, r)
+    elif query.type == QueryType.GROUP:
+        return handle_group(index, query, k, r, cache)
+
+    def evaluate() -> DocIds:
+        if query.type == QueryType.PHRASE:
+            return handle_phrase(index, query)
+        elif query.type == QueryType.PROX:
+            return handle_prox(index, query)
+        elif query.type == QueryType.OR:
+            return handle_or(index, query, k, r, cache)
+
+    return cached_result(index, cache, query_key(query), k, r, evaluate)
+
+
+def compile_plan(index: IndexReader, plan: planner.Plan, k: int, r: int) -> Cursor:
+    """
+    Compiles the conjunction `plan` into a tree of cursors, which reads the
+    postings of the query only while the matches are iterated.
+    """
+    if plan.include:
+        cursors = [compile_conjunct(index, x, k, r) for x in plan.include]
+        cursor = cursors[0] if len(cursors) == 1 else AndCursor(cursors)
+    else:
+        cursor = ListCursor.of(index.doc_ids)
+
+    for conjunct in plan.exclude:
+        cursor = AndNotCursor(cursor, compile_conjunct(index, conjunct, k, r))
+
+    return cursor
+
+
+def compile_conjunct(
+    index: IndexReader, conjunct: planner.Conjunct, k: int, r: int
+) -> Cursor:
+    """Compiles the query of `conjunct`, ignoring its negation."""
+    if conjunct.plan is not None:
+        return compile_plan(index, conjunct.plan, k, r)
+    return compile_query(index, conjunct.query, k, r)
+
+
+def compile_query(index: IndexReader, query: Query, k: int, r: int) -> Cursor:
+    """
+    Compiles `query`, ignoring its negation. Terms read their posting lists on
+    the first move of their cursor. Phrase and proximity queries check the
+    positions of their terms in every document containing all of them.
+    """
+    if query.type == QueryType.TERM:
+        term = index.analyzer.analyze_term(query.term)
+        name = field_term(term, query.field) if term is not None else None
+        doc_freq = index.get_doc_freq(name) if name is not None else 0
+
+        def load_term() -> Sequence[int]:
+            posting_list = index.get_posting_list(name) if name is not None else None
+            if posting_list is not None and len(posting_list) >= r:
+                return posting_list.doc_ids
+            # Too few matches, use the spell checker.
+            return to_list(handle_term(index, query, k, r))
+
+        return ListCursor(load_term, doc_freq)
+    elif query.type == QueryType.PHRASE:
+        terms = [index.analyzer.analyze_term(x) for x in query.parts]
+        terms = index.analyzer.phrase_terms([x for x in terms if x is not None])
+        cursors = [posting_list_cursor(index, x, query.field) for x in terms]
+        if len(cursors) < 2:
+            return cursors[0] if cursors else ListCursor.of([])
+        return PositionalCursor(
+            cursors, lambda positions: bool(Posting.phrase_positions(positions))
+        )
+    elif query.type == QueryType.PROX:
+        term_a = index.analyzer.analyze_term(query.term_a.term)
+        term_b = index.analyzer.analyze_term(query.term_b.term)
+        if term_a is None or term_b is None:
+            return ListCursor.of([])
+        return PositionalCursor(
+            [
+                posting_list_cursor(index, term_a, query.term_a.field),
+                posting_list_cursor(index, term_b, query.term_b.field),
+            ],
+            lambda positions: bool(Posting.proximity_positions(*positions, query.k)),
+        )
+    elif query.type == QueryType.GROUP:
+        return compile_plan(index, planner.plan(index, query.and_queries), k, r)
+    elif query.type == QueryType.OR:
+        cursors = []
+        for part in query.parts:
+            cursor = compile_query(index, part, k, r)
+            if part.is_not:
+                cursor = AndNotCursor(ListCursor.of(index.doc_ids), cursor)
+            cursors.append(cursor)
+        return OrCursor(cursors)
+
+
+def posting_list_cursor(index: IndexReader, term: str, field: str) -> PostingListCursor:
+    """Returns a cursor over the postings of the analyzed `term` in `field`."""
+    name = field_term(term, field)
+    return PostingListCursor(
+        lambda: index.get_posting_list(name), index.get_doc_freq(name)
+    )
+
+
+def handle_or(
+    index: IndexReader,
+    query: OrQuery,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    eprint("OR", f'Handle OR query "{query}"')
+
+    results = []
+    for part in query.parts:
+        doc_ids = handle_query(index, part, k, r, cache)
+        if part.is_not:
+            doc_ids = and_not(index.get_doc_id_bitmap(), doc_ids)
+        results.append(doc_ids)
+
+    results = union_many(results)
+    eprint("OR", f'Found {len(results)} documents for query "{query}"')
+
+    return results
+
+
+def handle_prox(index: IndexReader, query: ProxQuery) -> list[int]:
+    eprint("PROX", f'Handle proximity query "{query}"')
+
+    term_a = index.analyzer.analyze_term(query.term_a.term)
+    term_b = index.analyzer.analyze_term(query.term_b.term)
+    if term_a is None or term_b is None:
+        eprint("PROX", f'Query "{query}" contains a term that is not indexed')
         return []
 
+    postings_a = index.get_positional_postings(field_term(term_a, query.term_a.field))
+    postings_b = index.get_positional_postings(field_term(term_b, query.term_b.field))
+
     intersect_postings = Posting.positional_intersect(postings_a, postings_b, query.k)
 
     if len(intersect_postings) == 0:
@@ -221,83 +1198,81 @@ def handle_prox(index: Index, query: ProxQuery) -> list[int]:
     return get_doc_ids(intersect_postings)
 
 
-def handle_phrase(index: Index, query: PhraseQuery) -> list[int]:
+def handle_phrase(index: IndexReader, query: PhraseQuery) -> list[int]:
     eprint("PHRASE", f'Handle phrase query "{query}"')
 
-    positional_postings = [index.get_positional_postings(x) for x in query.parts]
-
-    if None in positional_postings:
-        eprint("PHRASE", f'Found 0 matches for phrase query "{query}"')
+    # Terms removed by the analyzer are removed from the phrase as well, the
+    # positions in the index are consecutive without them.
+    terms = [index.analyzer.analyze_term(x) for x in query.parts]
+    terms = [x for x in terms if x is not None]
+    if not terms:
+        eprint("PHRASE", f'Phrase "{query}" contains no indexed terms')
         return []
 
-    # Special case single term phrase queries.
-    if len(positional_postings) == 1:
-        eprint(
-            "PHRASE",
-            f'Found {len(positional_postings[0])} matches for phrase query "{query}"',
-        )
-        return get_doc_ids(positional_postings[0])
-
-    # Nested function so we can break from the loop by using `return`.
-    def iterate_positional_postings() -> list[int]:
-        doc_ids: set[int] = set()
+    # With biwords, a phrase of two terms is a single lookup and longer
+    # phrases only compare the positions of their much rarer biwords.
+    terms = index.analyzer.phrase_terms(terms)
 
-        # Iterate in reverse order to stop at the start of the phrase.
-        right = positional_postings[-1]
-        for left in reversed(positional_postings[:-1]):
-            intersect_postings = Posting.positional_intersect(left, right, 1)
-            if len(intersect_postings) == 0:
-                eprint("PHRASE", f'Found 0 matches for phrase query "{query}"')
-                return []
+    # Special case phrases looked up by a single term.
+    if len(terms) == 1:
+        posting_list = index.get_posting_list(field_term(terms[0], query.field))
+        doc_ids = list(posting_list.doc_ids) if posting_list is not None else []
+        eprint("PHRASE", f'Found {len(doc_ids)} matches for phrase query "{query}"')
+        return doc_ids
 
-            for posting in intersect_postings:
-                doc_ids.add(posting.doc_id)
+    positional_postings = [
+        index.get_positional_postings(field_term(x, query.field)) for x in terms
+    ]
 
-            right = intersect_postings
+    # All terms are matched at once by their offset in the phrase.
+    phrase_postings = Posting.phrase_intersect(positional_postings)
+    eprint("PHRASE", f'Found {len(phrase_postings)} matches for phrase query "{query}"')
 
-        return list(sorted(doc_ids))
+    return get_doc_ids(phrase_postings)
 
-    return iterate_positional_postings()
 
-
-def handle_term(index: Index, query: TermQuery, k: int, r: int) -> list[int]:
+def handle_term(index: IndexReader, query: TermQuery, k: int, r: int) -> DocIds:
     eprint("TERM", f'Handle term "{query.term}"')
 
-    posting_list = index.get_positional_postings(query.term)
+    term = index.analyzer.analyze_term(query.term)
+    if term is None:
+        eprint("TERM", f'Term "{query.term}" is not indexed')
+        return []
+
+    term_id = index.get_term_id(field_term(term, query.field))
+    num_docs = len(index.doc_ids)
 
-    if len(posting_list) >= r:
-        return [x.doc_id for x in posting_list]
+    # Dense terms are answered from the bitmaps cached by the index, so their
+    # postings are neither decoded nor converted again for every query.
+    if term_id is not None and is_dense(index.get_doc_freq_by_id(term_id), num_docs):
+        bitmap = index.get_bitmap_by_id(term_id)
+        if len(bitmap) >= r:
+            return bitmap
 
-    eprint("TERM", f'Found less than r={r} documents for term "{query.term}"')
+    posting_list = None if term_id is None else index.get_posting_list_by_id(term_id)
 
-    return use_spell_checker(query.term, index, k)
+    if posting_list is not None and len(posting_list) >= r:
+        if is_dense(len(posting_list), num_docs):
+            return posting_list.bitmap
+        return posting_list.doc_ids.tolist()
 
+    eprint("TERM", f'Found less than r={r} documents for term "{term}"')
 
-def handle_group(index: Index, query: GroupQuery, k: int, r: int) -> list[int]:
-    eprint("GROUP", f'Handle group query "{query}"')
+    return use_spell_checker(term, index, k, query.field)
 
-    def handle_part(query: Query) -> list[int]:
-        if query.type == QueryType.TERM:
-            return handle_term(index, query, k, r)
-        elif query.type == QueryType.PHRASE:
-            return handle_phrase(index, query)
-        elif query.type == QueryType.PROX:
-            return handle_prox(index, query)
-        elif query.type == QueryType.GROUP:
-            return handle_group(index, query, k, r)
-        elif query.type == QueryType.OR:
-            left = handle_part(query.parts[0])
-            right = handle_part(query.parts[1])
-            union = Posting.union(left, right)
-            return union
 
-    results = []
-    for q in query.and_queries:
-        results.append(handle_part(q))
+def handle_group(
+    index: IndexReader,
+    query: GroupQuery,
+    k: int,
+    r: int,
+    cache: Optional[ResultCache] = None,
+) -> DocIds:
+    eprint("GROUP", f'Handle group query "{query}"')
 
     # Same handling as in `main` because GROUP queries can consist of multiple
     # AND queries.
-    results = intersect_many(results)
+    results = execute_plan(index, planner.plan(index, query.and_queries), k, r, cache)
     eprint("GROUP", f'Found {len(results)} documents for query "{query}"')
 
     return results
@@ -314,12 +1289,14 @@ def computeJaccardCoeffcient(itersectionList, unionList):
     return len(itersectionList) / (len(unionList) - len(itersectionList))
 
 
-def use_spell_checker(term: str, index: Index, k: int) -> list[int]:
+def use_spell_checker(
+    term: str, index: IndexReader, k: int, field: str = DEFAULT_FIELD
+) -> list[int]:
     @measure_time
     def build_k_gram_index():
         k_gram_index = KGramIndex(term)
         k_gram_index.build(k)
-        k_gram_index.setKGramValues(index)
+        k_gram_index.setKGramValues(index, field)
         return k_gram_index
 
     eprint("SPELL", f'Spell checker uses k-gram index with k={k} for term "{term}"')
@@ -334,7 +1311,9 @@ def use_spell_checker(term: str, index: Index, k: int) -> list[int]:
     for kgram in k_gram_index._kgrams:
         kgramResultList = []
         for obj in kgram["values"]:
-            kgramResultList += index.get_positional_postings(obj["val"])
+            kgramResultList += index.get_positional_postings(
+                field_term(obj["val"], field)
+            )
         results.append(kgramResultList)
 
     doc_ids = [posting.doc_id for posting_list in results for posting in posting_list]
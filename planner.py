@@ -0,0 +1,129 @@
+from typing import Optional, Sequence
+
+from index import IndexReader, field_term
+from input_parser import Query, QueryType, TermQuery
+
+
+class Conjunct:
+    """
+    Operand of a conjunction together with its estimated costs.
+
+    `estimate` is the estimated number of documents matching `query`, ignoring
+    a negation, and `cost` the number of postings read to evaluate it. Group
+    queries are planned recursively, their plan is stored in `plan`.
+    """
+
+    def __init__(
+        self, query: Query, estimate: int, cost: int, plan: Optional["Plan"] = None
+    ):
+        self.query = query
+        self.estimate = estimate
+        self.cost = cost
+        self.plan = plan
+
+    def __repr__(self):
+        return f"{self.query} (est. {self.estimate} docs, cost {self.cost})"
+
+
+class Plan:
+    """
+    Execution plan of a conjunction of queries.
+
+    The conjuncts in `include` are intersected in ascending order of their
+    estimated number of documents, so the intermediate result is small from
+    the start and evaluation can stop as soon as it is empty. The negated
+    conjuncts in `exclude` are then removed from the result with an AND NOT
+    merge instead of intersecting the result with their complement. If there
+    are no conjuncts to include, the excluded ones are removed from all
+    documents.
+    """
+
+    def __init__(self, include: list[Conjunct], exclude: list[Conjunct], num_docs: int):
+        self.include = include
+        self.exclude = exclude
+        if include:
+            self.estimate = min(x.estimate for x in include)
+        else:
+            self.estimate = max(
+                0, num_docs - max((x.estimate for x in exclude), default=0)
+            )
+        self.cost = sum(x.cost for x in include + exclude)
+
+    def explain(self, indent: int = 0) -> list[str]:
+        """Returns one line for every step of the plan."""
+        prefix = "  " * indent
+        lines = [f"{prefix}AND (est. {self.estimate} docs, cost {self.cost})"]
+        if not self.include:
+            lines.append(f"{prefix}  ALL DOCUMENTS")
+
+        # Negated queries are already printed with a leading "NOT".
+        for conjunct in self.include + self.exclude:
+            if conjunct.plan is None:
+                lines.append(f"{prefix}  {conjunct}")
+            else:
+                negation = "NOT " if conjunct.query.is_not else ""
+                lines.append(f"{prefix}  {negation}GROUP")
+                lines += conjunct.plan.explain(indent + 2)
+        return lines
+
+
+def _doc_freq(index: IndexReader, term: TermQuery) -> int:
+    analyzed = index.analyzer.analyze_term(term.term)
+    if analyzed is None:
+        return 0
+    return index.get_doc_freq(field_term(analyzed, term.field))
+
+
+def estimate(index: IndexReader, query: Query) -> Conjunct:
+    """
+    Estimates the number of documents matching `query` and the number of
+    postings read to evaluate it from the document frequencies of its terms.
+    """
+    if query.type == QueryType.TERM:
+        doc_freq = _doc_freq(index, query)
+        return Conjunct(query, doc_freq, doc_freq)
+
+    if query.type == QueryType.PHRASE:
+        terms = [index.analyzer.analyze_term(x) for x in query.parts]
+        terms = index.analyzer.phrase_terms([x for x in terms if x is not None])
+        doc_freqs = [index.get_doc_freq(field_term(x, query.field)) for x in terms]
+        # Every document containing the phrase contains all of its terms, or
+        # all of its biwords if they are indexed.
+        return Conjunct(query, min(doc_freqs, default=0), sum(doc_freqs))
+
+    if query.type == QueryType.PROX:
+        doc_freqs = [_doc_freq(index, query.term_a), _doc_freq(index, query.term_b)]
+        return Conjunct(query, min(doc_freqs), sum(doc_freqs))
+
+    if query.type == QueryType.OR:
+        num_docs = len(index.doc_ids)
+        parts = [estimate(index, x) for x in query.parts]
+        # A negated part matches all documents not matching the part itself.
+        estimates = [
+            num_docs - x.estimate if x.query.is_not else x.estimate for x in parts
+        ]
+        return Conjunct(
+            query,
+            min(num_docs, sum(estimates)),
+            sum(x.cost for x in parts),
+        )
+
+    if query.type == QueryType.GROUP:
+        group_plan = plan(index, query.and_queries)
+        return Conjunct(query, group_plan.estimate, group_plan.cost, group_plan)
+
+    raise ValueError(f'Cannot estimate query "{query}"')
+
+
+def plan(index: IndexReader, and_queries: Sequence[Query]) -> Plan:
+    """Creates the execution plan for the conjunction of `and_queries`."""
+    include = []
+    exclude = []
+    for query in and_queries:
+        conjunct = estimate(index, query)
+        (exclude if query.is_not else include).append(conjunct)
+
+    include.sort(key=lambda x: x.estimate)
+    # Removing the largest results first shrinks the result the most.
+    exclude.sort(key=lambda x: x.estimate, reverse=True)
+    return Plan(include, exclude, len(index.doc_ids))
@@ -1,9 +1,31 @@
+import bisect
+import heapq
+import itertools
+from typing import Sequence
+
 from index import PositionalPosting
 
+# Intersections use galloping search once the longer list is at least this
+# many times longer than the shorter one. Below, a linear merge is faster.
+GALLOP_RATIO = 8
+
 
 class Posting:
     @staticmethod
-    def intersect(p1: list[int], p2: list[int]) -> list[int]:
+    def intersect(p1: Sequence[int], p2: Sequence[int]) -> list[int]:
+        """
+        Returns the intersection of the sorted doc ID lists `p1` and `p2`.
+
+        Lists of similar length are merged linearly, otherwise the shorter
+        list is searched in the longer one by galloping.
+        """
+        p1, p2 = (p1, p2) if len(p1) <= len(p2) else (p2, p1)
+        if len(p2) >= GALLOP_RATIO * len(p1):
+            return Posting.gallop_intersect(p1, p2)
+        return Posting.merge_intersect(p1, p2)
+
+    @staticmethod
+    def merge_intersect(p1: Sequence[int], p2: Sequence[int]) -> list[int]:
         """
         Basic intersect that merges the lists `p1` and `p2` and returns their
         intersection of doc IDs.
@@ -25,6 +47,40 @@ class Posting:
 
         return result
 
+    @staticmethod
+    def gallop_intersect(p1: Sequence[int], p2: Sequence[int]) -> list[int]:
+        """
+        Intersects the lists `p1` and `p2` by searching every doc ID of the
+        shorter list in the longer one. The search first doubles its step
+        size until it passes the doc ID (exponential search) and then
+        bisects the last step, so the intersection costs
+        O(len(short) * log(len(long))). The result is the same as for
+        `merge_intersect`.
+        """
+        p1, p2 = (p1, p2) if len(p1) <= len(p2) else (p2, p1)
+        result = []
+        n = len(p2)
+        j = 0
+
+        for doc_id in p1:
+            # Find an upper bound for the position of `doc_id` in `p2`.
+            lo = j
+            step = 1
+            hi = j
+            while hi < n and p2[hi] < doc_id:
+                lo = hi + 1
+                hi = j + step
+                step *= 2
+
+            j = bisect.bisect_left(p2, doc_id, lo, min(hi, n))
+            if j == n:
+                break
+            if p2[j] == doc_id:
+                result.append(doc_id)
+                j += 1
+
+        return result
+
     @staticmethod
     def union(p1: list[int], p2: list[int]) -> list[int]:
         p1, p2 = (p1, p2) if len(p1) <= len(p2) else (p2, p1)
@@ -55,6 +111,36 @@ class Posting:
 
         return result
 
+    @staticmethod
+    def and_not(p1: Sequence[int], p2: Sequence[int]) -> list[int]:
+        """
+        Returns the doc IDs of the sorted list `p1` which are not in `p2` by
+        merging both lists. Every doc ID is returned only once.
+        """
+        result: list[int] = []
+        j = 0
+
+        for doc_id in p1:
+            while j < len(p2) and p2[j] < doc_id:
+                j += 1
+            if j < len(p2) and p2[j] == doc_id:
+                continue
+            if not result or result[-1] != doc_id:
+                result.append(doc_id)
+
+        return result
+
+    @staticmethod
+    def union_many(lists: Sequence[Sequence[int]]) -> list[int]:
+        """
+        Returns the union of all sorted doc ID lists in `lists` with a single
+        k-way merge over a heap, which costs O(n log k) for n doc IDs in k
+        lists. Every doc ID is returned only once.
+        """
+        if len(lists) == 1:
+            return [doc_id for doc_id, _ in itertools.groupby(lists[0])]
+        return [doc_id for doc_id, _ in itertools.groupby(heapq.merge(*lists))]
+
     # Basic AND_Not merge two lists of IndexTerm objects and return the result as list
     def andNot(list1: list[PositionalPosting], list2: list[PositionalPosting]):
         list1, list2 = swapListIfSecondIsSmaller(list1, list2)
@@ -176,16 +262,61 @@ class Posting:
 
         return PositionalPosting(pos_a.doc_id, positions)
 
+    @staticmethod
+    def proximity_positions(
+        pp1: Sequence[int], pp2: Sequence[int], k: int
+    ) -> list[int]:
+        """
+        Returns the positions of `pp2` which are at most `k` positions away
+        from a position in `pp1`.
+
+        Both lists are sorted, so a single pass suffices: the pointer into
+        `pp1` only moves forward past the positions that are too far left of
+        the current position of `pp2`.
+        """
+        result = []
+        i = 0
+        n = len(pp1)
+
+        for pos in pp2:
+            while i < n and pp1[i] < pos - k:
+                i += 1
+            if i == n:
+                break
+            if pp1[i] <= pos + k:
+                result.append(pos)
+
+        return result
+
+    @staticmethod
+    def phrase_positions(positions: Sequence[Sequence[int]]) -> list[int]:
+        """
+        Returns the positions at which a phrase starts, where `positions[i]`
+        are the positions of the i-th term of the phrase in a document. The
+        phrase starts at `p` if `positions[i]` contains `p + i` for every
+        term. The positions of every term are shifted by their offset in the
+        phrase and intersected, starting with the term with the fewest
+        positions.
+        """
+        order = sorted(range(len(positions)), key=lambda i: len(positions[i]))
+        starts = {pos - order[0] for pos in positions[order[0]]}
+        for i in order[1:]:
+            starts.intersection_update([pos - i for pos in positions[i]])
+            if not starts:
+                return []
+        return sorted(starts)
+
     @staticmethod
     def positional_intersect(
-        p1: list[PositionalPosting], p2: list[PositionalPosting], k: int
+        p1: Sequence[PositionalPosting], p2: Sequence[PositionalPosting], k: int
     ) -> list[PositionalPosting]:
         """
         Returns the positional intersect of p1 and p2 where the terms are at
-        most k terms apart.
+        most k terms apart. For every document the result contains one
+        posting with the matching positions of the term of p2.
 
-        This function can be used to implement the proximity operator and phrase
-        queries.
+        This function can be used to implement the proximity operator. The
+        cost is linear in the number of postings and positions.
         """
         answer: list[PositionalPosting] = []
         i = 0
@@ -193,27 +324,11 @@ class Posting:
 
         while i < len(p1) and j < len(p2):
             if p1[i].doc_id == p2[j].doc_id:
-                l = []
-                pp1 = p1[i].positions
-                pp2 = p2[j].positions
-                pp1_i = 0
-
-                while pp1_i < len(pp1):
-                    pp2_i = 0
-                    while pp2_i < len(pp2):
-                        if abs(pp1[pp1_i] - pp2[pp2_i]) <= k:
-                            l.append(pp2[pp2_i])
-                        elif pp2[pp2_i] > pp1[pp1_i]:
-                            break
-                        pp2_i += 1
-                    while l != [] and abs(l[0] - pp1[pp1_i]) > k:
-                        del l[0]
-
-                    answer += [
-                        PositionalPosting(p1[i].doc_id, [pp1[pp1_i], pos]) for pos in l
-                    ]
-                    pp1_i += 1
-
+                positions = Posting.proximity_positions(
+                    p1[i].positions, p2[j].positions, k
+                )
+                if positions:
+                    answer.append(PositionalPosting(p1[i].doc_id, positions))
                 i += 1
                 j += 1
             elif p1[i].doc_id < p2[j].doc_id:
@@ -223,6 +338,43 @@ class Posting:
 
         return answer
 
+    @staticmethod
+    def phrase_intersect(
+        postings: Sequence[Sequence[PositionalPosting]],
+    ) -> list[PositionalPosting]:
+        """
+        Returns one posting for every document that contains the phrase whose
+        i-th term has the postings `postings[i]`. The positions of a posting
+        are the positions at which the phrase starts.
+
+        The documents of the term with the fewest postings are looked up in
+        the other lists, whose pointers only move forward.
+        """
+        answer: list[PositionalPosting] = []
+        lead = min(range(len(postings)), key=lambda i: len(postings[i]))
+        pointers = [0] * len(postings)
+
+        for posting in postings[lead]:
+            doc_id = posting.doc_id
+            doc_positions = []
+
+            for i, other in enumerate(postings):
+                j = pointers[i]
+                while j < len(other) and other[j].doc_id < doc_id:
+                    j += 1
+                pointers[i] = j
+                if j == len(other):
+                    return answer
+                if other[j].doc_id != doc_id:
+                    break
+                doc_positions.append(other[j].positions)
+            else:
+                starts = Posting.phrase_positions(doc_positions)
+                if starts:
+                    answer.append(PositionalPosting(doc_id, starts))
+
+        return answer
+
     # Sort the list of IndexTerm objects by term frequency
     def sortByTermFrequency(self, terms):
         return sorted(terms, key=lambda k: k.tf, reverse=True)
@@ -0,0 +1,135 @@
+import re
+from typing import Iterator
+
+import tokenizer
+
+# Tokens of the CISI.BLN format: operators like "#and", quoted terms and
+# punctuation. Everything else except whitespace is invalid.
+_BLN_TOKEN = re.compile(r"\s*(?:(#\w+)|'([^']*)'|([(),=;])|(\S))")
+
+# Operators of the CISI.BLN format and the operator they are translated to.
+_BLN_OPERATORS = {"#and": "AND", "#or": "OR"}
+
+
+def _bln_tokens(text: str) -> Iterator[str]:
+    """
+    Returns the tokens of `text`. Terms are returned with their quotes, so
+    they cannot be confused with operators.
+    """
+    for match in _BLN_TOKEN.finditer(text):
+        operator, term, punctuation, invalid = match.groups()
+        if invalid is not None:
+            raise ValueError(f'Unexpected character "{invalid}" in boolean query file')
+        if operator is not None:
+            yield operator
+        elif term is not None:
+            yield f"'{term}'"
+        else:
+            yield punctuation
+
+
+def _translate_term(term: str) -> str:
+    # Terms are tokenized like the documents, e.g. 'computer-ready' is
+    # indexed as "computer". Terms of several tokens become a phrase.
+    tokens = [x for x, _ in tokenizer.tokenize_text(term)]
+    if not tokens:
+        raise ValueError(f'Term "{term}" contains no token')
+    if len(tokens) == 1:
+        return tokens[0]
+    return '"' + " ".join(tokens) + '"'
+
+
+class _BlnParser:
+    """Recursive descent parser translating one CISI.BLN expression."""
+
+    def __init__(self, tokens: list[str]):
+        self._tokens = tokens
+        self._i = 0
+
+    def _next(self) -> str:
+        if self._i == len(self._tokens):
+            raise ValueError("Unexpected end of boolean query file")
+        self._i += 1
+        return self._tokens[self._i - 1]
+
+    def _expect(self, expected: str):
+        token = self._next()
+        if token != expected:
+            raise ValueError(f'Expected "{expected}" but found "{token}"')
+
+    def expression(self, nested: bool = False) -> str:
+        """
+        Translates the next expression. Nested expressions with operators are
+        put in parentheses.
+        """
+        token = self._next()
+        if token.startswith("'"):
+            return _translate_term(token[1:-1])
+
+        if token == "#not":
+            self._expect("(")
+            operand = self.expression(nested=True)
+            self._expect(")")
+            return f"NOT {operand}"
+
+        if token not in _BLN_OPERATORS:
+            raise ValueError(f'Unknown operator "{token}"')
+
+        self._expect("(")
+        operands = [self.expression(nested=True)]
+        separator = self._next()
+        while separator == ",":
+            operands.append(self.expression(nested=True))
+            separator = self._next()
+        if separator != ")":
+            raise ValueError(f'Expected ")" but found "{separator}"')
+
+        if len(operands) == 1:
+            return operands[0]
+        translated = f" {_BLN_OPERATORS[token]} ".join(operands)
+        return f"({translated})" if nested else translated
+
+
+def translate_bln(text: str) -> list[tuple[int, str]]:
+    """
+    Translates the boolean queries of the CISI.BLN format into the syntax of
+    `input_parser` and returns them with their query IDs.
+
+    Every query has the form "#q<ID>= <expression>;", where an expression is
+    a quoted term or one of "#and (...)", "#or (...)" and "#not (...)".
+    Settings like "#default_ct = 3;" and "#endcoll;" are skipped.
+
+    Example:
+        #q3= #and ('information', #or ('science', 'definition'));
+        is translated to: information AND (science OR definition)
+    """
+    queries = []
+    # Every statement ends with a semicolon.
+    for statement in text.split(";"):
+        match = re.match(r"\s*#q(\d+)\s*=", statement)
+        if match is None:
+            continue
+        parser = _BlnParser(list(_bln_tokens(statement[match.end() :])))
+        queries.append((int(match.group(1)), parser.expression()))
+    return queries
+
+
+def read_query_file(path: str) -> list[tuple[int, str]]:
+    """
+    Reads the boolean queries of `path` together with their IDs.
+
+    Files in the CISI.BLN format are translated with `translate_bln`. Other
+    files contain one query per line in the syntax of `input_parser`, the ID
+    of a query is its line number. Empty lines are skipped.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+
+    if re.search(r"^\s*#q\d+\s*=", text, re.MULTILINE):
+        return translate_bln(text)
+
+    return [
+        (line_number, line.strip())
+        for line_number, line in enumerate(text.splitlines(), start=1)
+        if line.strip()
+    ]
@@ -0,0 +1,177 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Sequence, Union
+
+from bitmap import Bitmap
+from index import field_term
+from input_parser import Query, QueryType
+
+# Default bounds of a result cache.
+MAX_ENTRIES = 1024
+MAX_BYTES = 64 * 2**20
+
+# Size of an int object holding a doc ID below 2**30.
+_INT_BYTES = sys.getsizeof(2**16)
+
+Result = Union[list[int], Bitmap]
+
+
+def _negate(key: str) -> str:
+    return key[4:] if key.startswith("NOT ") else "NOT " + key
+
+
+def _and_parts(and_queries: Sequence[Query]) -> set[str]:
+    parts = set()
+    for query in and_queries:
+        if query.type == QueryType.GROUP and not query.is_not:
+            # a AND (b AND c) is a AND b AND c.
+            parts |= _and_parts(query.and_queries)
+        else:
+            parts.add(_key(query))
+    return parts
+
+
+def _or_parts(or_queries: Sequence[Query]) -> set[str]:
+    parts = set()
+    for query in or_queries:
+        if query.type == QueryType.OR and not query.is_not:
+            parts |= _or_parts(query.parts)
+        else:
+            parts.add(_key(query))
+    return parts
+
+
+def _join(parts: set[str], operator: str) -> str:
+    if len(parts) == 1:
+        return next(iter(parts))
+    return "(" + f" {operator} ".join(sorted(parts)) + ")"
+
+
+def _key(query: Query, negation: bool = True) -> str:
+    if query.type == QueryType.TERM:
+        key = field_term(query.term, query.field)
+    elif query.type == QueryType.PHRASE:
+        key = field_term('"' + " ".join(query.parts) + '"', query.field)
+    elif query.type == QueryType.PROX:
+        # The distance is measured in both directions, so the terms commute.
+        terms = sorted([_key(query.term_a), _key(query.term_b)])
+        key = f"{terms[0]} /{query.k} {terms[1]}"
+    elif query.type == QueryType.OR:
+        key = _join(_or_parts(query.parts), "OR")
+    elif query.type == QueryType.GROUP:
+        key = _join(_and_parts(query.and_queries), "AND")
+    else:
+        raise ValueError(f'Cannot create the key of query "{query}"')
+
+    # Negating a negated query, e.g. NOT (NOT a), removes both negations.
+    return _negate(key) if negation and query.is_not else key
+
+
+def query_key(query: Query) -> str:
+    """
+    Returns the canonical form of `query`, ignoring its negation. Queries
+    with the same canonical form match the same documents.
+    """
+    return _key(query, negation=False)
+
+
+def conjunction_key(and_queries: Sequence[Query]) -> str:
+    """
+    Returns the canonical form of the conjunction of `and_queries`.
+
+    The operands of AND and OR are sorted and duplicates are removed, nested
+    conjunctions and disjunctions are flattened and double negations are
+    removed. E.g. "b AND (NOT (NOT a))" and "a AND b AND b" have the same
+    canonical form "(a AND b)".
+    """
+    return _join(_and_parts(and_queries), "AND")
+
+
+def result_bytes(doc_ids: Result) -> int:
+    """Returns the estimated number of bytes a query result uses."""
+    if isinstance(doc_ids, Bitmap):
+        return doc_ids.memory_usage()
+    return sys.getsizeof(doc_ids) + len(doc_ids) * _INT_BYTES
+
+
+class ResultCache:
+    """
+    Least recently used cache of query results.
+
+    The cache holds at most `max_entries` results using at most `max_bytes`
+    bytes, larger results are not cached at all. All entries belong to one
+    version of the index, they are dropped as soon as the cache is used with
+    another version. `hits` and `misses` count the lookups.
+
+    Cached results are shared between all callers and must not be modified.
+    The cache can be used from several threads at once.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        # Mapping from key to the result and its size, least recently used
+        # first.
+        self._entries: OrderedDict[Hashable, tuple[Result, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"ResultCache({len(self)} entries, {self.bytes} bytes, "
+            f"{self.hits} hits, {self.misses} misses)"
+        )
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _use_version(self, version: int):
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def get(self, version: int, key: Hashable) -> Optional[Result]:
+        """
+        Returns the cached result for `key` in version `version` of the index
+        or `None` if it is not cached.
+        """
+        with self._lock:
+            self._use_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, version: int, key: Hashable, doc_ids: Result):
+        """
+        Caches the result `doc_ids` for `key` in version `version` of the
+        index. The least recently used entries are evicted until the cache
+        is within its bounds again.
+        """
+        size = result_bytes(doc_ids)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._use_version(version)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (doc_ids, size)
+            self.bytes += size
+
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
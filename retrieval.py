@@ -1,8 +1,10 @@
 import math
 from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Optional
 
 import tokenizer
-from index import Index
+from index import DEFAULT_FIELD, CachingIndexReader, IndexReader, field_term
 
 
 class RankedResult:
@@ -38,56 +40,94 @@ class InitRetrievalSystem(ABC):
 
 
 class TFIDFRetrievalSystem(InitRetrievalSystem):
-    def __init__(self, index: Index):
+    def __init__(
+        self, index: IndexReader, field_weights: Optional[dict[str, float]] = None
+    ):
+        """
+        Create a new tf-idf retrieval system.
+
+        field_weights: Mapping from field to the weight of its score. By
+        default only the default field is searched.
+        """
         super().__init__(index.doc_ids)
         self._index = index
+        self._field_weights = field_weights or {DEFAULT_FIELD: 1.0}
 
     def retrieve(self, query: str) -> list[RankedResult]:
-        tokens = list(map(lambda x: x[0], tokenizer.tokenize_text(query)))
-        return self._fast_cosine_score(tokens)
+        return self._fast_cosine_score(self._tokenize(query))
 
     def retrieve_k(self, query: str, k: int) -> list[RankedResult]:
-        tokens = list(map(lambda x: x[0], tokenizer.tokenize_text(query)))
-        return self._fast_cosine_score(tokens)[:k]
+        return self._fast_cosine_score(self._tokenize(query))[:k]
+
+    def _tokenize(self, query: str) -> list[str]:
+        """Tokenizes `query` with the analyzer of the index."""
+        tokens = self._index.analyzer.analyze(tokenizer.tokenize_text(query))
+        return list(map(lambda x: x[0], tokens))
 
     def _fast_cosine_score(self, query: list[str]) -> list[RankedResult]:
         """
         Implements the fast cosine score algorithm from chapter 8 slide 9.
 
-        Takes in a tokenized query and returns a list of ranked results.
+        Takes in a tokenized query and returns a list of ranked results. The
+        score of a document is the weighted sum of the scores of its fields.
+        """
+        # Mapping from doc id to score.
+        scores: dict[int, float] = {}
+        # Terms occurring several times in the query are only looked up once.
+        index = CachingIndexReader(self._index)
+
+        for field, weight in self._field_weights.items():
+            field_scores = self._field_scores(index, query, field)
+            for doc_id, score in field_scores.items():
+                scores[doc_id] = scores.get(doc_id, 0) + weight * score
+
+        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        ranked_results = list(map(lambda x: RankedResult(x[0], x[1]), sorted_scores))
+
+        return ranked_results
+
+    def _field_scores(
+        self, index: IndexReader, query: list[str], field: str
+    ) -> dict[int, float]:
+        """
+        Returns the mapping from doc id to the score of `field` for the
+        tokenized `query`. Scores are normalized by the length of the field.
         """
         # Mapping from doc id to score.
         scores: dict[int, float] = {}
 
         num_docs = len(self._index.doc_ids)
-        avg_doc_len = self._index.avg_doc_length
+        field_lengths, avg_field_len = index.get_field_lengths(field)
+        term_ids = [index.get_term_id(field_term(term, field)) for term in query]
+        # Mapping from term ID to its number of occurrences in the query.
+        query_counts = Counter(term_ids)
+
+        for term_id in term_ids:
+            if term_id is None:
+                continue
 
-        for term in query:
-            posting_list = self._index.get_posting_list(term)
+            posting_list = index.get_posting_list_by_id(term_id)
 
             if posting_list is None:
                 continue
 
             df_t = posting_list.doc_freq
+            tf_tq = math.log10(query_counts[term_id] + 1)
 
-            for doc_id in posting_list.doc_ids:
-                tf_tq = math.log10(query.count(term) + 1)
-                tf_td = posting_list.get_term_frequency(doc_id)
-                doc_len = self._index.doc_lengths[doc_id]
+            for doc_id, term_freq in zip(posting_list.doc_ids, posting_list.term_freqs):
+                tf_td = math.log10(term_freq + 1)
+                doc_len = field_lengths[doc_id]
 
                 wf_td = self._weighted_term_value(
-                    tf_tq, tf_td, df_t, num_docs, doc_len, avg_doc_len
+                    tf_tq, tf_td, df_t, num_docs, doc_len, avg_field_len
                 )
 
                 scores[doc_id] = scores.get(doc_id, 0) + wf_td
 
         for doc_id in scores.keys():
-            scores[doc_id] /= float(self._index.doc_lengths[doc_id])
+            scores[doc_id] /= float(field_lengths[doc_id])
 
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        ranked_results = list(map(lambda x: RankedResult(x[0], x[1]), sorted_scores))
-
-        return ranked_results
+        return scores
 
     def _weighted_term_value(
         self,
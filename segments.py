@@ -0,0 +1,380 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+from array import array
+from typing import Callable, Iterable, Iterator, Optional
+
+from analyzer import Analyzer
+from index import IndexReader, Lexicon, PostingList, average_length
+from index_store import IndexFormatError, IndexWriter, MappedIndex, save_index
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+# The merge policy merges segments as soon as there are more than this many.
+MAX_SEGMENTS = 8
+
+
+class SegmentedIndex(IndexReader):
+    """
+    Unified read-only view over several immutable index segments.
+
+    Every segment is a `MappedIndex` together with the set of its deleted doc
+    IDs (tombstones). A document is only visible in at most one segment, so
+    the postings of all segments can be merged by doc ID.
+    """
+
+    def __init__(
+        self,
+        segments: list[tuple[MappedIndex, set[int]]],
+        analyzer: Optional[Analyzer] = None,
+        version: int = 0,
+    ):
+        self._segments = segments
+        self.analyzer = analyzer or Analyzer()
+        self.version = version
+        self.doc_lengths = {
+            doc_id: length
+            for segment, deleted in segments
+            for doc_id, length in segment.doc_lengths.items()
+            if doc_id not in deleted
+        }
+        self.doc_ids = sorted(
+            doc_id
+            for segment, deleted in segments
+            for doc_id in segment.doc_ids
+            if doc_id not in deleted
+        )
+        self.avg_doc_length = average_length(self.doc_lengths)
+        self.field_lengths: dict[str, dict[int, int]] = {}
+        for segment, deleted in segments:
+            for field, lengths in segment.field_lengths.items():
+                self.field_lengths.setdefault(field, {}).update(
+                    (doc_id, length)
+                    for doc_id, length in lengths.items()
+                    if doc_id not in deleted
+                )
+        self.avg_field_lengths = {
+            field: average_length(lengths)
+            for field, lengths in self.field_lengths.items()
+        }
+        # Term dictionary over all segments and, for every segment, an array
+        # mapping a term ID to the ID of the term in the segment (-1 if the
+        # segment does not contain the term). A single segment uses its own
+        # term IDs, otherwise both are built on first use.
+        self._lexicon: Optional[Lexicon] = None
+        self._segment_term_ids: list[array] = []
+        # The view may be shared between threads, the lexicon is only built
+        # by one of them.
+        self._lexicon_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SegmentedIndex({len(self._segments)} segments, {len(self.doc_ids)} docs)\n"
+
+    def terms(self) -> Iterator[str]:
+        merged = heapq.merge(*[segment.terms() for segment, _ in self._segments])
+        for term, _ in itertools.groupby(merged):
+            yield term
+
+    def _load_lexicon(self) -> Lexicon:
+        with self._lexicon_lock:
+            if self._lexicon is None:
+                lexicon = Lexicon(self.terms())
+                for segment, _ in self._segments:
+                    term_ids = array("i", [-1]) * len(lexicon)
+                    for segment_term_id, term in enumerate(segment.terms()):
+                        term_ids[lexicon.get_id(term)] = segment_term_id
+                    self._segment_term_ids.append(term_ids)
+                self._lexicon = lexicon
+        return self._lexicon
+
+    def get_term_id(self, term: str) -> Optional[int]:
+        if len(self._segments) == 1:
+            return self._segments[0][0].get_term_id(term)
+        return self._load_lexicon().get_id(term)
+
+    def get_term(self, term_id: int) -> str:
+        if len(self._segments) == 1:
+            return self._segments[0][0].get_term(term_id)
+        return self._load_lexicon().get_term(term_id)
+
+    def get_doc_freq_by_id(self, term_id: int) -> int:
+        """
+        Returns the number of documents containing the term `term_id`. If
+        documents were deleted, this is an upper bound, because the deleted
+        postings are only skipped when the postings are decoded.
+        """
+        if len(self._segments) == 1:
+            return self._segments[0][0].get_doc_freq_by_id(term_id)
+
+        self._load_lexicon()
+        doc_freq = 0
+        for (segment, _), term_ids in zip(self._segments, self._segment_term_ids):
+            if term_ids[term_id] >= 0:
+                doc_freq += segment.get_doc_freq_by_id(term_ids[term_id])
+        return doc_freq
+
+    def get_posting_list_by_id(self, term_id: int) -> Optional[PostingList]:
+        if len(self._segments) == 1:
+            if not self._segments[0][1]:
+                return self._segments[0][0].get_posting_list_by_id(term_id)
+            segment_term_ids = [term_id]
+        else:
+            self._load_lexicon()
+            segment_term_ids = [x[term_id] for x in self._segment_term_ids]
+
+        lists = []
+        for (segment, deleted), segment_term_id in zip(
+            self._segments, segment_term_ids
+        ):
+            if segment_term_id < 0:
+                continue
+            postings = segment.get_posting_list_by_id(segment_term_id).postings
+            if deleted:
+                postings = tuple(x for x in postings if x.doc_id not in deleted)
+            if postings:
+                lists.append(postings)
+
+        if not lists:
+            return None
+        if len(lists) == 1:
+            postings = lists[0]
+        else:
+            postings = heapq.merge(*lists, key=lambda k: k.doc_id)
+        return PostingList.from_postings(self.get_term(term_id), postings)
+
+
+class IndexDirectory:
+    """
+    A directory containing an index made of immutable segments.
+
+    The manifest lists the segments, the deleted doc IDs of every segment and
+    information about the corpus the index was built from. Adding documents
+    writes a new segment, deleting documents only records tombstones. Merging
+    segments writes a new segment without the deleted documents.
+
+    Only one process may modify an index directory at a time, but any number
+    of processes can read it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._manifest = self._read_manifest()
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, MANIFEST), "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+
+        return manifest
+
+    def _write_manifest(self):
+        # Every change of the manifest is a new version of the index.
+        self._manifest["generation"] = self._manifest.get("generation", 0) + 1
+        tmp_path = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+
+        # Remove segment files which are no longer part of the index. Readers
+        # which still have them mapped keep working.
+        names = {x["name"] for x in self._manifest["segments"]}
+        for name in os.listdir(self.path):
+            if name.endswith(".seg") and name not in names:
+                os.remove(os.path.join(self.path, name))
+
+    @property
+    def exists(self) -> bool:
+        return self._manifest is not None
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Fingerprint of the corpus the index was last synchronized with."""
+        return self._manifest["fingerprint"] if self._manifest else None
+
+    @property
+    def corpus(self) -> Optional[str]:
+        """Path of the corpus the index was built from."""
+        return self._manifest.get("corpus") if self._manifest else None
+
+    @property
+    def doc_hashes(self) -> dict[int, str]:
+        """Mapping from doc ID to the hash of the indexed document."""
+        if self._manifest is None:
+            return {}
+        return {int(k): v for k, v in self._manifest["doc_hashes"].items()}
+
+    @property
+    def compress(self) -> bool:
+        """Whether the postings of new segments are compressed."""
+        return self._manifest.get("compress", False) if self._manifest else False
+
+    @property
+    def version(self) -> int:
+        """Number which changes whenever the contents of the index change."""
+        return self._manifest.get("generation", 0) if self._manifest else 0
+
+    @property
+    def analyzer(self) -> Analyzer:
+        """Analyzer all segments are indexed with."""
+        if self._manifest is None:
+            return Analyzer()
+        return Analyzer.from_config(self._manifest.get("analyzer", {}))
+
+    @property
+    def segments(self) -> list[tuple[str, set[int]]]:
+        """Names of all segments together with their deleted doc IDs."""
+        if self._manifest is None:
+            return []
+        return [(x["name"], set(x["deleted"])) for x in self._manifest["segments"]]
+
+    def _new_segment(self) -> tuple[str, str]:
+        name = f"{self._manifest['next_segment']:06d}.seg"
+        self._manifest["next_segment"] += 1
+        return name, os.path.join(self.path, name)
+
+    def _open_segment(self, name: str) -> MappedIndex:
+        return MappedIndex(os.path.join(self.path, name))
+
+    def open(self) -> SegmentedIndex:
+        """Returns a read-only view of all segments."""
+        if self._manifest is None:
+            raise IndexFormatError(f'"{self.path}" does not contain an index')
+        return SegmentedIndex(
+            [(self._open_segment(name), deleted) for name, deleted in self.segments],
+            self.analyzer,
+            self.version,
+        )
+
+    def rebuild(
+        self,
+        write_segment: Callable[[str], None],
+        compress: bool = False,
+        analyzer: Optional[Analyzer] = None,
+    ):
+        """
+        Replaces all segments by a single new one. `write_segment` is called
+        with the path the new segment has to be written to. If `compress` is
+        set, segments written later on are compressed as well. `analyzer` is
+        the analyzer the new segment was built with and has to be used for
+        all segments added later on.
+        """
+        if os.path.isfile(self.path):
+            # Index file of an older version.
+            os.remove(self.path)
+        os.makedirs(self.path, exist_ok=True)
+
+        next_segment = self._manifest["next_segment"] if self._manifest else 0
+        self._manifest = {
+            "version": MANIFEST_VERSION,
+            "generation": self.version,
+            "fingerprint": None,
+            "doc_hashes": {},
+            "next_segment": next_segment,
+            "compress": compress,
+            "analyzer": (analyzer or Analyzer()).to_config(),
+            "segments": [],
+        }
+
+        name, path = self._new_segment()
+        write_segment(path)
+        self._manifest["segments"] = [{"name": name, "deleted": []}]
+        self._write_manifest()
+
+    def set_source(self, fingerprint: str, doc_hashes: dict[int, str], corpus: str):
+        """Records the corpus the index is now synchronized with."""
+        self._manifest["corpus"] = corpus
+        self._manifest["fingerprint"] = fingerprint
+        self._manifest["doc_hashes"] = {str(k): v for k, v in doc_hashes.items()}
+        self._write_manifest()
+
+    def delete_documents(self, doc_ids: Iterable[int]):
+        """Records tombstones for `doc_ids` in every segment containing them."""
+        doc_ids = set(doc_ids)
+        if not doc_ids:
+            return
+
+        for segment in self._manifest["segments"]:
+            reader = self._open_segment(segment["name"])
+            contained = doc_ids & reader.doc_lengths.keys()
+            segment["deleted"] = sorted(set(segment["deleted"]) | contained)
+
+        self._write_manifest()
+
+    def add_documents(self, index: IndexReader):
+        """
+        Adds all documents of `index` as a new segment. Documents which are
+        already part of the index are replaced.
+        """
+        self.delete_documents(index.doc_lengths.keys())
+
+        name, path = self._new_segment()
+        save_index(index, path, name, self.compress)
+        self._manifest["segments"].append({"name": name, "deleted": []})
+        self._write_manifest()
+
+    def merge(self, names: Optional[list[str]] = None):
+        """
+        Merges the segments `names`, or all segments if `names` is `None`, into
+        a single new segment that does not contain deleted documents.
+        """
+        segments = [
+            x for x in self._manifest["segments"] if names is None or x["name"] in names
+        ]
+        if not segments:
+            return
+
+        view = SegmentedIndex(
+            [(self._open_segment(x["name"]), set(x["deleted"])) for x in segments]
+        )
+        name, path = self._new_segment()
+
+        with IndexWriter(path, name, self.compress) as writer:
+            for term in view.terms():
+                posting_list = view.get_posting_list(term)
+                if posting_list is None:
+                    continue
+
+                writer.add_term(
+                    term,
+                    posting_list.doc_ids,
+                    posting_list.term_freqs,
+                    posting_list.positions,
+                )
+            writer.set_documents(view.doc_lengths, view.field_lengths)
+
+        merged = {x["name"] for x in segments}
+        remaining = [x for x in self._manifest["segments"] if x["name"] not in merged]
+        self._manifest["segments"] = remaining + [{"name": name, "deleted": []}]
+        self._write_manifest()
+
+    def apply_merge_policy(self, max_segments: int = MAX_SEGMENTS):
+        """
+        Drops segments whose documents are all deleted. If there are still more
+        than `max_segments` segments, all segments except the largest one are
+        merged.
+        """
+        live_docs = {}
+        for name, deleted in self.segments:
+            live_docs[name] = len(self._open_segment(name).doc_lengths.keys() - deleted)
+
+        segments = self._manifest["segments"]
+        if any(live_docs[x["name"]] == 0 for x in segments) and len(segments) > 1:
+            self._manifest["segments"] = [
+                x for x in segments if live_docs[x["name"]] > 0
+            ] or segments[-1:]
+            self._write_manifest()
+
+        if len(self._manifest["segments"]) > max_segments:
+            names = sorted(
+                (x["name"] for x in self._manifest["segments"]),
+                key=lambda x: live_docs[x],
+            )
+            self.merge(names[:-1])
@@ -0,0 +1,202 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from input_parser import QuerySyntaxError
+from result_cache import ResultCache
+from retrieval import RankedResult
+
+# Number of latencies per endpoint the percentiles are computed from.
+MAX_SAMPLES = 10000
+
+# Answers a boolean query, called with the query, k, r and the maximum number
+# of matches or `None` for all of them.
+BooleanSearch = Callable[[str, int, int, Optional[int]], list[int]]
+
+# Answers a tf-idf query, called with the query.
+RankedSearch = Callable[[str], list[RankedResult]]
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Returns the `p`-th percentile of `sorted_values` (nearest rank)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyStats:
+    """
+    Latencies of the last `MAX_SAMPLES` requests of every endpoint. Requests
+    are recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque[float]] = {}
+        self._counts: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=MAX_SAMPLES)).append(
+                seconds
+            )
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Returns the number of requests and the p50 and p99 latency in
+        milliseconds of every endpoint.
+        """
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+            counts = dict(self._counts)
+
+        return {
+            endpoint: {
+                "requests": counts[endpoint],
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+            for endpoint, values in samples.items()
+        }
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server answering boolean and tf-idf queries with JSON.
+
+    Every request is handled in its own thread. All threads share the
+    read-only index behind `boolean` and `tf_idf` and the result cache
+    `cache`, so the index is only loaded once.
+
+    Endpoints:
+        GET /boolean?q=QUERY[&k=3][&r=3][&limit=N]
+        GET /tf-idf?q=QUERY[&top=10]
+        GET /stats
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        boolean: BooleanSearch,
+        tf_idf: RankedSearch,
+        cache: Optional[ResultCache] = None,
+    ):
+        super().__init__(address, QueryHandler)
+        self.boolean = boolean
+        self.tf_idf = tf_idf
+        self.cache = cache
+        self.latency = LatencyStats()
+
+    def stats(self) -> dict:
+        stats = {"latency": self.latency.summary()}
+        if self.cache is not None:
+            stats["cache"] = {
+                "entries": len(self.cache),
+                "bytes": self.cache.bytes,
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            }
+        return stats
+
+
+class QueryError(Exception):
+    """Invalid parameters of a request."""
+
+    pass
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server: QueryServer
+
+    def log_message(self, format, *args):
+        # The query handlers already log every query.
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        handlers = {
+            "/boolean": self._boolean,
+            "/tf-idf": self._tf_idf,
+            "/stats": lambda _: self.server.stats(),
+        }
+
+        handler = handlers.get(url.path)
+        if handler is None:
+            self._send(404, {"error": f'Unknown endpoint "{url.path}"'})
+            return
+
+        start = time.perf_counter()
+        try:
+            body = handler(params)
+        except QueryError as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            # Keep serving other requests if a query fails.
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        elapsed = time.perf_counter() - start
+
+        if url.path != "/stats":
+            self.server.latency.record(url.path, elapsed)
+            body["time_ms"] = round(elapsed * 1000, 3)
+        self._send(200, body)
+
+    def _boolean(self, params: dict[str, str]) -> dict:
+        query = _query(params)
+        k = _int_param(params, "k", 3)
+        r = _int_param(params, "r", 3)
+        limit = _int_param(params, "limit", None)
+        try:
+            doc_ids = self.server.boolean(query, k, r, limit)
+        except QuerySyntaxError as e:
+            raise QueryError(f'Invalid query "{query}": {e}')
+        return {"query": query, "matches": len(doc_ids), "doc_ids": doc_ids}
+
+    def _tf_idf(self, params: dict[str, str]) -> dict:
+        query = _query(params)
+        top = _int_param(params, "top", 10)
+        results = self.server.tf_idf(query)[:top]
+        return {
+            "query": query,
+            "results": [{"doc_id": x.doc_id, "score": x.score} for x in results],
+        }
+
+
+def _query(params: dict[str, str]) -> str:
+    query = params.get("q", "").strip()
+    if not query:
+        raise QueryError('Missing parameter "q"')
+    return query
+
+
+def _int_param(
+    params: dict[str, str], name: str, default: Optional[int]
+) -> Optional[int]:
+    if name not in params:
+        return default
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise QueryError(f'Parameter "{name}" must be an integer')
+    if value < 1:
+        raise QueryError(f'Parameter "{name}" must be at least 1')
+    return value
@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import os
+import struct
+import tempfile
+from array import array
+from typing import Iterable, Iterator, Optional
+
+from index import DEFAULT_FIELD, field_term
+from index_store import IndexWriter
+
+# Rough number of bytes a new term costs in a block: the dictionary entry, the
+# term string and three empty arrays.
+TERM_OVERHEAD = 300
+
+# Header of a term in a run file: length of the term, number of postings and
+# number of positions.
+_RUN_ENTRY = struct.Struct("=III")
+
+
+def _read_run(path: str) -> Iterator[tuple[str, array, array, array]]:
+    """
+    Reads the run file at `path` and yields its terms in sorted order together
+    with their doc IDs, position counts and positions.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_RUN_ENTRY.size)
+            if not header:
+                break
+
+            term_len, num_postings, num_positions = _RUN_ENTRY.unpack(header)
+            term = f.read(term_len).decode()
+            doc_ids, counts, positions = array("I"), array("I"), array("I")
+            doc_ids.fromfile(f, num_postings)
+            counts.fromfile(f, num_postings)
+            positions.fromfile(f, num_positions)
+            yield term, doc_ids, counts, positions
+
+
+class SpimiIndexBuilder:
+    """
+    Builds an index file with a fixed memory budget (single-pass in-memory
+    indexing).
+
+    Postings are collected in an in-memory block until the block reaches
+    `memory_budget` bytes. The block is then written to a temporary run file
+    sorted by term and a new block is started. `write` merges all runs into
+    the final index file, so memory usage does not grow with the corpus size.
+
+    Documents must be added in ascending doc ID order.
+    """
+
+    def __init__(self, memory_budget: int, tmp_dir: Optional[str] = None):
+        self._memory_budget = memory_budget
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix="spimi-", dir=tmp_dir)
+        self._runs: list[str] = []
+        # Mapping from term to its doc IDs, position counts and positions.
+        self._block: dict[str, tuple[array, array, array]] = {}
+        self._block_bytes = 0
+        # Mapping from doc id to doc length.
+        self._doc_lengths: dict[int, int] = {}
+        # Mapping from field to the mapping from doc id to field length.
+        self._field_lengths: dict[str, dict[int, int]] = {}
+        self._last_doc_id: Optional[int] = None
+
+    @property
+    def num_runs(self) -> int:
+        return len(self._runs)
+
+    def add_document(
+        self,
+        doc_id: int,
+        tokens: Iterable[tuple[str, int]],
+        fields: Optional[dict[str, Iterable[tuple[str, int]]]] = None,
+    ) -> int:
+        """
+        Adds the `tokens` of the document `doc_id` and returns the length of
+        the document. Works like `IndexBuilder.add_document`.
+        """
+        if self._last_doc_id is not None and doc_id <= self._last_doc_id:
+            raise ValueError(
+                f"Document {doc_id} was added after document {self._last_doc_id}"
+            )
+        self._last_doc_id = doc_id
+
+        length = self._add_field(doc_id, tokens, DEFAULT_FIELD)
+        self._doc_lengths[doc_id] = length
+
+        for field, field_tokens in (fields or {}).items():
+            field_lengths = self._field_lengths.setdefault(field, {})
+            field_lengths[doc_id] = self._add_field(doc_id, field_tokens, field)
+
+        if self._block_bytes >= self._memory_budget:
+            self._spill()
+
+        return length
+
+    def _add_field(
+        self, doc_id: int, tokens: Iterable[tuple[str, int]], field: str
+    ) -> int:
+        """Adds the `tokens` of one field and returns the length of the field."""
+        # Mapping from term to its positions in this document.
+        doc_positions: dict[str, array] = {}
+        length = 0
+
+        for token, pos in tokens:
+            positions = doc_positions.get(token)
+            if positions is None:
+                positions = doc_positions[token] = array("I")
+            positions.append(pos + 1)
+            length = pos + 1
+
+        for token, positions in doc_positions.items():
+            term = field_term(token, field)
+            entry = self._block.get(term)
+            if entry is None:
+                entry = self._block[term] = (array("I"), array("I"), array("I"))
+                self._block_bytes += TERM_OVERHEAD + len(term)
+
+            doc_ids, counts, term_positions = entry
+            doc_ids.append(doc_id)
+            counts.append(len(positions))
+            term_positions.extend(positions)
+            self._block_bytes += (2 + len(positions)) * positions.itemsize
+
+        return length
+
+    def _spill(self):
+        """Writes the current block to a new run file."""
+        path = os.path.join(self._tmp_dir.name, f"run-{len(self._runs)}")
+
+        with open(path, "wb") as f:
+            for term in sorted(self._block.keys()):
+                doc_ids, counts, positions = self._block[term]
+                encoded = term.encode()
+                f.write(_RUN_ENTRY.pack(len(encoded), len(doc_ids), len(positions)))
+                f.write(encoded)
+                doc_ids.tofile(f)
+                counts.tofile(f)
+                positions.tofile(f)
+
+        self._runs.append(path)
+        self._block = {}
+        self._block_bytes = 0
+
+    def write(self, path: str, fingerprint: str, compress: bool = False) -> IndexWriter:
+        """
+        Merges all runs into the index file at `path` and removes the runs.
+        Returns the writer, which holds the size of the postings.
+        """
+        if self._block or not self._runs:
+            self._spill()
+
+        try:
+            runs = [_read_run(x) for x in self._runs]
+            # `heapq.merge` is stable, so the postings of a term are merged
+            # in the order of the runs, which is ascending doc ID order.
+            merged = heapq.merge(*runs, key=lambda x: x[0])
+
+            with IndexWriter(path, fingerprint, compress) as writer:
+                for term, entries in itertools.groupby(merged, key=lambda x: x[0]):
+                    doc_ids, counts, positions = array("I"), array("I"), array("I")
+                    for _, run_doc_ids, run_counts, run_positions in entries:
+                        doc_ids.extend(run_doc_ids)
+                        counts.extend(run_counts)
+                        positions.extend(run_positions)
+                    writer.add_term(term, doc_ids, counts, positions)
+
+                writer.set_documents(self._doc_lengths, self._field_lengths)
+        finally:
+            self._tmp_dir.cleanup()
+
+        return writer
@@ -1,50 +1,34 @@
+import itertools
 import re
+from typing import Iterator
 
+# Matches a whitespace-separated part of the text that contains a token: the
+# characters before the token, the token itself (captured) and the rest of the
+# part, which is ignored. Parts without any token character, like "=", never
+# match. `\s` matches the same characters as `str.split`.
+_TOKEN = re.compile(r"[^\sa-zA-Z0-9']*([a-zA-Z0-9']+)\S*")
 
-def tokenize(path) -> tuple[str, int]:
+
+def tokenize(path) -> Iterator[tuple[str, int]]:
     """
     Returns an iterator of token strings where each token matches
     the following regex: [a-z0-9']+
 
     Returns the token and its position in the document.
     """
-    token_pos = 0
     with open(path, "r") as f:
-        while True:
-            line = f.readline()
-            if not line:
-                break
-
-            # Remove surrounding whitespaces and new lines.
-            line = line.strip()
-
-            if line == "":
-                continue
-
-            # Split on one or more whitespace.
-            parts = line.split()
-
-            for part in parts:
-                capture = re.search(
-                    r"[^a-zA-Z0-9']*([a-zA-Z0-9']+)[^a-zA-Z0-9']*", part
-                )
+        text = f.read()
+    return tokenize_text(text)
 
-                # Tokens like "=" do not match the above regex so we ignore them.
-                if capture is not None:
-                    yield (capture.groups()[0].lower(), token_pos)
-                    token_pos += 1
 
+def tokenize_text(text: str) -> Iterator[tuple[str, int]]:
+    """
+    Tokenizes `text` like `tokenize`.
 
-def tokenize_text(text: str) -> tuple[str, int]:
-    token_pos = 0
-
-    # Split on one or more whitespace.
-    parts = text.strip().split()
-
-    for part in parts:
-        capture = re.search(r"[^a-zA-Z0-9']*([a-zA-Z0-9']+)[^a-zA-Z0-9']*", part)
-
-        # Tokens like "=" do not match the above regex so we ignore them.
-        if capture is not None:
-            yield (capture.groups()[0].lower(), token_pos)
-            token_pos += 1
+    Every whitespace-separated part yields at most one token, the first run of
+    token characters in the part. The whole text is tokenized in a single
+    pass of a compiled regex.
+    """
+    # Tokens are only lowercased after matching, lowercasing the whole text
+    # would turn some non-ASCII characters into token characters.
+    return zip(map(str.lower, _TOKEN.findall(text)), itertools.count())
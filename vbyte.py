@@ -0,0 +1,63 @@
+from typing import Iterable
+
+
+def encode(values: Iterable[int], out: bytearray):
+    """
+    Appends `values` to `out` using variable byte encoding.
+
+    Every value is split into groups of 7 bits, starting with the lowest
+    group. The highest bit of a byte is set if more bytes of the same value
+    follow.
+    """
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode(data: bytes) -> list[int]:
+    """
+    Decodes all variable byte encoded values in `data`.
+    """
+    values = []
+    value = 0
+    shift = 0
+
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+
+    return values
+
+
+def decode_first(data: bytes, offset: int = 0) -> int:
+    """
+    Decodes only the variable byte encoded value starting at `offset` in
+    `data`.
+    """
+    value = 0
+    shift = 0
+    while data[offset] & 0x80:
+        value |= (data[offset] & 0x7F) << shift
+        shift += 7
+        offset += 1
+    return value | (data[offset] << shift)
+
+
+def gaps(values: Iterable[int]) -> list[int]:
+    """
+    Returns the differences between consecutive sorted `values`. The first
+    value is kept as is.
+    """
+    result = []
+    previous = 0
+    for value in values:
+        result.append(value - previous)
+        previous = value
+    return result